@@ -1,16 +1,30 @@
 try:
-    from scapy.all import sniff
-    from scapy import error
-    import scapy_http.http
-    import requests
-    import os
-    import platform
+    import exercise_scapy #Scapy layers are imported on first use
     import time
-    from termcolor import colored, cprint
+    from termcolor import colored
     import threading
+    import socket
+    import select
     import argparse
     import sys
     import exercise_config #Store static settings
+    from exercise_clock import Clock
+    from exercise_pcap import PcapReader
+    from exercise_parser import parse_frame
+    from exercise_pipeline import PacketRing
+    from exercise_shard import ShardCoordinator
+    from exercise_rate import RateWindow
+    from exercise_record import RecordBuilder
+    from exercise_bpf import build_filter
+    from exercise_capture import PacketMmapSocket
+    from exercise_dashboard import DashboardRenderer
+    from exercise_epoch import EpochSwap
+    from exercise_checkpoint import save_checkpoint, load_checkpoint, CheckpointError
+    from exercise_export import MetricsSnapshot, MetricsServer, UdpExporter, parse_address
+    from exercise_profile import Profiler
+    from collections import deque
+    import heapq
+    from operator import attrgetter
     from exercise_statistic import *
     from exercise_state import *
 except ImportError as err:
@@ -19,44 +33,472 @@ except ImportError as err:
 
 class HttpMonitor(object):
 
-    def _callback(self,packet):
+    def _callback_raw(self, frame, linktype, timestamp, interface=None):
         """
-        Callback function invoked by tshark to notify upon new HTTP transaction arrival.
+        Callback function invoked with an undissected frame, decodes it with the configured parser.
 
-        :param packet: packet object received from tshark
+        :param frame: bytes or memoryview of a captured frame
+        :param linktype: pcap link-layer type of the frame
+        :param timestamp: capture time in sec since epoch
+        :param interface: device the frame was captured on, None when replaying
         """
-        response = packet.getlayer(scapy_http.http.HTTPResponse)
-        request = packet.getlayer(scapy_http.http.HTTPRequest)
+        transaction = self._decode(frame, linktype, timestamp)
+        if transaction:
+            self._dispatch(*transaction, interface=interface)
 
-        #Count HTTP request
-        if request:
-            self.request_count += 1
+    def _decode(self, frame, linktype, timestamp):
+        """
+        Dissect a raw frame with Scapy/scapy_http, or with the fast parser, timed as the 'decode' stage
+
+        :return (packet, request, response) tuple, None when the frame carries no HTTP request or response
+        """
+        stage = self._decode_stage
+        started = stage.start()
+        transaction = self._dissect(frame, linktype, timestamp)
+        stage.stop(started)
+        return transaction
+
+    def _dissect(self, frame, linktype, timestamp):
+        if self.parser == 'fast':
+            packet = parse_frame(frame, linktype, timestamp)
+            if packet is None:
+                return None
+            return packet, packet.request, packet.response
+        packet = exercise_scapy.dissection_conf().l2types[linktype](bytes(frame))
+        if not self._is_http(packet):
+            return None
+        packet.time = timestamp
+        http = exercise_scapy.http()
+        return packet, packet.getlayer(http.HTTPRequest), packet.getlayer(http.HTTPResponse)
+
+    def _enqueue(self, frame, linktype, timestamp, interface=None):
+        """
+        Capture side of the pipeline, only buffers the raw frame, dissection runs on consumer workers
+        """
+        self.pipeline.put((frame, linktype, timestamp, interface))
+
+    def _consume(self):
+        """
+        Consumer worker, drain the pipeline in batches until it is closed and empty
+        """
+        while True:
+            batch = self.pipeline.get_batch(self.config.pipeline_batch_size)
+            if batch:
+                self._process_batch(batch)
+            elif self.pipeline.drained():
+                break
+            else:
+                self.pipeline.wait(self.config.timeout)
+
+    def _process_batch(self, batch):
+        """
+        Decode a batch of raw frames into records, then buffer them with the request count in one epoch enter.
+        The next tick hands the whole buffer to each Plug-in in one call.
+
+        :param batch: list of (frame, linktype, timestamp, interface) tuples
+        """
+        records = []
+        request_count = 0
+        learning = self.state.check_state(LearnState) #Skip running Plug-ins during learning mode
+        now = self.clock.time()
+        build = self.record_builder.build
+        stage = self._record_stage
+        for frame, linktype, timestamp, interface in batch:
+            transaction = self._decode(frame, linktype, timestamp)
+            if transaction:
+                if transaction[1]:
+                    request_count += 1
+                if not learning:
+                    started = stage.start()
+                    records.append(build(transaction[0], transaction[1], transaction[2], now, interface))
+                    stage.stop(started)
+        writer = self.epochs.writer()
+        buffer = writer.begin() #One epoch enter per batch, Plug-ins run on the reporting thread
+        try:
+            buffer.request_count += request_count
+            buffer.records.extend(records)
+        finally:
+            writer.end()
+        self.pipeline.mark_processed(len(batch))
+
+    def _dispatch(self, packet, request, response, interface=None):
+        """
+        Count HTTP request and parse the transaction once into a PacketRecord for all StatisticVisitor Plug-ins,
+        both go to the active epoch buffer of the calling thread until the next tick collects them.
+
+        :param packet: Scapy packet, or FastPacket from the fast parser
+        :param request: HTTP request layer, None if absent
+        :param response: HTTP response layer, None if absent
+        :param interface: device the packet was captured on, None when replaying
+        """
+        writer = self.epochs.writer()
+        buffer = writer.begin()
+        try:
+            #Count HTTP request
+            if request:
+                buffer.request_count += 1
+
+            #Skip running Plug-ins during learning mode
+            if self.state.check_state(LearnState):
+                return
+
+            stage = self._record_stage
+            started = stage.start()
+            buffer.records.append(self.record_builder.build(packet, request, response, self.clock.time(), interface))
+            stage.stop(started)
+        finally:
+            writer.end()
+
+    def _collect(self):
+        """
+        Swap epochs, add up request counts and hand records of the frozen buffers to all StatisticVisitor Plug-ins.
+        Records of several threads are merged in capture order, so a response never reaches Plug-ins before its request
+        when both were taken from the ring by different consumers.
+        Reporting side only, Plug-in hits are never changed by capture or consumer threads.
+        """
+        stage = self.profiler.stage('epoch swap', 1)
+        started = stage.start()
+        buffers = self.epochs.swap()
+        stage.stop(started)
+        batches = []
+        for buffer in buffers:
+            self.request_count += buffer.request_count
+            if buffer.records:
+                batches.append(buffer.records)
+            buffer.clear()
+        if len(batches) > 1:
+            batches = [list(heapq.merge(*batches, key=attrgetter('capture_time')))] #Each buffer follows the ring, in capture order
+        for records in batches:
+            for plugin in self.statistic_plugins:
+                stage = self.profiler.stage('plugin '+type(plugin).__name__, 1)
+                started = stage.start()
+                plugin.accept_batch(records)
+                stage.stop(started, len(records))
+
+    @staticmethod
+    def _is_http(packet):
+        """
+        Filter function to keep only packets carrying HTTP request or response
+        """
+        http = exercise_scapy.http()
+        return packet.haslayer(http.HTTPRequest) or packet.haslayer(http.HTTPResponse)
+
+    def _sniff(self, interface):
+        """
+        Capture frames of one interface in a thread until exit_event set, stop() wakes the capture loop up right away.
+        One thread runs per interface, all hand frames to the same pipeline, shards or Plug-ins.
+        """
+        try:
+            if self.shards:
+                handler = self.shards.dispatch #Hand off raw frames to shard worker processes
+            elif self.config.pipeline_workers > 0:
+                handler = self._enqueue #Hand off raw frames to consumer workers
+            else:
+                handler = self._callback_raw
+            if self.capture == 'mmap':
+                self._sniff_mmap(interface, handler, handler != self._callback_raw) #Frames outlive the call when buffered
+            else:
+                self._sniff_raw(interface, handler)
+        except (OSError, ValueError) as err:
+            sys.stderr.write ('Sniffer error on '+interface+': '+str(err)+'\n\r') #Likely triggered by "No such device"
+        except:
+            sys.stderr.write ('Unexpected Sniffer error on '+interface+': '+ str(sys.exc_info()[0])+'\n\r')
 
-        #Skip running Plug-ins during learning mode    
+    def _sniff_mmap(self, interface, handler, copy):
+        """
+        Receive frames from an AF_PACKET TPACKET_V3 ring and pass them to handler, until exit_event set.
+        The kernel filters with the compiled BPF filter, frames are read in place from the ring.
+
+        :param handler: function taking (frame, linktype, timestamp, interface)
+        :param copy: pass frames as bytes instead of memoryview slices of the ring, for handlers keeping them
+        """
+        sock = PacketMmapSocket(interface, self.ports or None, self.config.bpf_prefilter,
+            self.config.capture_block_size, self.config.capture_block_count, self.config.capture_block_timeout)
+        self.capture_sockets[interface] = sock
+        sock.watch(self._wakeup[0].fileno())
+        linktype = sock.linktype
+        try:
+            while not self.exit_event.is_set():
+                for timestamp, frame in sock.recv_frames(self.config.timeout):
+                    handler(bytes(frame) if copy else frame, linktype, timestamp, interface)
+        finally:
+            sock.close()
+
+    def _sniff_raw(self, interface, handler):
+        """
+        Receive undissected frames from a layer 2 socket and pass them to handler, until exit_event set.
+        Reads only once select() reports the socket readable, so a quiet link never blocks shutdown.
+
+        :param handler: function taking (frame, linktype, timestamp, interface)
+        """
+        conf = exercise_scapy.capture_conf()
+        sock = conf.L2listen(iface=interface, promisc=False, filter=self.bpf_filter)
+        readers = [sock, self._wakeup[0]]
+        try:
+            while not self.exit_event.is_set():
+                if sock not in select.select(readers, [], [], self.config.timeout)[0]: #Timeout or woken up by stop()
+                    continue
+                link_layer, frame, timestamp = sock.recv_raw()
+                if frame is None: #Outgoing copy or interrupted read
+                    continue
+                handler(frame, conf.l2types.layer2num.get(link_layer), timestamp, interface)
+        finally:
+            sock.close()
+
+    def stop(self):
+        """
+        Ask capture, consumers and the main loop to exit, safe to call from any thread
+        """
+        self.exit_event.set()
+        try:
+            self._wakeup[1].send(b'\0') #Wake up select()/poll() of the capture loop
+        except OSError: #Already woken up, buffer full or closed
+            pass
+
+    def _tick(self, render=True):
+        """
+        Advance learning, alerting and dashboard countdowns by one <timeout> step
+
+        :param render: draw learning status and dashboard to the console when True
+        :return False when still learning, True when enforcing
+        """
+        #Close the rate bucket of this step, the window slides instead of being reset
+        self._collect()
+        self.rate.add(self.request_count, self.clock.time())
+        self.request_count = 0
+
+        #Learning mode...
         if self.state.check_state(LearnState):
-            return 
+            self.average_learning_countdown-=self.config.timeout
+            if self.average_learning_countdown < 0:
+                self.average_learning_countdown = 0 #Int underflow protection
+            #Calculate average baseline per <average_bucket_size>
+            self.learning_elapsed = self.config.average_learning_duration-self.average_learning_countdown
+            self.learning_count = self.rate.total(self.learning_elapsed)
+            self.average_baseline = round(self.learning_count*self.config.average_bucket_size/self.learning_elapsed)
+
+            #Draw learning status
+            if render:
+                self._render()
+            #Prepare exiting learning
+            if self.average_learning_countdown <= 0:
+                self.average_learning_countdown = self.config.average_learning_duration #Reset learning countdown for next learning
+                if self.average_baseline > 0: #Restart learning when baseline==0
+                    self.state.switch(NormalState) #Set to enforcing mode after finishing learning
+                else:
+                    return False #Skip during learning mode
+            else:
+                return False #Skip during learning mode
+
+        #Enforce mode...
+        self.dashboard_bucket_countdown-=self.config.timeout
+        self.average_bucket_countdown-=self.config.timeout
+
+        #Update Alert status based on the rolling request count of the last <average_bucket_size>,
+        #checked every step for a new alert, every <average_bucket_size> to record or dismiss an ongoing one
+        rolling_count = self.rate.total(self.config.average_bucket_size)
+        if self.average_bucket_countdown <= 0 or (not self.state.check_state(AlertState) and
+                (rolling_count-self.average_baseline)*100/self.average_baseline > self.config.average_threshold):
+            self.average_bucket_countdown = self.config.average_bucket_size #Reset average request countdown 
+            self.process_alert(self.state, rolling_count, self.config.average_threshold, self.average_baseline, self.alert_history, self.clock.time())
+
+        #Refresh top hits snapshot shown on the dashboard
+        if self.dashboard_bucket_countdown <= 0:
+            self.dashboard_bucket_countdown = self.config.dashboard_bucket_size #Reset top-hits countdown
+            self._snapshot_plugins()
+        if render:
+            self._render()
+        return True
 
-        #Calling all StatisticVisitors Plug-ins
+    def _snapshot_plugins(self):
+        """
+        Copy top hits lines and export samples of all StatisticVisitor Plug-ins, then trim aged hits
+        """
+        plugin_lines = []
+        plugin_samples = []
         for plugin in self.statistic_plugins:
-            plugin.accept_packet(packet, request, response)
+            stage = self.profiler.stage('snapshot '+type(plugin).__name__, 1)
+            started = stage.start()
+            plugin_lines.extend(plugin.lines())
+            plugin_samples.extend(plugin.metrics())
+            plugin.trim()
+            stage.stop(started)
+        self.plugin_lines = plugin_lines
+        self.plugin_samples = sorted(plugin_samples, key=lambda sample: sample[0]) #Samples of a metric stay together, in Plug-in order
 
-    def _sniff(self):
+    def _snapshot_metrics(self):
         """
-        Start calling sniff block mode in a thread, wait until exit_event set to exit 
+        Return a MetricsSnapshot of request rate, alert state, internal counters and the last Plug-ins snapshot,
+        must be called under <dispatch_lock>
+        """
+        samples = [
+            ('http_monitor_requests', (('window', str(self.config.average_bucket_size)+'s'),), self.rate.total(self.config.average_bucket_size)),
+            ('http_monitor_request_baseline', (('window', str(self.config.average_bucket_size)+'s'),), self.average_baseline),
+            ('http_monitor_alert_active', (), 1 if self.state.check_state(AlertState) else 0),
+            ('http_monitor_state', (('state', self.state.name),), 1),
+            ('http_monitor_alert_history', (), len(self.alert_history)),
+            ('http_monitor_pipeline_enqueued', (), self.pipeline.enqueued),
+            ('http_monitor_pipeline_processed', (), self.pipeline.processed),
+            ('http_monitor_pipeline_backlog', (), len(self.pipeline)),
+            ('http_monitor_pipeline_dropped', (), self.pipeline.dropped),
+            ('http_monitor_epoch_swaps', (), self.epochs.swaps)
+        ]
+        kernel = [(interface, capture_socket.statistics()) for interface, capture_socket in list(self.capture_sockets.items())]
+        for index, name in enumerate(('http_monitor_kernel_received', 'http_monitor_kernel_dropped', 'http_monitor_kernel_freezes')):
+            samples.extend((name, (('interface', interface),), counters[index]) for interface, counters in kernel)
+        samples.extend(self.plugin_samples)
+        samples.extend(self.profiler.metrics())
+        return MetricsSnapshot(samples, self.clock.time())
+
+    def _open_exporters(self):
+        """
+        Start the metrics endpoint on <metrics_port> and the UDP exporter to <metrics_udp> when configured
         """
         try:
-            sniff(iface=self.interface,
-                promisc=False,
-                filter='tcp and port '+self.filter,
-                lfilter=lambda x: x.haslayer(scapy_http.http.HTTPRequest) or x.haslayer(scapy_http.http.HTTPResponse),
-                prn=self._callback,
-                count=0,
-                stop_filter=lambda p: self.exit_event.is_set()
-            )
+            if self.metrics_port is not None:
+                self.exporters.append(MetricsServer(self.config.metrics_host, self.metrics_port))
+            if self.metrics_udp:
+                host, port = parse_address(self.metrics_udp)
+                self.exporters.append(UdpExporter(host, port, self.config.metrics_udp_packet_size))
+        except (OSError, ValueError) as err:
+            sys.stderr.write('Metrics export disabled: '+str(err)+'\n\r')
+
+    def _export(self):
+        """
+        Take a metrics snapshot under <dispatch_lock> and publish it to exporters outside of it
+        """
+        if not self.exporters:
+            return
+        with self.dispatch_lock:
+            self.metrics = self._snapshot_metrics()
+        stage = self.profiler.stage('export', 1)
+        started = stage.start()
+        for exporter in self.exporters:
+            exporter.publish(self.metrics)
+        stage.stop(started)
+
+    def _learning_lines(self):
+        """
+        Return the lines of the learning status screen
+        """
+        return [
+            colored('<<<Learning mode>>>', 'white', 'on_grey'),
+            "Collected "+colored(str(self.learning_count),'blue')+' HTTP request in '+str(self.learning_elapsed)+'s',
+            "Est. average rate: " + colored(str(self.average_baseline)+'/'+str(self.config.average_bucket_size)+'s', 'blue'),
+            str(self.average_learning_countdown) + 's counting down...'
+        ]
+
+    def _dashboard_lines(self):
+        """
+        Return the lines of baseline, alert status, alert history and the last StatisticVisitor Plug-ins snapshot
+        """
+        #Baseline info
+        lines = ['', '[INFO] Average baseline: '+colored(str(self.average_baseline)+'/'+str(self.config.average_bucket_size)+'s','blue')+', '+
+            'Alert threshold: '+colored(str(self.config.average_threshold)+'%','yellow')+', '+
+            'Current average: '+colored(str(self.rate.total(self.config.average_bucket_size))+'/'+str(self.config.average_bucket_size)+'s','blue')+', '+
+            'Next Alert check in '+colored(str(self.average_bucket_countdown)+'s...','blue')]
+        for interface, capture_socket in list(self.capture_sockets.items()):
+            received, dropped, freezes = capture_socket.statistics()
+            lines.append('[INFO] Kernel '+interface+' received: '+colored(str(received),'blue')+', '+
+                'dropped: '+colored(str(dropped),'red' if dropped else 'blue')+', '+
+                'ring frozen: '+colored(str(freezes),'blue'))
+        if self.config.pipeline_workers > 0 and not self.replaying:
+            lines.append('[INFO] Pipeline enqueued: '+colored(str(self.pipeline.enqueued),'blue')+', '+
+                'processed: '+colored(str(self.pipeline.processed),'blue')+', '+
+                'backlog: '+colored(str(len(self.pipeline)),'blue')+', '+
+                'dropped: '+colored(str(self.pipeline.dropped),'red' if self.pipeline.dropped else 'blue'))
+
+        #Alert status
+        if len(self.alert_history) > 0 and self.state.check_state(NormalState)==False:
+            lines.append('')
+            if self.state.check_state(AlertState):
+                lines.append(colored('<<<Active Alert>>>','red'))
+            elif self.state.check_state(DismissState):
+                lines.append(colored('<<<Alert Dismissed>>>','green'))
+            lines.append("High traffic generated an alert - hits="+colored(str(self.alert_history[0][0]),'yellow')+", triggered at "+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(self.alert_history[0][1])))
+
+        #Trim Alert history, oldest alerts at the right end
+        while len(self.alert_history) > 0:
+            if self.clock.time()-self.alert_history[-1][1] > self.config.max_retention_length:
+                self.alert_history.pop()
+            else:
+                break
+        #Alert history
+        lines.extend(['', colored('<<<Alert History>>>', 'yellow', 'on_grey')])
+        for alert in self.alert_history:
+            lines.append("hits "+colored(str(alert[0]),'yellow')+" at "+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(alert[1])))
+
+        #All StatisticVisitor Plug-ins
+        lines.extend(self.plugin_lines)
+
+        #Hot path profile
+        if self.profile_dashboard:
+            lines.extend(['', colored('<<<Profile>>>', 'white', 'on_grey')]+self.profiler.lines())
+        return lines
+
+    def _frame(self):
+        """
+        Return the lines of the current screen, built under <dispatch_lock> so counters, alerts and hits are consistent
+        """
+        with self.dispatch_lock:
+            if self.state.check_state(LearnState):
+                return self._learning_lines()
+            return self._dashboard_lines()
+
+    def _render(self):
+        """
+        Draw the current screen, only lines changed since the previous frame are written
+        """
+        stage = self.profiler.stage('render', 1)
+        started = stage.start()
+        self.renderer.render(self._frame())
+        stage.stop(started)
+
+    def _render_loop(self):
+        """
+        Renderer thread, redraws the dashboard every <dashboard_render_interval> independently of capture and Plug-ins
+        """
+        while not self.exit_event.wait(self.config.dashboard_render_interval):
+            self._render()
+
+    def _print_dashboard(self):
+        """
+        Print baseline, alert status, alert history and all StatisticVisitor Plug-ins as plain lines,
+        or the learning status when traffic ended before learning completed, e.g. a short capture
+        """
+        with self.dispatch_lock:
+            if self.state.check_state(LearnState):
+                lines = self._learning_lines()[:-1]+['Learning did not complete, '+colored(str(self.average_learning_countdown)+'s','blue')+
+                    ' of '+str(self.config.average_learning_duration)+'s missing, no baseline enforced and no Plug-in statistics collected']
+            else:
+                self._snapshot_plugins()
+                lines = self._dashboard_lines()
+        print('\n'.join(lines))
+
+    def _resume(self):
+        """
+        Restore statistics from <checkpoint_path> and skip learning when the checkpoint is fresh enough
+
+        :return True when resumed
+        """
+        if not self.checkpoint_path:
+            return False
+        try:
+            return load_checkpoint(self, self.checkpoint_path, self.config.checkpoint_max_age)
+        except (OSError, CheckpointError) as err:
+            sys.stderr.write('Checkpoint ignored: '+str(err)+'\n\r')
+            return False
+
+    def _checkpoint(self):
+        """
+        Save statistics to <checkpoint_path>, nothing worth saving while learning
+        """
+        if not self.checkpoint_path or self.state.check_state(LearnState):
+            return
+        try:
+            save_checkpoint(self, self.checkpoint_path)
         except OSError as err:
-            sys.stderr.write ('Sniffer error: '+str(err)+'\n\r') #Likely triggered by "No such device"
-        except:
-            sys.stderr.write ('Unexpected Sniffer error: '+ sys.exc_info()[0]+'\n\r')
+            sys.stderr.write('Checkpoint failed: '+str(err)+'\n\r')
 
     def run(self):
         """
@@ -68,94 +510,131 @@ class HttpMonitor(object):
             -average alert duration
         """
 
-        #Launch new thread for sniffing
-        sniff_thread = threading.Thread(target=self._sniff)
-        sniff_thread.start()
+        #Warm restart from the last checkpoint
+        self._resume()
+        self._open_exporters()
+
+        #Launch shard processes or consumer workers, then new thread for sniffing
+        if self.shard_workers > 0:
+            self.shards = ShardCoordinator(self, self.shard_workers)
+            consumer_threads = []
+        else:
+            consumer_threads = [threading.Thread(target=self._consume) for i in range(self.config.pipeline_workers)]
+        for consumer_thread in consumer_threads:
+            consumer_thread.start()
+        sniff_threads = [threading.Thread(target=self._sniff, args=(interface,)) for interface in self.interfaces]
+        for sniff_thread in sniff_threads:
+            sniff_thread.start()
+        if not self.headless:
+            render_thread = threading.Thread(target=self._render_loop, daemon=True) #Slow terminals never hold up capture or alerting
+            render_thread.start()
         time.sleep(1)
 
         #Update dashboard as long as sniffing up working
-        while sniff_thread.is_alive():
+        while any(sniff_thread.is_alive() for sniff_thread in sniff_threads) and not self.exit_event.is_set():
           try:
-            time.sleep(self.config.timeout)
-
-            #Learning mode...
-            if self.state.check_state(LearnState):
-                self.average_learning_countdown-=self.config.timeout
-                if self.average_learning_countdown < 0:
-                    self.average_learning_countdown = 0 #Int underflow protection
-                #Calculate average baseline per <average_bucket_size>
-                self.average_baseline = round(self.request_count*self.config.average_bucket_size/(self.config.average_learning_duration-self.average_learning_countdown))
-
-                #Print learning status
-                os.system('cls' if platform=='Windows' else 'clear')
-                cprint ('<<<Learning mode>>>', 'white', 'on_grey')
-                print ("Collected "+colored(str(self.request_count),'blue')+' HTTP request in '+str(self.config.average_learning_duration-self.average_learning_countdown)+'s')
-                print ("Est. average rate: " + colored(str(self.average_baseline)+'/'+str(self.config.average_bucket_size)+'s', 'blue'))
-                print (str(self.average_learning_countdown) + 's counting down...')
-                #Prepare exiting learning
-                if self.average_learning_countdown <= 0:
-                    self.request_count = 0 #Reset HTTP request count
-                    self.average_learning_countdown = self.config.average_learning_duration #Reset learning countdown for next learning
-                    if self.average_baseline > 0: #Restart learning when baseline==0
-                        self.state.switch(NormalState) #Set to enforcing mode after finishing learning
-                    else:
-                        continue #Skip during learning mode
-                else:
-                    continue #Skip during learning mode
-
-            #Enforce mode...
-            self.dashboard_bucket_countdown-=self.config.timeout
-            self.average_bucket_countdown-=self.config.timeout
-
-            #Update Alert status based on current request count
-            if self.average_bucket_countdown <= 0:
-                self.average_bucket_countdown = self.config.average_bucket_size #Reset average request countdown 
-                self.process_alert(self.state, self.request_count, self.config.average_threshold, self.average_baseline, self.alert_history)
-                self.request_count = 0 #Reset HTTP request count
-
-            #Update dashboard info on screen
-            if self.dashboard_bucket_countdown <= 0:
-                self.dashboard_bucket_countdown = self.config.dashboard_bucket_size #Reset top-hits countdown
-                #Clean up screen
-                os.system('cls' if platform=='Windows' else 'clear')
-
-                #Print baseline info
-                print ('\n\r[INFO] Average baseline: '+colored(str(self.average_baseline)+'/'+str(self.config.average_bucket_size)+'s','blue')+', '+
-                    'Alert threshold: '+colored(str(self.config.average_threshold)+'%','yellow')+', '+
-                    'Current average: '+colored(str(self.request_count)+'/'+str(self.config.average_bucket_size)+'s','blue')+', '+
-                    'Next Alert check in '+colored(str(self.average_bucket_countdown)+'s...','blue'))
-
-                #Print Alert status
-                if len(self.alert_history) > 0 and self.state.check_state(NormalState)==False:
-                    if self.state.check_state(AlertState):
-                        cprint ('\n\r<<<Active Alert>>>','red')
-                    elif self.state.check_state(DismissState):
-                        cprint ('\n\r<<<Alert Dismissed>>>','green')
-                    print("High traffic generated an alert - hits="+colored(str(self.alert_history[0][0]),'yellow')+", triggered at "+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(self.alert_history[0][1])))
-                    
-                #Trim Alert history
-                while len(self.alert_history) > 0:
-                    if time.time()-self.alert_history[len(self.alert_history)-1][1] > self.config.max_retention_length:
-                        self.alert_history.pop()
-                    else:
-                        break
-                #Print Alert history
-                cprint ('\n\r<<<Alert History>>>', 'yellow', 'on_grey')
-                for alert in self.alert_history:
-                    print("hits "+colored(str(alert[0]),'yellow')+" at "+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(alert[1])))
-                    
-                #Print All StatisticVisitor Plug-ins
-                for plugin in self.statistic_plugins:
-                    plugin.print()
-
+            if self.exit_event.wait(self.config.timeout):
+                break
+            if self.shards:
+                self.shards.sync(self.config.timeout) #Merge shard statistics before alerting on them
+            with self.dispatch_lock: #Renderer sees the step either before or after
+                self._tick(render=False)
+            self._export()
+            self.checkpoint_countdown-=self.config.timeout
+            if self.checkpoint_countdown <= 0:
+                self.checkpoint_countdown = self.config.checkpoint_interval #Reset checkpoint countdown
+                self._checkpoint()
           except KeyboardInterrupt:
-            self.exit_event.set()
-            requests.get('http://www.bbc.com')
-            sniff_thread.join()
             break
+        self._shutdown(sniff_threads, consumer_threads)
+
+    def _shutdown(self, sniff_threads, consumer_threads):
+        """
+        Stop capture, drain consumers and shards for at most <shutdown_timeout> sec each, then flush final statistics
+        """
+        self.stop()
+        deadline = time.time()+self.config.shutdown_timeout
+        for sniff_thread in sniff_threads:
+            sniff_thread.join(max(0, deadline-time.time()))
+
+        #Let consumers drain what was captured, whatever is left after the timeout is dropped and counted
+        self.pipeline.close()
+        deadline = time.time()+self.config.shutdown_timeout
+        for consumer_thread in consumer_threads:
+            consumer_thread.join(max(0, deadline-time.time()))
+        if any(consumer_thread.is_alive() for consumer_thread in consumer_threads):
+            self.pipeline.discard()
+            for consumer_thread in consumer_threads:
+                consumer_thread.join()
+        if self.shards:
+            self.shards.sync(self.config.shutdown_timeout)
+            self.shards.stop(self.config.shutdown_timeout)
+
+        #Final statistics on screen and in the checkpoint, next start resumes from here
+        with self.dispatch_lock:
+            self._collect()
+            if not self.state.check_state(LearnState):
+                self._snapshot_plugins()
+        if not self.headless:
+            self._render()
+        self._export()
+        for exporter in self.exporters:
+            exporter.close()
+        self._checkpoint()
+
+    def enable_profiling(self):
+        """
+        Instrument stages and Plug-ins even with <profile_enabled> off, e.g. for --profile
+        """
+        if not self.profiler.enabled:
+            self.profiler = Profiler(self.config.profile_sample_interval)
+            self._decode_stage = self.profiler.stage('decode')
+            self._record_stage = self.profiler.stage('record')
+
+    def replay(self, path, render=False):
+        """
+        Feed a pcap file through the same filter, callback and Plug-ins as live sniffing, as fast as possible.
+        The clock follows packet timestamps so learning, alerting and retention behave as they did on the wire.
+
+        :param path: path to a libpcap capture file
+        :param render: print learning status and dashboard on every tick when True
+        :return number of packets read from the file
+        """
+        packet_count = 0
+        next_tick = None
+        self.replaying = True
+        if self.shard_workers > 0:
+            self.shards = ShardCoordinator(self, self.shard_workers, replay=True)
+            handler = self.shards.dispatch
+        else:
+            handler = self._callback_raw #Inline, ticks must see packets in capture order
+        try:
+            with PcapReader(path) as reader:
+                for timestamp, frame in reader:
+                    packet_count += 1
+                    if next_tick is None:
+                        next_tick = timestamp + self.config.timeout
+                    while timestamp >= next_tick: #Catch up all ticks elapsed between packets
+                        self.clock.advance(next_tick)
+                        if self.shards:
+                            self.shards.sync() #Workers catch up to this tick before alerting
+                        self._tick(render)
+                        next_tick += self.config.timeout
+                    self.clock.advance(timestamp)
+                    handler(frame, reader.linktype, timestamp)
+                    del frame #Release memory map slice
+            if self.shards:
+                self.shards.sync()
+            with self.dispatch_lock:
+                self._collect() #Statistics of the last partial step
+        finally:
+            if self.shards:
+                self.shards.stop()
+                self.shards = None
+        return packet_count
 
     @staticmethod
-    def process_alert(_state, _request_count, _average_threshold, _average_baseline, _alert_history):
+    def process_alert(_state, _request_count, _average_threshold, _average_baseline, _alert_history, _now=None):
         """
         Calculate current rate against threshold, manage alert state transitioning when needed.
 
@@ -163,14 +642,19 @@ class HttpMonitor(object):
         :param _request_count: current request count
         :param _average_threshold: alerting threshold from configuration
         :param _average_baseline: baseline learned
-        :param _alert_history: array holding the history of alerts in reverse order
+        :param _alert_history: deque or list holding the history of alerts in reverse order
+        :param _now: alert timestamp, defaults to time.time()
 
         :return Delta in percentage between baseline rate and the current rate
         """
         average_delta = (_request_count-_average_baseline)*100/_average_baseline #Percentage of baseline delta
         if average_delta > _average_threshold: 
             _state.switch(AlertState) #Set alert to active
-            _alert_history.insert(0, [_request_count, time.time()])
+            alert = [_request_count, time.time() if _now is None else _now]
+            if isinstance(_alert_history, deque):
+                _alert_history.appendleft(alert) #Bounded, drops the oldest alert when full
+            else:
+                _alert_history.insert(0, alert)
         else:
             if _state.check_state(AlertState): 
                 _state.switch(DismissState) #Set enforce_alert -> enforce_dismiss
@@ -178,33 +662,74 @@ class HttpMonitor(object):
                 _state.switch(NormalState)
         return average_delta
 
-    def __init__(self, interface, filter):
+    def __init__(self, interface, filter, parser=None, workers=None):
         """
         Intialize member variables
         """
         #Fetch configurations
         self.config = exercise_config.Config
         self.interface = interface
+        self.interfaces = interface.split(',') if interface else [] #Devices captured concurrently, comma separated
         self.filter = filter
+        self.ports = [int(port) for port in filter.split(',')] if filter else [] #TCP ports of HTTP traffic, comma separated
+        self.parser = parser if parser else self.config.parser #'scapy' full dissection, or 'fast' raw HTTP head parsing
+        if self.parser == 'scapy':
+            exercise_scapy.bind_http_ports(self.ports) #Loads Scapy, the fast parser never does
+        self.bpf_filter = build_filter(filter, self.config.bpf_prefilter) if filter else None #Kernel capture filter, only HTTP heads with prefilter
+        self.shard_workers = self.config.shard_workers if workers is None else workers #Worker processes sharding flows, 0 processes in this process
+        self.capture = self.config.capture_backend #'scapy' capture socket, or 'mmap' AF_PACKET ring
+        self.capture_sockets = {} #Interface -> PacketMmapSocket while capturing with the 'mmap' backend
+        self.checkpoint_path = self.config.checkpoint_path #Checkpoint file of run(), None disables warm restart
+        self.metrics_port = self.config.metrics_port #Port of the metrics endpoint of run(), None disables it
+        self.metrics_udp = self.config.metrics_udp #'host:port' line protocol collector of run(), None disables it
+        self.headless = False #run() exports metrics without drawing the dashboard
+        self.replaying = False #Set by replay(), packets are processed inline and live capture counters stay empty
 
         #Run-time variables
         self.average_baseline = 0 #average HTTP request rate baseline per <average_bucket_size>
         self.average_bucket_countdown = self.config.average_bucket_size #countdown in sec when to refresh average request per <average_bucket_size>
         self.dashboard_bucket_countdown = self.config.dashboard_bucket_size #countdown in sec when to refresh top-hits list
         self.average_learning_countdown = self.config.average_learning_duration #countdown in sec when to stop learning average request baseline
-        self.request_count = 0 #Tracking Http Request count
+        self.checkpoint_countdown = self.config.checkpoint_interval #countdown in sec when to save the next checkpoint
+        self.request_count = 0 #Tracking Http Request count since last <timeout> step, collected from <epochs> on each tick
+        self.epochs = EpochSwap() #Request counts and records buffered per capture thread, swapped on each tick
+        self.rate = RateWindow(max(self.config.average_bucket_size, self.config.average_learning_duration), self.config.timeout) #Per step request counts, rolling rate over any window
         self.state = LearnState() #Starts with learning states
-        self.alert_history = [] #Stores all history alerts, aged data greater than <Config.max_retention_length> are periodically removed
+        self.alert_history = deque(maxlen=self.config.max_alert_history) #Stores history alerts newest first, aged data greater than <Config.max_retention_length> are periodically removed
         self.exit_event = threading.Event()
+        self._wakeup = socket.socketpair() #stop() writes to wake up the capture loop blocked in select()/poll()
+        self._wakeup[1].setblocking(False)
+        self.clock = Clock() #Wall clock when sniffing, packet clock when replaying
+        self.pipeline = PacketRing(self.config.pipeline_capacity) #Raw frames buffered between capture and consumer workers
+        self.dispatch_lock = threading.Lock() #Held by the reporting side while ticking, merging shards or building a frame
+        self.shards = None #ShardCoordinator while running with <shard_workers> processes
+        self.record_builder = RecordBuilder(self.config) #Decodes fields once per packet for all Plug-ins
+        self.learning_count = 0 #HTTP request count collected so far in learning mode
+        self.learning_elapsed = 0 #Sec elapsed in learning mode
+        self.plugin_lines = [] #Top hits lines of all Plug-ins, refreshed every <dashboard_bucket_size>
+        self.renderer = DashboardRenderer() #Diff based console output, no screen clearing
+        self.plugin_samples = [] #Export samples of all Plug-ins, refreshed with <plugin_lines>
+        self.metrics = None #Last MetricsSnapshot handed to exporters
+        self.exporters = [] #MetricsServer and UdpExporter opened by run()
+        self.profiler = Profiler(self.config.profile_sample_interval, self.config.profile_enabled) #Call counters and sampled timing per stage and Plug-in
+        self.profile_dashboard = self.config.profile_dashboard #Show the profiler stages on the dashboard, set by --profile
+        self._decode_stage = self.profiler.stage('decode') #Per packet stages, looked up once
+        self._record_stage = self.profiler.stage('record')
 
         #Include Plug-in classes to use
         self.statistic_plugins = [ #A list of statistic plug-ins currently available, aged data greater than <Config.max_retention_length> are periodically removed
-            TopHitsBySection(self.config),           #Count by uniuqe Section
-            TopHitsByHost(self.config),              #Count by unique Domain
-            TopHitsUploadByHost(self.config),        #Request data volume by unique Domain
-            TopHitsByUserAgent(self.config),         #Count by uniuqe User-Agent
-            TopHitsByHttpMethod(self.config),        #Count by uniuqe Http Method
-            TopHitsByStatusCode(self.config)         #Count by unique Status line
+            TopHitsBySection(self.config, self.clock),           #Count by uniuqe Section
+            TopHitsByHost(self.config, self.clock),              #Count by unique Domain
+            TopHitsUploadByHost(self.config, self.clock),        #Request data volume by unique Domain
+            TopHitsByUserAgent(self.config, self.clock),         #Count by uniuqe User-Agent
+            TopHitsByHttpMethod(self.config, self.clock),        #Count by uniuqe Http Method
+            TopHitsByStatusCode(self.config, self.clock),        #Count by unique Status line
+            ResponseTimeByHost(self.config, self.clock),         #Response time percentiles by unique Domain
+            ResponseTimeBySection(self.config, self.clock),      #Response time percentiles by unique Section
+            TopHitsByInterface(self.config, self.clock),         #Count by capture interface
+            TopHitsByPort(self.config, self.clock),              #Count by server port
+            DistinctClientsByHost(self.config, self.clock),      #Estimated distinct client addresses by unique Domain
+            DistinctPathsByHost(self.config, self.clock)         #Estimated distinct paths by unique Domain
         ]
 
 if __name__ == '__main__':
@@ -213,11 +738,48 @@ if __name__ == '__main__':
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description="This program monitors HTTP traffic, print information and reports alert.",
     )
-    parser.add_argument("--interface", "-i", help="Which interface to sniff on.", default="eth0")
-    parser.add_argument("--port", "-p", help="Which port to sniff on HTTP traffic.", default="80")
+    parser.add_argument("--interface", "-i", help="Which interface to sniff on, several separated by commas, e.g. eth0,eth1.", default="eth0")
+    parser.add_argument("--port", "-p", help="Which port to sniff on HTTP traffic, several separated by commas, e.g. 80,8080,8000.", default="80")
+    parser.add_argument("--read", "-r", help="Replay a pcap file instead of sniffing on the interface.", default=None)
+    parser.add_argument("--parser", choices=['scapy', 'fast'], help="Dissect packets with Scapy, or parse HTTP heads from raw bytes.", default=exercise_config.Config.parser)
+    parser.add_argument("--workers", "-w", type=int, help="Worker processes sharding flows by 5-tuple hash, 0 to process in a single process.", default=exercise_config.Config.shard_workers)
+    parser.add_argument("--capture", choices=['scapy', 'mmap'], help="Capture through Scapy, or a Linux AF_PACKET TPACKET_V3 memory mapped ring.", default=exercise_config.Config.capture_backend)
+    parser.add_argument("--checkpoint", "-c", help="Checkpoint file to resume from and save statistics to, omitted to always learn from scratch.", default=exercise_config.Config.checkpoint_path)
+    parser.add_argument("--metrics-port", type=int, help="Serve metrics in the text exposition format on http://<metrics_host>:<port>/metrics.", default=exercise_config.Config.metrics_port)
+    parser.add_argument("--metrics-udp", help="Send metrics as line protocol in UDP datagrams to host:port.", default=exercise_config.Config.metrics_udp)
+    parser.add_argument("--headless", action="store_true", help="Do not draw the dashboard, only export metrics.")
+    parser.add_argument("--window", type=int, help="Sec of recent traffic the dashboard top hits cover, instead of counts since a key was first seen.", default=exercise_config.Config.dashboard_window)
+    parser.add_argument("--profile", nargs='?', const='-', help="Show time spent per stage and Plug-in on the dashboard, and write a summary to the file, or stdout, at exit.", default=None)
     args = parser.parse_args()
     
     #Create HttpMonitor with sniffing parameters
-    monitor = HttpMonitor(args.interface, args.port)
-    #start sniffing now...
-    monitor.run()
+    monitor = HttpMonitor(args.interface, args.port, args.parser, args.workers)
+    monitor.checkpoint_path = args.checkpoint
+    monitor.capture = args.capture
+    monitor.metrics_port = args.metrics_port
+    monitor.metrics_udp = args.metrics_udp
+    monitor.headless = args.headless
+    if args.profile:
+        monitor.enable_profiling()
+    for plugin in monitor.statistic_plugins:
+        plugin.window = args.window
+    if args.read:
+        #replay capture file offline...
+        try:
+            monitor.replay(args.read)
+            monitor._print_dashboard() #Final statistics of the capture
+        except (OSError, ValueError) as err:
+            sys.stderr.write ('Replay error: '+str(err)+'\n\r')
+            exit(1)
+    else:
+        #start sniffing now...
+        if args.profile:
+            monitor.profile_dashboard = True
+        monitor.run()
+    if args.profile:
+        #Time spent per stage and Plug-in...
+        if args.profile == '-':
+            monitor.profiler.summary()
+        else:
+            with open(args.profile, 'w') as f:
+                monitor.profiler.summary(f)
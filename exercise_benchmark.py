@@ -0,0 +1,279 @@
+"""
+Benchmark the HttpMonitor hot path by replaying a pcap file as fast as possible
+"""
+try:
+    import sys
+    import os
+    import time
+    import tempfile
+    import argparse
+    import subprocess
+    import scapy_http.http
+    import exercise_scapy
+    from exercise import HttpMonitor
+    from exercise_pcap import PcapReader
+    from exercise_parser import parse_frame
+    from exercise_hits import ExactHits
+    from exercise_bpf import prefilter_match
+    import exercise_config
+    from exercise_state import *
+    from gen_traffic import TrafficProfile, write_pcap
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+def synthesize_pcap(path, count, start=1500000000.0, interval=0.001, hosts=20, paths=200, user_agents=10, append=False, segments=False):
+    """
+    Write a capture file of <count> HTTP request/response pairs every <interval> sec with gen_traffic.write_pcap,
+    each response half an interval after its request
+
+    :param path: output pcap file
+    :param append: add packets to an existing capture file
+    :param segments: wrap each pair in a full TCP exchange, handshake, ACKs, body segment and FIN, as seen on the wire
+    :return number of packets written
+    """
+    pairs = write_pcap(path, TrafficProfile(1.0/interval), float('inf'), count, start, interval/2, hosts=hosts, paths=paths, user_agents=user_agents,
+        append=append, segments=segments)
+    return pairs*(9 if segments else 2) #Frames per pair
+
+class PluginTimer(object):
+    """
+    Wrap a StatisticVisitor Plug-in's accept_batch to accumulate its cost and the number of records it processed
+    """
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.calls = 0 #Records, not batches
+        self.elapsed = 0.0
+        self._accept_batch = plugin.accept_batch
+        plugin.accept_batch = self.accept_batch
+
+    def accept_batch(self, records):
+        start = time.perf_counter()
+        self._accept_batch(records)
+        self.elapsed += time.perf_counter()-start
+        self.calls += len(records)
+
+PARSER_FIELDS = ('Method', 'Path', 'Host', 'User-Agent', 'Status-Line') #Fields read by Plug-ins
+
+def _scapy_fields(frame, link_layer):
+    packet = link_layer(bytes(frame))
+    if not HttpMonitor._is_http(packet):
+        return None
+    layer = packet.getlayer(scapy_http.http.HTTPRequest) or packet.getlayer(scapy_http.http.HTTPResponse)
+    return dict((name, layer.fields[name]) for name in PARSER_FIELDS if name in layer.fields)
+
+def _fast_fields(frame, linktype):
+    packet = parse_frame(frame, linktype)
+    if packet is None:
+        return None
+    layer = packet.request or packet.response
+    return dict((name, layer.fields[name]) for name in PARSER_FIELDS if name in layer.fields)
+
+def bench_parser(path):
+    """
+    Parse every frame of a capture with Scapy/scapy_http and with the fast parser, compare speed and output
+
+    :return dictionary of measured figures
+    """
+    result = {'packets': 0, 'http': 0, 'mismatches': 0, 'scapy': 0.0, 'fast': 0.0}
+    with PcapReader(path) as reader:
+        link_layer = exercise_scapy.dissection_conf().l2types[reader.linktype]
+        for timestamp, frame in reader:
+            start = time.perf_counter()
+            expected = _scapy_fields(frame, link_layer)
+            middle = time.perf_counter()
+            actual = _fast_fields(frame, reader.linktype)
+            result['fast'] += time.perf_counter()-middle
+            result['scapy'] += middle-start
+            result['packets'] += 1
+            result['http'] += 1 if expected else 0
+            result['mismatches'] += 1 if expected != actual else 0
+            del frame
+    return result
+
+def bench_prefilter(path, port='80'):
+    """
+    Count frames of a capture passing the plain port filter and the HTTP head prefilter, check no HTTP head is lost
+
+    :return dictionary of measured figures
+    """
+    result = {'packets': 0, 'port': 0, 'prefilter': 0, 'http': 0, 'missed': 0}
+    with PcapReader(path) as reader:
+        for timestamp, frame in reader:
+            result['packets'] += 1
+            result['port'] += 1 if prefilter_match(frame, reader.linktype, int(port), False) else 0
+            passed = prefilter_match(frame, reader.linktype, int(port))
+            result['prefilter'] += 1 if passed else 0
+            if parse_frame(frame, reader.linktype):
+                result['http'] += 1
+                result['missed'] += 0 if passed else 1
+            del frame
+    return result
+
+def bench_replay(path, port='80', parser='scapy', workers=0):
+    """
+    Replay a capture file in enforce mode and report throughput and per Plug-in cost
+
+    :return dictionary of measured figures
+    """
+    monitor = HttpMonitor(None, port, parser, workers)
+    monitor.state = NormalState() #Skip learning, run every Plug-in on every packet
+    monitor.average_baseline = 1
+    timers = [PluginTimer(plugin) for plugin in monitor.statistic_plugins]
+    start = time.perf_counter()
+    packet_count = monitor.replay(path)
+    elapsed = time.perf_counter()-start
+    return {
+        'packets': packet_count,
+        'requests': sum(value[0] for value in monitor.statistic_plugins[4].hits.values()), #Every request has a Method
+        'elapsed': elapsed,
+        'plugins': [(type(timer.plugin).__name__, timer.calls, timer.elapsed) for timer in timers]
+    }
+
+def _legacy_refresh(hits, max_top_hits, now, max_retention_length):
+    """
+    Dashboard refresh before incremental top view, sort whole table by count then by last seen
+    """
+    top = sorted(hits.items(), key=lambda kv: (kv[1][0],kv[1][1]), reverse=True)[:max_top_hits]
+    trim_hits = sorted(hits.items(), key=lambda kv: (kv[1][1]))
+    while len(trim_hits) > 0:
+        if now-trim_hits[0][1][1] > max_retention_length:
+            hits.pop(trim_hits[0][0])
+            trim_hits.pop(0)
+        else:
+            break
+    return top
+
+def bench_refresh(key_counts, refreshes=20):
+    """
+    Compare cost of one dashboard refresh (top N + retention) of a plain dictionary against ExactHits as key count grows
+
+    :return list of (key count, legacy sec per refresh, incremental sec per refresh)
+    """
+    config = exercise_config.Config
+    results = []
+    for key_count in key_counts:
+        legacy = {}
+        hits = ExactHits(config)
+        for last_seen in range(key_count): #Zipf-like counts spread over time, 1% of keys expire before each refresh
+            i = last_seen*7919 % key_count
+            key = '/section%d' % i
+            legacy[key] = [key_count//(i+1), last_seen]
+            hits.add(key, key_count//(i+1), last_seen)
+        now = key_count + config.max_retention_length
+        step = max(1, key_count//100)
+        elapsed = [0.0, 0.0]
+        for refresh in range(refreshes):
+            now_refresh = now + refresh*step
+            start = time.perf_counter()
+            expected = _legacy_refresh(legacy, config.max_top_hits, now_refresh, config.max_retention_length)
+            middle = time.perf_counter()
+            actual = hits.top(config.max_top_hits)
+            hits.expire(now_refresh-config.max_retention_length)
+            elapsed[1] += time.perf_counter()-middle
+            elapsed[0] += middle-start
+            assert [key for key, value in expected] == [key for key, value in actual]
+        assert len(legacy) == len(hits)
+        results.append((key_count, elapsed[0]/refreshes, elapsed[1]/refreshes))
+    return results
+
+PEAK_RSS = ('import resource, sys\n'
+    'def peak_rss():\n'
+    '    try:\n'
+    '        return [int(line.split()[1]) for line in open("/proc/self/status") if line.startswith("VmHWM:")][0]\n'
+    '    except (OSError, IndexError):\n'
+    '        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n') #Peak RSS in KB of the process image, ru_maxrss survives exec on Linux
+STARTUP_SCRIPTS = [ #(title, python code printing its peak RSS in KB), run in a fresh interpreter each
+    ('interpreter', PEAK_RSS+'print(peak_rss())'),
+    ('scapy.all + requests', PEAK_RSS+'import scapy.all, requests; print(peak_rss())'),
+    ('first packet, scapy parser', PEAK_RSS+'from exercise import HttpMonitor; HttpMonitor(None, sys.argv[2], "scapy", 0).replay(sys.argv[1]); print(peak_rss())'),
+    ('first packet, fast parser', PEAK_RSS+'from exercise import HttpMonitor; HttpMonitor(None, sys.argv[2], "fast", 0).replay(sys.argv[1]); print(peak_rss())')
+]
+
+def bench_startup(port='80', runs=3):
+    """
+    Measure time from process start until the first packet went through the Plug-ins, and memory at that point.
+    Each run starts a fresh interpreter replaying a capture of one request/response pair, best of <runs> is kept.
+
+    :return list of (title, sec, peak RSS in KB)
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    fd, path = tempfile.mkstemp(suffix='.pcap')
+    os.close(fd)
+    try:
+        synthesize_pcap(path, 1)
+        commands = [('exercise.py --help', [sys.executable, os.path.join(here, 'exercise.py'), '--help'], False)]
+        commands += [(title, [sys.executable, '-c', script, path, port], True) for title, script in STARTUP_SCRIPTS]
+        results = []
+        for title, command, reports_rss in commands:
+            best = None
+            for run in range(runs):
+                start = time.perf_counter()
+                output = subprocess.run(command, cwd=here, stdout=subprocess.PIPE, check=True).stdout
+                elapsed = time.perf_counter()-start
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, int(output.split()[-1]) if reports_rss else None)
+            results.append((title, best[0], best[1]))
+        return results
+    finally:
+        os.remove(path)
+
+def print_report(title, result):
+    print('<<<'+title+'>>>')
+    print('packets: %d, requests: %d, elapsed: %.3fs' % (result['packets'], result['requests'], result['elapsed']))
+    print('packets/sec: %.0f, requests/sec: %.0f' % (result['packets']/result['elapsed'], result['requests']/result['elapsed']))
+    for name, calls, elapsed in result['plugins']:
+        print('  %-24s %8d records %8.3fs %6.2fus/record' % (name, calls, elapsed, elapsed*1000000/calls if calls else 0))
+
+if __name__ == '__main__':
+    #Parse out commandline arguments
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="This program benchmarks HTTP monitoring throughput by replaying a pcap file.",
+    )
+    parser.add_argument("--read", "-r", help="Pcap file to replay, a synthetic capture is generated when omitted.", default=None)
+    parser.add_argument("--port", "-p", help="Which port carries HTTP traffic.", default="80")
+    parser.add_argument("--count", "-n", type=int, help="Number of request/response pairs of the synthetic capture.", default=10000)
+    parser.add_argument("--parser", choices=['scapy', 'fast', 'both'], help="Packet parser used by the replay benchmark.", default='both')
+    parser.add_argument("--segments", action='store_true', help="Synthetic capture includes handshakes, ACKs and body segments.")
+    parser.add_argument("--refresh", type=int, nargs='*', help="Only run the dashboard refresh benchmark with these key counts, e.g. --refresh 1000 100000.", default=None)
+    parser.add_argument("--startup", action='store_true', help="Only run the startup benchmark, time to first packet and memory of a fresh process.")
+    parser.add_argument("--workers", "-w", type=int, nargs='*', help="Also replay with these numbers of shard worker processes, e.g. -w 1 2 4.", default=[])
+    args = parser.parse_args()
+
+    if args.refresh:
+        print('<<<Dashboard refresh, sec per refresh>>>')
+        for key_count, legacy, incremental in bench_refresh(args.refresh):
+            print('keys: %8d, full sort: %.6fs, incremental: %.6fs, speedup: %.0fx' % (key_count, legacy, incremental, legacy/incremental))
+        exit(0)
+
+    if args.startup:
+        print('<<<Startup, best of 3 fresh processes>>>')
+        for title, elapsed, rss in bench_startup(args.port):
+            print('%-28s %.3fs' % (title, elapsed)+(' peak RSS: %dKB' % rss if rss else ''))
+        exit(0)
+
+    path = args.read
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        synthesize_pcap(path, args.count, segments=args.segments)
+    try:
+        for name in ['scapy', 'fast'] if args.parser == 'both' else [args.parser]:
+            print_report('Replay throughput, '+name+' parser', bench_replay(path, args.port, name))
+        for workers in args.workers:
+            for name in ['scapy', 'fast'] if args.parser == 'both' else [args.parser]:
+                result = bench_replay(path, args.port, name, workers)
+                print('<<<Replay throughput, '+name+' parser, '+str(workers)+' shard workers>>>')
+                print('packets/sec: %.0f, requests/sec: %.0f' % (result['packets']/result['elapsed'], result['requests']/result['elapsed']))
+        result = bench_prefilter(path, args.port)
+        print('<<<BPF prefilter, frames crossing into Python>>>')
+        print('packets: %d, port filter: %d, HTTP head prefilter: %d (%.0f%% fewer), HTTP heads: %d, missed: %d' % (result['packets'],
+            result['port'], result['prefilter'], 100-result['prefilter']*100.0/result['port'] if result['port'] else 0, result['http'], result['missed']))
+        result = bench_parser(path)
+        print('<<<Parser comparison>>>')
+        print('packets: %d, http: %d, mismatches: %d' % (result['packets'], result['http'], result['mismatches']))
+        print('scapy: %.3fs, fast: %.3fs, speedup: %.1fx' % (result['scapy'], result['fast'], result['scapy']/result['fast']))
+    finally:
+        if args.read is None:
+            os.remove(path)
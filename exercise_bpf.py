@@ -0,0 +1,196 @@
+"""
+Build the BPF capture filter, optionally pre-filtering TCP segments that do not start a HTTP message in the kernel
+"""
+try:
+    import sys
+    from exercise_parser import locate_tcp_payload, REQUEST_METHODS
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+TCP_PAYLOAD = 'tcp[((tcp[12:1] & 0xf0) >> 2):4]' #First 4 bytes after the TCP header, IPv4 only in libpcap
+HTTP_TOKENS = sorted(set((method+b' ')[:4] for method in REQUEST_METHODS) | set([b'HTTP'])) #'GET ', 'POST', 'HTTP', ...
+
+def _ports(port):
+    """
+    Return a tuple of int port numbers from an int or a list of ints
+    """
+    return (port,) if isinstance(port, int) else tuple(port)
+
+def build_filter(port, prefilter=True, tokens=HTTP_TOKENS):
+    """
+    Return BPF expression selecting HTTP traffic on port
+
+    :param port: TCP port number as a string, several separated by commas, or a list of port strings
+    :param prefilter: only accept segments whose payload starts with one of tokens when True, ACKs and body segments
+        never reach userspace. IPv6 is passed unfiltered since libpcap cannot index TCP payload over IPv6.
+    :param tokens: 4 byte payload prefixes to accept
+    """
+    ports = port.split(',') if isinstance(port, str) else [str(each) for each in port]
+    if len(ports) == 1:
+        expression = 'tcp and port '+ports[0]
+    else:
+        expression = 'tcp and ('+' or '.join('port '+each for each in ports)+')'
+    if not prefilter:
+        return expression
+    matches = ' or '.join(TCP_PAYLOAD+' = 0x'+token.hex() for token in tokens)
+    return expression+' and (ip6 or '+matches+')'
+
+def prefilter_match(frame, linktype, port, prefilter=True, tokens=HTTP_TOKENS):
+    """
+    Evaluate the expression of build_filter in Python, used to replay captures and measure the filter
+
+    :param port: TCP port number as an int, or a list of them
+    :return True when the kernel would pass the frame to userspace
+    """
+    located = locate_tcp_payload(frame, linktype)
+    if located is None:
+        return False
+    info, start, end = located
+    ports = _ports(port)
+    if info.sport not in ports and info.dport not in ports:
+        return False
+    if not prefilter or len(info.src) == 16: #IPv6 passes unfiltered
+        return True
+    return end-start >= 4 and bytes(frame[start:start+4]) in tokens
+
+#Classic BPF opcodes used by compile_filter, see linux/filter.h
+BPF_LD_H_ABS = 0x28 #A = u16 at [k]
+BPF_LD_B_ABS = 0x30 #A = u8 at [k]
+BPF_LD_W_IND = 0x40 #A = u32 at [X+k]
+BPF_LD_H_IND = 0x48 #A = u16 at [X+k]
+BPF_LD_B_IND = 0x50 #A = u8 at [X+k]
+BPF_LDX_B_MSH = 0xb1 #X = 4*([k]&0xf)
+BPF_ALU_AND_K = 0x54
+BPF_ALU_RSH_K = 0x74
+BPF_ALU_ADD_X = 0x0c
+BPF_MISC_TAX = 0x07 #X = A
+BPF_JMP_JEQ_K = 0x15
+BPF_JMP_JSET_K = 0x45
+BPF_RET_K = 0x06
+SNAPLEN = 262144
+
+def compile_filter(port, prefilter=True, tokens=HTTP_TOKENS, linktype=1):
+    """
+    Compile the expression of build_filter to classic BPF instructions without libpcap, for SO_ATTACH_FILTER
+
+    :param port: TCP port number as an int, or a list of them
+    :param linktype: 1 for Ethernet frames, 101 for raw IP packets
+    :return list of (code, jt, jf, k) instructions
+    """
+    ports = _ports(port)
+    if linktype == 1:
+        link = 14
+        program = [
+            (BPF_LD_H_ABS, 0, 0, 12), #Ethertype
+            (BPF_JMP_JEQ_K, 'ipv6', 0, 0x86dd),
+            (BPF_JMP_JEQ_K, 'ipv4', 'reject', 0x0800)
+        ]
+    elif linktype == 101:
+        link = 0
+        program = [
+            (BPF_LD_B_ABS, 0, 0, 0), #IP version
+            (BPF_ALU_RSH_K, 0, 0, 4),
+            (BPF_JMP_JEQ_K, 'ipv6', 0, 6),
+            (BPF_JMP_JEQ_K, 'ipv4', 'reject', 4)
+        ]
+    else:
+        raise ValueError('unsupported link type %d' % linktype)
+    program += [
+        'ipv4',
+        (BPF_LD_B_ABS, 0, 0, link+9), #Protocol
+        (BPF_JMP_JEQ_K, 0, 'reject', 6),
+        (BPF_LD_H_ABS, 0, 0, link+6), #Fragment offset, TCP header only in the first fragment
+        (BPF_JMP_JSET_K, 'reject', 0, 0x1fff),
+        (BPF_LDX_B_MSH, 0, 0, link), #X = IP header length
+        (BPF_LD_H_IND, 0, 0, link) #Source port
+    ]
+    program += _match_ports(ports, 'ipv4_port', 0)
+    program.append((BPF_LD_H_IND, 0, 0, link+2)) #Destination port
+    program += _match_ports(ports, 'ipv4_port', 'reject')
+    program += [
+        'ipv4_port'
+    ]
+    if prefilter:
+        program += [
+            (BPF_LD_B_IND, 0, 0, link+12), #TCP data offset
+            (BPF_ALU_AND_K, 0, 0, 0xf0),
+            (BPF_ALU_RSH_K, 0, 0, 2),
+            (BPF_ALU_ADD_X, 0, 0, 0),
+            (BPF_MISC_TAX, 0, 0, 0), #X = IP and TCP header length
+            (BPF_LD_W_IND, 0, 0, link) #First 4 bytes of TCP payload
+        ]
+        for i, token in enumerate(tokens):
+            program.append((BPF_JMP_JEQ_K, 'accept', 'reject' if i == len(tokens)-1 else 0, int.from_bytes(token, 'big')))
+    else:
+        program.append((BPF_RET_K, 0, 0, SNAPLEN))
+    program += [
+        'ipv6', #Passed unfiltered by the prefilter like build_filter does
+        (BPF_LD_B_ABS, 0, 0, link+6), #Next header
+        (BPF_JMP_JEQ_K, 0, 'reject', 6),
+        (BPF_LD_H_ABS, 0, 0, link+40)
+    ]
+    program += _match_ports(ports, 'accept', 0)
+    program.append((BPF_LD_H_ABS, 0, 0, link+42))
+    program += _match_ports(ports, 'accept', 'reject')
+    program += [
+        'accept',
+        (BPF_RET_K, 0, 0, SNAPLEN),
+        'reject',
+        (BPF_RET_K, 0, 0, 0)
+    ]
+
+    #Resolve labels to relative jump offsets
+    labels = {}
+    instructions = []
+    for item in program:
+        if isinstance(item, str):
+            labels[item] = len(instructions)
+        else:
+            instructions.append(item)
+    resolve = lambda target, pc: labels[target]-pc-1 if isinstance(target, str) else target
+    return [(code, resolve(jt, pc), resolve(jf, pc), k) for pc, (code, jt, jf, k) in enumerate(instructions)]
+
+def _match_ports(ports, match, miss):
+    """
+    Return instructions jumping to match when A equals one of ports, to miss after the last one
+    """
+    return [(BPF_JMP_JEQ_K, match, miss if i == len(ports)-1 else 0, each) for i, each in enumerate(ports)]
+
+def run_filter(program, frame):
+    """
+    Interpret instructions of compile_filter on a frame the way the kernel does, out of bounds loads reject
+
+    :return number of bytes the kernel would capture, 0 when rejected
+    """
+    a = x = pc = 0
+    length = len(frame)
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code in (BPF_LD_H_ABS, BPF_LD_B_ABS, BPF_LD_W_IND, BPF_LD_H_IND, BPF_LD_B_IND, BPF_LDX_B_MSH):
+            offset = k+x if code in (BPF_LD_W_IND, BPF_LD_H_IND, BPF_LD_B_IND) else k
+            size = 4 if code == BPF_LD_W_IND else 2 if code in (BPF_LD_H_ABS, BPF_LD_H_IND) else 1
+            if offset+size > length:
+                return 0
+            value = int.from_bytes(bytes(frame[offset:offset+size]), 'big')
+            if code == BPF_LDX_B_MSH:
+                x = (value & 0xf)*4
+            else:
+                a = value
+        elif code == BPF_ALU_AND_K:
+            a &= k
+        elif code == BPF_ALU_RSH_K:
+            a >>= k
+        elif code == BPF_ALU_ADD_X:
+            a = (a+x) & 0xffffffff
+        elif code == BPF_MISC_TAX:
+            x = a
+        elif code == BPF_JMP_JEQ_K:
+            pc += jt if a == k else jf
+        elif code == BPF_JMP_JSET_K:
+            pc += jt if a & k else jf
+        elif code == BPF_RET_K:
+            return k
+        else:
+            raise ValueError('unsupported instruction 0x%x' % code)
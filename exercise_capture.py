@@ -0,0 +1,165 @@
+"""
+Linux AF_PACKET capture through a PACKET_MMAP TPACKET_V3 block ring, frames are read in place from shared memory
+"""
+try:
+    import sys
+    import socket
+    import select
+    import struct
+    import mmap
+    import ctypes
+    from exercise_bpf import compile_filter
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+#linux/if_packet.h, linux/if_ether.h, asm-generic/socket.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+SO_ATTACH_FILTER = 26
+ETH_P_ALL = 0x0003
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+#linux/if_arp.h device types -> pcap link-layer types
+ARPHRD_LINKTYPES = {
+    1: 1, #ARPHRD_ETHER
+    772: 1, #ARPHRD_LOOPBACK, Ethernet header with zero addresses
+    65534: 101 #ARPHRD_NONE, e.g. tun devices carry raw IP
+}
+
+_tpacket_req3 = struct.Struct('=7I') #block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+_block_header = struct.Struct('=III') #block_status, num_pkts, offset_to_first_pkt at offset 8 of tpacket_block_desc
+_packet_header = struct.Struct('=IIIII') #tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len of tpacket3_hdr
+_mac_offset = struct.Struct('=H') #tp_mac at offset 24 of tpacket3_hdr
+_tpacket_stats_v3 = struct.Struct('=III') #tp_packets, tp_drops, tp_freeze_q_cnt
+
+def device_linktype(interface):
+    """
+    Return the pcap link-layer type of a network device
+
+    :raise OSError when the device does not exist, ValueError when its link layer is not supported
+    """
+    with open('/sys/class/net/%s/type' % interface) as f:
+        hatype = int(f.read())
+    if hatype not in ARPHRD_LINKTYPES:
+        raise ValueError('unsupported device type %d of %s' % (hatype, interface))
+    return ARPHRD_LINKTYPES[hatype]
+
+class PacketMmapSocket(object):
+    """
+    AF_PACKET socket receiving into a TPACKET_V3 ring of <block_count> blocks of <block_size> bytes.
+    The kernel fills whole blocks and wakes the reader once per block, or when <block_timeout> ms elapsed,
+    frames are handed out as memoryview slices of the ring and the block goes back to the kernel afterwards.
+    The BPF filter is attached before binding to the device, so no unfiltered frame ever enters the ring.
+    """
+    def __init__(self, interface, port=None, prefilter=True, block_size=1<<20, block_count=64, block_timeout=100, frame_size=2048):
+        """
+        :param interface: device name to capture on
+        :param port: TCP port number as an int or a list of them, see exercise_bpf.compile_filter, None captures everything
+        :param prefilter: only HTTP heads pass the filter when True
+        :raise OSError when the socket, ring or filter cannot be set up, e.g. without CAP_NET_RAW
+        """
+        if not hasattr(socket, 'AF_PACKET'):
+            raise OSError('AF_PACKET capture is only available on Linux')
+        self.interface = interface
+        self.linktype = device_linktype(interface)
+        self.block_size = block_size
+        self.block_count = block_count
+        self.received = 0 #Frames counted by the kernel including dropped ones, PACKET_STATISTICS
+        self.dropped = 0 #Frames dropped by the kernel because the ring was full
+        self.freezes = 0 #Times the ring was frozen while full
+        self._block = 0 #Index of the next block to read
+        self._ring = None
+        self._view = None
+        self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0) #Protocol 0 receives nothing until bound
+        try:
+            if port is not None:
+                self._attach_filter(compile_filter(port, prefilter, linktype=self.linktype))
+            self._sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            self._sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _tpacket_req3.pack(
+                block_size, block_count, frame_size, block_size*block_count//frame_size, block_timeout, 0, 0))
+            self._ring = mmap.mmap(self._sock.fileno(), block_size*block_count, mmap.MAP_SHARED, mmap.PROT_READ|mmap.PROT_WRITE)
+            self._view = memoryview(self._ring)
+            self._sock.bind((interface, ETH_P_ALL))
+        except:
+            self.close()
+            raise
+        self._poll = select.poll()
+        self._poll.register(self._sock.fileno(), select.POLLIN|select.POLLERR)
+
+    def _attach_filter(self, program):
+        instructions = ctypes.create_string_buffer(b''.join(struct.pack('=HBBI', *instruction) for instruction in program))
+        self._sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HP', len(program), ctypes.addressof(instructions)))
+
+    def watch(self, fd):
+        """
+        Also wake up recv_frames when fd becomes readable, e.g. to stop capturing without waiting for the timeout
+        """
+        self._poll.register(fd, select.POLLIN)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv_frames(self, timeout=None):
+        """
+        Yield frames of every block the kernel handed over, waiting up to timeout sec for the first one.
+        A frame must not be used after the generator moved on, copy it with bytes() to keep it longer.
+
+        :return generator of (timestamp, memoryview of the frame)
+        """
+        view = self._view
+        while True:
+            offset = self._block*self.block_size
+            status, count, first = _block_header.unpack_from(view, offset+8)
+            if not status & TP_STATUS_USER:
+                if timeout is None:
+                    return
+                events = self._poll.poll(int(timeout*1000))
+                if not any(fd == self._sock.fileno() for fd, event in events): #Timeout or woken up by a watched fd
+                    return
+                timeout = None #Only wait once, then drain what is ready
+                continue
+            packet = offset+first
+            try:
+                for i in range(count):
+                    next_offset, sec, nsec, snaplen, length = _packet_header.unpack_from(view, packet)
+                    mac = packet+_mac_offset.unpack_from(view, packet+24)[0]
+                    frame = view[mac:mac+snaplen]
+                    yield sec+nsec/1e9, frame
+                    frame.release()
+                    packet += next_offset
+            finally:
+                struct.pack_into('=I', view, offset+8, TP_STATUS_KERNEL) #Hand the block back
+                self._block = (self._block+1) % self.block_count
+
+    def statistics(self):
+        """
+        Add up kernel counters since the last call, PACKET_STATISTICS resets them on every read
+
+        :return (received, dropped, freezes) since the socket was opened
+        """
+        if self._sock.fileno() < 0: #Closed, counters were read one last time by close()
+            return self.received, self.dropped, self.freezes
+        packets, drops, freezes = _tpacket_stats_v3.unpack(self._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _tpacket_stats_v3.size))
+        self.received += packets
+        self.dropped += drops
+        self.freezes += freezes
+        return self.received, self.dropped, self.freezes
+
+    def close(self):
+        if self._ring is not None:
+            self.statistics()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._ring is not None:
+            try:
+                self._ring.close()
+            except BufferError: #A frame is still referenced, the map goes away with it
+                pass
+            self._ring = None
+        self._sock.close()
@@ -0,0 +1,100 @@
+"""
+Persist learned baseline, rate window, alert history and Plug-in hits, so a restart resumes enforcing without learning
+"""
+try:
+    import sys
+    import os
+    import struct
+    import marshal
+    from exercise_state import *
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+MAGIC = b'HMCK'
+FORMAT_VERSION = 2 #2 adds time buckets and response time histograms of Plug-ins
+HEADER = struct.Struct('!4sHHd') #Magic, format version, marshal version, saved at in sec since epoch
+
+class CheckpointError(ValueError):
+    """
+    Raised when a checkpoint file is damaged or written by an incompatible version
+    """
+    pass
+
+def save_checkpoint(monitor, path):
+    """
+    Write statistics of a HttpMonitor to path, the file is replaced atomically.
+    Tables are copied under <dispatch_lock>, encoding and writing happen outside of it.
+
+    :param monitor: HttpMonitor to checkpoint
+    :param path: checkpoint file
+    :return number of bytes written
+    """
+    with monitor.dispatch_lock:
+        now = monitor.clock.time()
+        plugins = {}
+        for plugin in monitor.statistic_plugins:
+            plugins[type(plugin).__name__] = plugin.dump()
+        data = {
+            'baseline': monitor.average_baseline,
+            'resolution': monitor.rate.resolution,
+            'rate': monitor.rate.dump(),
+            'alerts': [list(alert) for alert in monitor.alert_history],
+            'plugins': plugins
+        }
+    payload = HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version, now)+marshal.dumps(data)
+    temp_path = path+'.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(temp_path, path) #Readers never see a partially written checkpoint
+    return len(payload)
+
+def read_checkpoint(path):
+    """
+    Read a checkpoint file
+
+    :return (saved at, data dictionary)
+    :raise CheckpointError when the file is not a compatible checkpoint, OSError when it cannot be read
+    """
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if len(payload) < HEADER.size:
+        raise CheckpointError('truncated checkpoint '+path)
+    magic, version, marshal_version, saved_at = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != FORMAT_VERSION or marshal_version != marshal.version:
+        raise CheckpointError('incompatible checkpoint '+path)
+    try:
+        data = marshal.loads(payload[HEADER.size:])
+    except (EOFError, ValueError, TypeError) as err:
+        raise CheckpointError('damaged checkpoint '+path+': '+str(err))
+    return saved_at, data
+
+def load_checkpoint(monitor, path, max_age):
+    """
+    Restore statistics of a HttpMonitor from a checkpoint no older than max_age and switch it to NormalState.
+    Retention is applied while loading, hits and alerts older than <max_retention_length> are skipped.
+
+    :param monitor: HttpMonitor to restore, still learning
+    :param path: checkpoint file
+    :param max_age: sec, older checkpoints are ignored and the monitor keeps learning
+    :return True when resumed from the checkpoint
+    """
+    try:
+        saved_at, data = read_checkpoint(path)
+    except FileNotFoundError:
+        return False
+    now = monitor.clock.time()
+    if now-saved_at > max_age or data['baseline'] <= 0:
+        return False
+    cutoff = now-monitor.config.max_retention_length
+    with monitor.dispatch_lock:
+        monitor.average_baseline = data['baseline']
+        monitor.rate.load(data['rate'], data['resolution'])
+        monitor.alert_history.clear()
+        monitor.alert_history.extend(alert for alert in data['alerts'] if alert[1] >= cutoff)
+        for plugin in monitor.statistic_plugins:
+            dumped = data['plugins'].get(type(plugin).__name__)
+            if dumped is not None:
+                plugin.load(dumped, cutoff)
+        monitor.state.switch(NormalState) #Skip learning, the baseline is still valid
+    return True
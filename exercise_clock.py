@@ -0,0 +1,33 @@
+"""
+Define Clock used by HttpMonitor and StatisticVisitor Plug-ins to timestamp records
+"""
+try:
+    import sys
+    import time
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class Clock(object):
+    """
+    Wall clock by default, follows packet timestamps once advanced by an offline replay
+    """
+    def __init__(self):
+        self.replay_time = None #Timestamp of the last replayed packet, None when sniffing live
+
+    def time(self):
+        """
+        Return current time in sec since epoch, same as time.time() when sniffing live
+        """
+        if self.replay_time is None:
+            return time.time()
+        return self.replay_time
+
+    def advance(self, timestamp):
+        """
+        Move replay clock forward to the given packet timestamp, never backward
+
+        :param timestamp: packet capture time in sec since epoch
+        """
+        if self.replay_time is None or timestamp > self.replay_time:
+            self.replay_time = timestamp
@@ -4,9 +4,53 @@ class Config:
     '''
     timeout = 1 #Frequency in sec to check for new HTTP transaction, default 2s
     dashboard_bucket_size = 1 #Frequency in sec to refresh dashboard info, default 10s
+    dashboard_render_interval = 1 #Frequency in sec to redraw changed dashboard lines, default 1s
     average_bucket_size = 60*2 #Bucket size in sec for average HTTP request rate, default 2mins
     average_threshold = 10 #Threshold in percentage to trigger alerts when exceeding <average_baseline>, default 10%
     average_learning_duration = average_bucket_size #Duration of learning for average HTTP request rate, default 2mins
     max_str_length = 1024 #Protection of overlong string, default set to 1kb
     max_top_hits = 10 #Display top N hits on screen, hide the rest, default 10 hits
     max_retention_length = 3600*24 #Retention length in sec, used to purge aging data, default 24hrs
+    parser = 'scapy' #Packet parser, 'scapy' for full Scapy/scapy_http dissection, 'fast' to parse HTTP heads from raw bytes, default 'scapy'
+    pipeline_workers = 1 #Consumer threads processing captured packets in batches, 0 processes inline on the capture thread, default 1
+    pipeline_capacity = 100000 #Max packets buffered between capture and consumers, overflow is dropped and counted, default 100k packets
+    pipeline_batch_size = 256 #Max packets handed to Plug-ins per batch, default 256
+    shutdown_timeout = 2 #Max sec shutdown waits on capture, consumers and shard workers each, packets still buffered afterwards are dropped and counted, default 2s
+    shard_workers = 0 #Worker processes sharding flows by 5-tuple hash, statistics are merged on every tick, 0 processes in a single process, default 0
+    hits_backend = 'exact' #Hits table of Plug-ins, 'exact' unbounded dictionary, or 'space_saving' bounded approximate Top-K, default 'exact'
+    hits_backends = { #Per Plug-in class name override of <hits_backend>, default bounds Plug-ins keyed by client supplied strings
+        'TopHitsBySection': 'space_saving',
+        'TopHitsByHost': 'space_saving',
+        'TopHitsUploadByHost': 'space_saving',
+        'TopHitsByUserAgent': 'space_saving'
+    }
+    hits_capacity = 10000 #Max keys of a 'space_saving' hits table, exact below it, counts over-estimate by at most total/<hits_capacity> above it, default 10k keys
+    rollup_levels = ((1, 60), (60, 60), (3600, 24)) #(Resolution sec, buckets) of Plug-in time buckets from finest to coarsest, counts roll up as buckets age, () disables windowed top N, default 1m of 1s, 1h of 1m, 24h of 1h
+    rollup_max_keys = 100 #Max keys kept per time bucket, up to twice as many in the finest buckets, smaller counts are dropped when downsampling, bounds memory of every Plug-in, default 100 keys
+    dashboard_window = None #Sec of recent traffic the dashboard top N covers, None for counts since a key was first seen, default None
+    metrics_windows = (300,) #Sec of recent traffic exported as windowed top N next to lifetime counts, default 5mins
+    max_alert_history = 1000 #Max alerts kept in history, oldest dropped first, default 1000 alerts
+    section_cache_size = 4096 #Max (host, path) pairs kept in the LRU cache of normalized sections, default 4096
+    latency_precision_bits = 5 #Sub-bucket bits of response time histograms, quantiles within 1/2^bits of the true value, default 5 bits (~3%)
+    latency_max_keys = 1000 #Max keys with a response time histogram per Plug-in, the least recently seen is evicted above it, default 1000 keys
+    pairing_timeout = 60 #Max sec a request waits for its response, unanswered requests are dropped and counted, default 60s
+    pairing_max_flows = 100000 #Max TCP connections with requests waiting for a response, the least recently used is dropped above it, default 100k connections
+    pairing_max_pending = 32 #Max pipelined requests waiting on one TCP connection, default 32 requests
+    distinct_precision = 10 #Register bits of HyperLogLog distinct counts, 2^bits bytes per sketch, standard error 1.04/sqrt(2^bits), default 10 bits (1KB, ~3%)
+    distinct_max_keys = 1000 #Max keys with a distinct count sketch per Plug-in and per bucket, the least recently seen is evicted above it, default 1000 keys
+    distinct_bucket_size = 60 #Sec per time bucket of distinct count sketches, windowed estimates merge the buckets of the window, 0 disables them, default 1min
+    bpf_prefilter = True #Capture filter also matches TCP payloads starting with a HTTP method or 'HTTP/', ACKs and body segments stay in the kernel, default True
+    capture_backend = 'scapy' #Live capture, 'scapy' reads one frame per syscall, 'mmap' reads blocks of a Linux AF_PACKET TPACKET_V3 ring, default 'scapy'
+    capture_block_size = 1<<20 #Bytes per block of the 'mmap' ring, default 1MB
+    capture_block_count = 64 #Blocks of the 'mmap' ring, frames are dropped by the kernel and counted when all are full, default 64 blocks
+    capture_block_timeout = 100 #Max ms before the kernel hands over a partially filled block of the 'mmap' ring, default 100ms
+    checkpoint_path = None #File statistics are saved to and resumed from, e.g. 'exercise.checkpoint' to skip learning on a warm restart, None to always learn from scratch, default None
+    checkpoint_interval = 60 #Frequency in sec to save a checkpoint while enforcing, default 60s
+    checkpoint_max_age = 60*10 #Resume from a checkpoint saved at most this many sec ago, otherwise learn a new baseline, default 10mins
+    metrics_host = '127.0.0.1' #Address the metrics endpoint listens on, default local only
+    metrics_port = None #TCP port serving the text exposition format on /metrics, None disables it, default None
+    metrics_udp = None #'host:port' of a collector receiving line protocol over UDP, None disables it, default None
+    metrics_udp_packet_size = 1400 #Max bytes per UDP datagram of line protocol, fits an Ethernet MTU, default 1400 bytes
+    profile_enabled = True #Count calls and time samples per stage and Plug-in, False turns every stage into a no-op and exports no stage metrics, --profile turns it on, default True
+    profile_sample_interval = 64 #Time one in N calls of per packet stages, every call is still counted, 0 only counts calls, default 64
+    profile_dashboard = False #Show time spent per stage and Plug-in on the dashboard, turned on by --profile, default False
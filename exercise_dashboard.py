@@ -0,0 +1,84 @@
+try:
+    import sys
+    import shutil
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+#ANSI control sequences
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+CLEAR_LINE = '\x1b[K'
+CLEAR_BELOW = '\x1b[J'
+WRAP_OFF = '\x1b[?7l' #Overlong lines are clipped instead of shifting the rows below
+WRAP_ON = '\x1b[?7h'
+
+def move_to(row):
+    """
+    Return the ANSI sequence moving the cursor to the start of a 1-based row
+    """
+    return '\x1b[%d;1H' % row
+
+class DashboardRenderer(object):
+    """
+    Write dashboard frames to a terminal without clearing the screen.
+    Each frame is compared with the previous one, only changed lines are redrawn, and the whole update goes out
+    in a single buffered write so the screen never shows a half drawn frame.
+    Streams that are not a terminal get every frame appended as plain text.
+    """
+    def __init__(self, stream=None, rows=None):
+        """
+        :param stream: text stream to write frames to, defaults to sys.stdout
+        :param rows: terminal height, defaults to the size reported by the terminal
+        """
+        self.stream = stream if stream else sys.stdout
+        self.rows = rows
+        self.previous = None #Lines on screen after the last frame, None before the first frame
+        self.frames = 0
+        self.lines_written = 0
+
+    def is_terminal(self):
+        isatty = getattr(self.stream, 'isatty', None)
+        return bool(isatty and isatty())
+
+    def reset(self):
+        """
+        Forget what is on screen, the next frame clears the screen and is drawn in full
+        """
+        self.previous = None
+
+    def render(self, lines):
+        """
+        Draw a frame
+
+        :param lines: list of lines of the frame, may contain color sequences but no line breaks
+        :return number of lines written
+        """
+        if not self.is_terminal():
+            self.stream.write('\n'.join(lines)+'\n')
+            self.stream.flush()
+            self.frames += 1
+            self.lines_written += len(lines)
+            return len(lines)
+
+        rows = self.rows if self.rows else shutil.get_terminal_size().lines
+        lines = lines[:max(rows-1, 1)] #Keep the last row for the cursor so the screen never scrolls
+        buffer = [WRAP_OFF]
+        if self.previous is None:
+            buffer.append(CLEAR_SCREEN)
+            previous = ()
+        else:
+            previous = self.previous
+        written = 0
+        for row, line in enumerate(lines):
+            if row >= len(previous) or previous[row] != line:
+                buffer.append(move_to(row+1)+line+CLEAR_LINE)
+                written += 1
+        if len(lines) < len(previous):
+            buffer.append(move_to(len(lines)+1)+CLEAR_BELOW) #Frame got shorter
+        buffer.append(move_to(len(lines)+1)+WRAP_ON) #Park cursor below the frame
+        self.stream.write(''.join(buffer))
+        self.stream.flush()
+        self.previous = list(lines)
+        self.frames += 1
+        self.lines_written += written
+        return written
@@ -0,0 +1,90 @@
+"""
+Double buffered statistics between capture threads and the reporting thread, without a lock per packet
+"""
+try:
+    import sys
+    import time
+    import threading
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class EpochBuffer(object):
+    """
+    Statistics collected by one writer thread during one epoch
+    """
+    __slots__ = ('request_count', 'records')
+
+    def __init__(self):
+        self.request_count = 0 #HTTP requests seen
+        self.records = [] #PacketRecord waiting for Plug-ins
+
+    def clear(self):
+        self.request_count = 0
+        self.records = []
+
+class EpochWriter(object):
+    """
+    Pair of buffers owned by a single writer thread, the one of the active epoch is written while the other is frozen
+    """
+    __slots__ = ('swap', 'buffers', 'epoch', 'active')
+
+    def __init__(self, swap):
+        self.swap = swap
+        self.buffers = (EpochBuffer(), EpochBuffer())
+        self.epoch = swap.epoch #Epoch read by the last begin()
+        self.active = False #True between begin() and end()
+
+    def begin(self):
+        """
+        Enter the active epoch, must be followed by end()
+
+        :return EpochBuffer to update
+        """
+        self.active = True #Announced before reading the epoch, a concurrent swap then waits for end()
+        epoch = self.epoch = self.swap.epoch
+        return self.buffers[epoch & 1]
+
+    def end(self):
+        self.active = False
+
+class EpochSwap(object):
+    """
+    Epoch based double buffering. Each writer thread updates its buffer of the active epoch, the reporter flips
+    the epoch at a bucket boundary, waits for writers still inside the previous epoch and reads the frozen buffers.
+    Writers never block and never share a buffer, so no increment is lost between two swaps.
+    Relies on the interpreter running each attribute read or write atomically.
+    """
+    def __init__(self):
+        self.epoch = 0
+        self.writers = []
+        self.swaps = 0
+        self._local = threading.local()
+        self._lock = threading.Lock() #Only taken when a thread writes for the first time
+
+    def writer(self):
+        """
+        Return the EpochWriter of the calling thread, registered on first use
+        """
+        writer = getattr(self._local, 'writer', None)
+        if writer is None:
+            writer = self._local.writer = EpochWriter(self)
+            with self._lock:
+                self.writers.append(writer)
+        return writer
+
+    def swap(self):
+        """
+        Start a new epoch, only one reporter thread may call it.
+        The frozen buffers must be read and cleared before the next swap hands them back to writers.
+
+        :return list of EpochBuffer of the previous epoch, one per writer thread
+        """
+        with self._lock:
+            writers = list(self.writers)
+        epoch = self.epoch = self.epoch+1
+        for writer in writers:
+            while writer.active and writer.epoch != epoch: #Still writing into the previous epoch
+                time.sleep(0)
+        self.swaps += 1
+        return [writer.buffers[(epoch-1) & 1] for writer in writers]
@@ -0,0 +1,155 @@
+"""
+Headless export of monitor snapshots, as a HTTP text exposition endpoint and as batched UDP line protocol
+"""
+try:
+    import sys
+    import socket
+    import threading
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+def _exposition_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _line_protocol_tag(value):
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ').replace('\n', '\\n')
+
+class MetricsSnapshot(object):
+    """
+    Immutable list of samples taken under <dispatch_lock>, serialized lazily and at most once per format,
+    so exporters never read live tables and repeated scrapes of the same snapshot cost nothing.
+    A sample is (name, labels as a tuple of (label, value) pairs, value).
+    """
+    def __init__(self, samples, timestamp):
+        """
+        :param samples: list of samples, grouped by name
+        :param timestamp: sec since epoch the samples were taken at
+        """
+        self.samples = samples
+        self.timestamp = timestamp
+        self._exposition = None
+        self._lines = None
+
+    def exposition(self):
+        """
+        Return the samples in the Prometheus text exposition format, as bytes
+        """
+        if self._exposition is None:
+            lines = []
+            name_seen = None
+            for name, labels, value in self.samples:
+                if name != name_seen:
+                    lines.append('# TYPE '+name+' gauge')
+                    name_seen = name
+                if labels:
+                    name = name+'{'+','.join(label+'="'+_exposition_label(label_value)+'"' for label, label_value in labels)+'}'
+                lines.append(name+' '+repr(value))
+            lines.append('')
+            self._exposition = '\n'.join(lines).encode()
+        return self._exposition
+
+    def line_protocol(self):
+        """
+        Return the samples as InfluxDB line protocol lines, as bytes without line ending
+        """
+        if self._lines is None:
+            timestamp = ' '+str(int(self.timestamp*1e9))
+            self._lines = [(name+''.join(','+label+'='+_line_protocol_tag(label_value) for label, label_value in labels if label_value != '')+
+                ' value='+repr(value)+timestamp).encode() for name, labels, value in self.samples]
+        return self._lines
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        snapshot = self.server.snapshot
+        if self.path.split('?')[0] != '/metrics' or snapshot is None:
+            self.send_error(404 if snapshot is not None else 503)
+            return
+        body = snapshot.exposition()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): #Keep the console for the dashboard
+        pass
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP endpoint serving the last published MetricsSnapshot on /metrics, from a daemon thread
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        :param port: TCP port to listen on, 0 picks a free one, see <server_port>
+        """
+        HTTPServer.__init__(self, (host, port), _MetricsHandler)
+        self.snapshot = None #Last published MetricsSnapshot
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def publish(self, snapshot):
+        self.snapshot = snapshot
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+class UdpExporter(object):
+    """
+    Send snapshots as line protocol to a UDP collector, lines are packed into datagrams of at most <packet_size> bytes.
+    The socket never blocks, datagrams the kernel cannot take are dropped and counted.
+    """
+    def __init__(self, host, port, packet_size=1400):
+        self.address = (host, port)
+        self.packet_size = packet_size
+        self.sent = 0 #Datagrams sent
+        self.dropped = 0 #Datagrams dropped on send errors
+        self._sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def publish(self, snapshot):
+        """
+        Send all samples of a snapshot, a line longer than <packet_size> goes alone in its datagram
+
+        :return number of datagrams sent
+        """
+        sent = self.sent
+        batch = []
+        size = -1 #No separator before the first line
+        for line in snapshot.line_protocol():
+            if batch and size+1+len(line) > self.packet_size:
+                self._send(b'\n'.join(batch))
+                batch = []
+                size = -1
+            batch.append(line)
+            size += 1+len(line)
+        if batch:
+            self._send(b'\n'.join(batch))
+        return self.sent-sent
+
+    def _send(self, datagram):
+        try:
+            self._sock.sendto(datagram, self.address)
+            self.sent += 1
+        except OSError:
+            self.dropped += 1
+
+    def close(self):
+        self._sock.close()
+
+def parse_address(address):
+    """
+    Split 'host:port', '[v6 host]:port' or ':port' into (host, port), host defaults to 127.0.0.1
+
+    :raise ValueError when the port is missing or not a number
+    """
+    host, separator, port = address.rpartition(':')
+    if not separator:
+        raise ValueError('missing port in '+address)
+    return host.strip('[]') or '127.0.0.1', int(port)
@@ -0,0 +1,108 @@
+"""
+Fixed memory log-bucketed histogram of response times, in the spirit of HdrHistogram
+"""
+try:
+    import sys
+    from array import array
+    from bisect import bisect_left
+    from itertools import accumulate
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class LogHistogram(object):
+    """
+    Counts integer values (e.g. microseconds) in log-linear buckets.
+    Values below 2^<bits> are counted exactly, larger values fall in one of 2^(bits-1) buckets per power of two,
+    so any quantile is within 1/2^bits of the true value relative to it. Values above <max_value> are clamped.
+    Memory is fixed, about 2^bits + (log2(max_value)-bits)*2^(bits-1) counters of 4 bytes, 465 for the defaults.
+    """
+    def __init__(self, bits=5, max_value=1<<32):
+        """
+        :param bits: sub-bucket bits, precision of the histogram
+        :param max_value: largest value told apart, default 2^32 microseconds is 71 minutes
+        """
+        self.bits = bits
+        self.max_value = max_value
+        self._sub = 1<<bits #Exact values below it, then buckets per power of two start at half of it
+        self._half = self._sub>>1
+        self.counts = array('I', [0])*(self._index(max_value)+1)
+        self.count = 0 #Values added
+        self.max = 0 #Largest value added
+
+    def _index(self, value):
+        if value < self._sub:
+            return value
+        shift = value.bit_length()-self.bits #Keep the <bits> leading bits
+        return self._sub+(shift-1)*self._half+(value>>shift)-self._half
+
+    def _value(self, index):
+        """
+        Return the middle of the value range counted by a bucket
+        """
+        if index < self._sub:
+            return index
+        shift = (index-self._sub)//self._half+1
+        low = ((index-self._sub) % self._half+self._half)<<shift
+        return low+(1<<(shift-1))
+
+    def add(self, value, count=1):
+        """
+        Count value, negative values count as 0
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += count
+        self.count += count
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Return the value below which a q fraction of values fall, 0 when empty
+
+        :param q: fraction between 0 and 1, e.g. 0.99 for p99
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, int(q*self.count+0.5)) #Rank of the value to report, 1-based
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        """
+        Return the values of several quantiles with one cumulative sum of the buckets, same as quantile() for each
+
+        :param qs: fractions, e.g. (0.5, 0.95, 0.99)
+        """
+        if self.count == 0:
+            return [0]*len(qs)
+        cumulative = list(accumulate(self.counts)) #Summed in C, then each rank is a binary search
+        return [min(self._value(bisect_left(cumulative, max(1, int(q*self.count+0.5)))), self.max) for q in qs]
+
+    def sparse(self):
+        """
+        Return (index, count) pairs of non-empty buckets, compact to merge or checkpoint
+        """
+        return [(index, count) for index, count in enumerate(self.counts) if count]
+
+    def merge(self, sparse, maximum=0):
+        """
+        Add counts of another histogram of the same precision
+
+        :param sparse: pairs returned by sparse()
+        :param maximum: largest value of the other histogram
+        """
+        counts = self.counts
+        for index, count in sparse:
+            counts[index] += count
+            self.count += count
+        if maximum > self.max:
+            self.max = maximum
@@ -0,0 +1,290 @@
+"""
+Hits tables backing StatisticVisitor Plug-ins, key -> [count, last_seen]
+"""
+try:
+    import sys
+    import heapq
+    from operator import itemgetter
+    from collections import OrderedDict
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+_rank = itemgetter(1) #Sort key of a (key, [count, last_seen]) item, lists compare by count then last seen as the dashboard displays
+
+class ExactHits(OrderedDict):
+    """
+    Unbounded exact hits table, one entry per distinct key.
+    Entries are kept in last seen order so retention only touches expired entries, and the best <top_size> entries
+    are tracked as updates arrive so a dashboard refresh does not sort the whole table.
+    Plug-ins may still update the table the dictionary way, e.g. hits[key][0] += 1 or hits[key] = [1, now]:
+    a value handed out by hits[key] or assigned to it may change behind the table, so the top view is rebuilt on next read
+    and the next expire() scans every entry and restores the last seen order.
+    """
+    def __init__(self, config=None, top_size=None):
+        OrderedDict.__init__(self)
+        self.top_size = top_size if top_size else (config.max_top_hits if config else 10)
+        self._top = {} #Best <top_size> keys -> value, every other entry ranks lower
+        self._top_min = None #[count, last_seen] lower bound of the lowest entry in <_top> once full
+        self._top_dirty = False #Set when a top entry is removed, <_top> is rebuilt on next read
+        self._unordered = False #Set when a value may have changed outside add() or merge(), last seen order is restored on next expire()
+
+    def add(self, key, amount, timestamp):
+        """
+        Count <amount> hits of key seen at timestamp
+        """
+        value = self.get(key)
+        if value is None:
+            value = [amount, timestamp]
+            OrderedDict.__setitem__(self, key, value)
+        else:
+            value[0] += amount
+            value[1] = timestamp
+            self.move_to_end(key)
+        self._update_top(key, value)
+
+    def merge(self, hits):
+        """
+        Merge hits collected by another table, counts add up and last seen keeps the latest
+
+        :param hits: dictionary of key -> [count, last_seen]
+        """
+        for key, value in hits.items():
+            current = self.get(key)
+            if current is None:
+                current = [value[0], value[1]]
+                OrderedDict.__setitem__(self, key, current)
+            else:
+                current[0] += value[0]
+                if value[1] > current[1]:
+                    current[1] = value[1]
+                    self.move_to_end(key)
+            self._update_top(key, current)
+
+    def top(self, count):
+        """
+        Return up to <count> (key, value) items by count then last seen in descending order, O(<top_size>)
+        """
+        if count > self.top_size:
+            return sorted(self.items(), key=_rank, reverse=True)[:count]
+        if self._top_dirty or len(self._top) < min(self.top_size, len(self)):
+            self._rebuild_top()
+        return sorted(self._top.items(), key=_rank, reverse=True)[:count]
+
+    def expire(self, cutoff):
+        """
+        Remove entries last seen before cutoff, walks from the oldest entry and stops at the first fresh one
+
+        :return number of entries removed
+        """
+        if self._unordered:
+            return self._expire_all(cutoff)
+        removed = 0
+        while self:
+            key = next(iter(self))
+            if OrderedDict.__getitem__(self, key)[1] >= cutoff:
+                break
+            self.pop(key)
+            removed += 1
+        return removed
+
+    def _expire_all(self, cutoff):
+        """
+        Remove entries last seen before cutoff wherever they are, and put the rest back in last seen order
+        """
+        items = OrderedDict.items(self)
+        kept = sorted((item for item in items if item[1][1] >= cutoff), key=lambda item: item[1][1])
+        removed = len(self)-len(kept)
+        OrderedDict.clear(self)
+        setitem = OrderedDict.__setitem__
+        for key, value in kept:
+            setitem(self, key, value)
+        self._unordered = False
+        self._top_dirty = True #Set along with <_unordered>, removed keys may also be in the top view
+        return removed
+
+    def dump(self):
+        """
+        Return keys, counts and last seen as three lists in last seen order, compact for checkpoints
+        """
+        values = list(self.values())
+        return list(self.keys()), [value[0] for value in values], [value[1] for value in values]
+
+    def load(self, keys, counts, last_seen, cutoff=None):
+        """
+        Replace the content with lists returned by dump()
+
+        :param cutoff: skip entries last seen before cutoff, retention applied while loading the same way as expire()
+        """
+        self.clear()
+        start = 0
+        if cutoff is not None:
+            while start < len(last_seen) and last_seen[start] < cutoff:
+                start += 1
+        setitem = OrderedDict.__setitem__
+        for key, value in zip(keys[start:], map(list, zip(counts[start:], last_seen[start:]))):
+            setitem(self, key, value)
+        self._top_dirty = True #Top view rebuilt on next read
+
+    def _update_top(self, key, value):
+        top = self._top
+        if key in top or self._top_dirty:
+            return
+        if len(top) < self.top_size:
+            top[key] = value
+            if len(top) == self.top_size:
+                self._top_min = list(min(top.values()))
+            return
+        top_min = self._top_min
+        if value <= top_min:
+            return
+        #Counts only grow, <_top_min> may be stale, find the actual lowest top entry before swapping it out
+        min_key, min_value = min(top.items(), key=_rank)
+        if value > min_value:
+            del top[min_key]
+            top[key] = value
+        self._top_min = list(min_value) #Still a lower bound of every remaining top entry
+
+    def _rebuild_top(self):
+        self._top = dict(heapq.nlargest(self.top_size, self.items(), key=_rank))
+        self._top_min = list(min(self._top.values())) if len(self._top) == self.top_size else None
+        self._top_dirty = False
+
+    def _forget(self, key):
+        if key in self._top:
+            del self._top[key]
+            self._top_dirty = True
+
+    def __getitem__(self, key):
+        value = OrderedDict.__getitem__(self, key)
+        self._top_dirty = self._unordered = True #The caller may update the value in place
+        return value
+
+    def __setitem__(self, key, value):
+        OrderedDict.__setitem__(self, key, value)
+        self._top_dirty = self._unordered = True
+
+    def __delitem__(self, key):
+        OrderedDict.__delitem__(self, key)
+        self._forget(key)
+
+    def pop(self, key, *default):
+        self._forget(key)
+        return OrderedDict.pop(self, key, *default)
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self._top = {}
+        self._top_min = None
+        self._top_dirty = False
+        self._unordered = False
+
+class SpaceSavingHits(ExactHits):
+    """
+    Bounded approximate Top-K table using the Space-Saving algorithm (Metwally et al.), holds at most <capacity> keys.
+    Exact until <capacity> distinct keys are seen, afterwards a new key replaces the key with the lowest count and
+    inherits that count as its error. With N the total count added:
+        -count of a key never under-estimates, and over-estimates by at most errors[key] <= N/capacity
+        -any key whose true count exceeds N/capacity is guaranteed to be in the table
+    Memory is bounded by roughly capacity*(max_str_length+200) bytes.
+    """
+    def __init__(self, config=None, capacity=None, top_size=None):
+        ExactHits.__init__(self, config, top_size)
+        self.capacity = capacity if capacity else config.hits_capacity
+        self.errors = {} #Over-estimation bound per key, only keys which replaced an evicted key
+        self._heap = [] #(count, key) candidates for eviction, lazily refreshed since counts only grow
+
+    def add(self, key, amount, timestamp):
+        value = self.get(key)
+        if value is not None:
+            value[0] += amount
+            value[1] = timestamp
+            self.move_to_end(key)
+            self._update_top(key, value)
+            return
+        count = amount
+        if len(self) >= self.capacity:
+            evicted_count = self._evict_min()
+            count += evicted_count
+            self.errors[key] = evicted_count
+        value = [count, timestamp]
+        OrderedDict.__setitem__(self, key, value)
+        heapq.heappush(self._heap, (count, key))
+        if len(self._heap) > 2*self.capacity: #Drop stale candidates left by keys trimmed on retention
+            self._rebuild()
+        self._update_top(key, value)
+
+    def merge(self, hits):
+        """
+        Merge hits of another table, counts and over-estimation bounds add up and last seen keeps the latest
+
+        :param hits: dictionary of key -> [count, last_seen] or [count, last_seen, error] for keys with an error
+        """
+        for key, value in hits.items():
+            current = self.get(key)
+            if current is not None and value[1] < current[1]: #Older delta, counts add up and last seen keeps the latest
+                current[0] += value[0]
+                self._update_top(key, current)
+            else:
+                self.add(key, value[0], value[1])
+            if len(value) > 2 and value[2]:
+                self.errors[key] = self.errors.get(key, 0)+value[2]
+
+    def load(self, keys, counts, last_seen, cutoff=None, errors=None):
+        """
+        Replace the content with lists returned by dump(), keys with the lowest counts are evicted down to <capacity>
+
+        :param errors: over-estimation bounds of the dumped table
+        """
+        ExactHits.load(self, keys, counts, last_seen, cutoff)
+        if errors:
+            self.errors = dict((key, error) for key, error in errors.items() if key in self)
+        while len(self) > self.capacity:
+            self._evict_min()
+
+    def pop(self, key, *default):
+        self.errors.pop(key, None)
+        return ExactHits.pop(self, key, *default)
+
+    def clear(self):
+        ExactHits.clear(self)
+        self.errors.clear()
+        self._heap = []
+
+    def _evict_min(self):
+        """
+        Remove the key with the lowest count
+
+        :return count of the evicted key
+        """
+        while True:
+            if not self._heap: #Keys stored without add(), e.g. by a third-party Plug-in
+                self._rebuild()
+            count, key = heapq.heappop(self._heap)
+            value = self.get(key)
+            if value is None: #Key already trimmed
+                continue
+            if value[0] != count: #Stale candidate, count grew since pushed
+                heapq.heappush(self._heap, (value[0], key))
+                continue
+            self.pop(key)
+            return count
+
+    def _rebuild(self):
+        self._heap = [(value[0], key) for key, value in self.items()]
+        heapq.heapify(self._heap)
+
+HITS_BACKENDS = {
+    'exact': ExactHits,
+    'space_saving': SpaceSavingHits
+}
+
+def new_hits(config, plugin_name):
+    """
+    Create the hits table configured for a Plug-in
+
+    :param config: Config class
+    :param plugin_name: Plug-in class name, looked up in <hits_backends> before falling back to <hits_backend>
+    """
+    backend = config.hits_backends.get(plugin_name, config.hits_backend)
+    return HITS_BACKENDS[backend](config)
@@ -0,0 +1,94 @@
+"""
+Fixed memory HyperLogLog sketch of distinct values, mergeable across time buckets and processes
+"""
+try:
+    import sys
+    import math
+    from hashlib import blake2b
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+_POWERS = [2.0**-rank for rank in range(65)] #Register value -> its term of the harmonic mean
+_HIGH_BITS = {} #Number of registers -> int with the high bit of every byte set, for merge()
+
+def hash64(value):
+    """
+    Return a 64 bit hash of value, stable across processes and restarts unlike hash(), so sketches of shard workers
+    and checkpoints merge with the live ones
+
+    :param value: bytes or str
+    """
+    if isinstance(value, str):
+        value = value.encode('utf-8', 'replace')
+    return int.from_bytes(blake2b(value, digest_size=8).digest(), 'big')
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct values added with 2^precision one byte registers.
+    The leading <precision> bits of a hash pick a register which keeps the longest run of leading zeros of the other bits seen,
+    the standard error of the estimate is 1.04/sqrt(2^precision), ~3% for the default 1KB. Small counts use linear counting
+    and are close to exact. Two sketches of the same precision merge by keeping the largest of each register,
+    the result is the sketch of the union, whatever the order and grouping of merges.
+    """
+    __slots__ = ('precision', 'registers', '_shift', '_mask')
+
+    def __init__(self, precision=10, registers=None):
+        """
+        :param precision: register bits, from 4 to 16
+        :param registers: registers of another sketch to start from, e.g. read from a checkpoint
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError('precision out of range 4..16: '+str(precision))
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1<<precision)
+        self._shift = 64-precision #Bits left after the register index
+        self._mask = (1<<self._shift)-1
+
+    def add(self, value):
+        """
+        Add a bytes or str value
+        """
+        self.add_hash(hash64(value))
+
+    def add_hash(self, hashed):
+        """
+        Add a value by its hash64(), hash once when adding a value to several sketches
+        """
+        index = hashed >> self._shift
+        rank = self._shift-(hashed & self._mask).bit_length()+1 #Leading zeros of the remaining bits plus one
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, registers):
+        """
+        Add the values of another sketch of the same precision
+
+        :param registers: registers of the other sketch, bytes or bytearray
+        """
+        size = len(self.registers)
+        if len(registers) != size:
+            raise ValueError('cannot merge sketches of different precision')
+        high = _HIGH_BITS.get(size)
+        if high is None:
+            high = _HIGH_BITS[size] = int.from_bytes(b'\x80'*size, 'big')
+        #Registers never exceed 64, so every byte of (a|0x80)-b keeps its high bit iff a >= b and never borrows
+        #from its neighbour, the whole sketch is compared at once on big integers instead of byte by byte
+        a = int.from_bytes(self.registers, 'big')
+        b = int.from_bytes(registers, 'big')
+        keep = ((((a | high)-b) & high) >> 7)*0xff #0xff bytes where a >= b
+        self.registers = bytearray(((a & keep) | (b & ~keep)).to_bytes(size, 'big'))
+
+    def count(self):
+        """
+        Return the estimated number of distinct values added
+        """
+        registers = self.registers
+        m = len(registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213/(1+1.079/m))
+        estimate = alpha*m*m/sum(map(_POWERS.__getitem__, registers))
+        if estimate <= 2.5*m:
+            zeros = registers.count(0)
+            if zeros: #Linear counting, more accurate while many registers are still empty
+                estimate = m*math.log(m/zeros)
+        return int(round(estimate))
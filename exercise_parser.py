@@ -0,0 +1,170 @@
+"""
+Lightweight HTTP head parser working on raw frames, bypassing Scapy and scapy_http dissection
+"""
+try:
+    import sys
+    import struct
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8, 0x9100)
+IPPROTO_TCP = 6
+REQUEST_METHODS = frozenset([b'OPTIONS', b'GET', b'HEAD', b'POST', b'PUT', b'DELETE', b'TRACE', b'CONNECT']) #Same methods recognized by scapy_http
+REQUEST_FIRST_BYTES = frozenset(method[0] for method in REQUEST_METHODS)
+HEADER_FIELDS = {b'host': 'Host', b'user-agent': 'User-Agent'} #Lower-case header name -> field name read by Plug-ins
+MAX_HEAD_LENGTH = 8192 #Only the first <MAX_HEAD_LENGTH> bytes of a payload are scanned for header lines
+
+_ethertype = struct.Struct('!H')
+_ipv4 = struct.Struct('!BxH5xB2x4s4s') #version/ihl, total length, protocol, src, dst
+_ipv6 = struct.Struct('!4xHBx16s16s') #payload length, next header, src, dst
+_ports = struct.Struct('!HH8xB') #sport, dport, data offset
+
+class HttpHead(object):
+    """
+    Parsed HTTP request or response head, exposes fields like scapy_http layers do for StatisticVisitor._get_field_value
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+class IpInfo(object):
+    """
+    Network and transport header values of a frame, <len> mirrors Scapy's IP total length read by Plug-ins.
+    Addresses are kept packed (4 or 16 bytes) to avoid formatting on the hot path.
+    """
+    __slots__ = ('src', 'dst', 'sport', 'dport', 'len')
+
+class FastPacket(object):
+    """
+    Stand-in of a Scapy packet produced by parse_frame
+    """
+    __slots__ = ('time', 'payload', 'request', 'response')
+
+def locate_tcp_payload(frame, linktype=LINKTYPE_ETHERNET):
+    """
+    Walk link, IP and TCP headers in place without copying the frame
+
+    :param frame: bytes, bytearray or memoryview of a captured frame
+    :param linktype: pcap link-layer type of the frame
+    :return (IpInfo, payload start, payload end), or None when the frame is not TCP over IPv4/IPv6
+    """
+    frame_length = len(frame)
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 14
+        if frame_length < offset:
+            return None
+        ethertype = _ethertype.unpack_from(frame, 12)[0]
+        while ethertype in ETHERTYPE_VLAN and frame_length >= offset+4: #Skip 802.1Q/802.1ad tags
+            ethertype = _ethertype.unpack_from(frame, offset+2)[0]
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+        if frame_length < offset:
+            return None
+        ethertype = _ethertype.unpack_from(frame, 14)[0]
+    elif linktype == LINKTYPE_RAW:
+        offset = 0
+        if frame_length < 1:
+            return None
+        ethertype = ETHERTYPE_IPV4 if frame[0]>>4 == 4 else ETHERTYPE_IPV6
+    else:
+        return None
+
+    info = IpInfo()
+    if ethertype == ETHERTYPE_IPV4:
+        if frame_length < offset+20:
+            return None
+        version_ihl, total_length, protocol, info.src, info.dst = _ipv4.unpack_from(frame, offset)
+        if protocol != IPPROTO_TCP:
+            return None
+        end = offset + total_length
+        offset += (version_ihl & 0x0f)*4
+        info.len = total_length
+    elif ethertype == ETHERTYPE_IPV6:
+        if frame_length < offset+40:
+            return None
+        payload_length, next_header, info.src, info.dst = _ipv6.unpack_from(frame, offset)
+        if next_header != IPPROTO_TCP: #Extension headers are not followed
+            return None
+        end = offset + 40 + payload_length
+        offset += 40
+        info.len = 40 + payload_length
+    else:
+        return None
+
+    if frame_length < offset+20:
+        return None
+    info.sport, info.dport, data_offset = _ports.unpack_from(frame, offset)
+    offset += (data_offset>>4)*4
+    if end > frame_length: #Truncated by snaplen
+        end = frame_length
+    return info, offset, end
+
+def parse_head(frame, start, end):
+    """
+    Parse the HTTP head at the start of a TCP payload, only the head bytes are ever copied
+
+    :return HttpHead of a request or a response, or None when the payload does not start a HTTP message
+    """
+    if end-start < 16 or frame[start] not in REQUEST_FIRST_BYTES and frame[start] != 0x48: #0x48: 'H' of 'HTTP/'
+        return None
+    head = bytes(frame[start:min(end, start+MAX_HEAD_LENGTH)])
+    line_end = head.find(b'\r\n')
+    if line_end < 0:
+        return None
+    first_line = head[:line_end]
+    if first_line.startswith(b'HTTP/'): #Status-Line, e.g. HTTP/1.1 200 OK
+        if len(first_line) < 13 or first_line[8] != 0x20 or not first_line[9:12].isdigit() or first_line[12] != 0x20:
+            return None
+        return HttpHead({'Status-Line': first_line.strip()})
+
+    #Request-Line, e.g. GET /path HTTP/1.1
+    method, space, rest = first_line.partition(b' ')
+    if method not in REQUEST_METHODS:
+        return None
+    path, space, version = rest.rpartition(b' ')
+    if not path or len(version) != 8 or not version.startswith(b'HTTP/'):
+        return None
+    fields = {'Method': method, 'Path': path, 'Http-Version': version}
+    head_end = head.find(b'\r\n\r\n', line_end)
+    for line in head[line_end+2:head_end if head_end >= 0 else len(head)].split(b'\r\n'):
+        name, colon, value = line.partition(b':')
+        if colon:
+            field_name = HEADER_FIELDS.get(name.strip().lower())
+            if field_name:
+                fields[field_name] = value.strip()
+    return HttpHead(fields)
+
+def parse_frame(frame, linktype=LINKTYPE_ETHERNET, timestamp=None):
+    """
+    Build a FastPacket holding the HTTP request or response carried by a raw frame
+
+    :param frame: bytes, bytearray or memoryview of a captured frame
+    :param linktype: pcap link-layer type of the frame
+    :param timestamp: capture time in sec since epoch
+    :return FastPacket, or None when the frame does not start a HTTP message
+    """
+    located = locate_tcp_payload(frame, linktype)
+    if located is None:
+        return None
+    info, start, end = located
+    head = parse_head(frame, start, end)
+    if head is None:
+        return None
+    packet = FastPacket()
+    packet.time = timestamp
+    packet.payload = info
+    if 'Method' in head.fields:
+        packet.request = head
+        packet.response = None
+    else:
+        packet.request = None
+        packet.response = head
+    return packet
@@ -0,0 +1,85 @@
+"""
+Streaming reader of libpcap capture files, used by offline replay and benchmark
+"""
+try:
+    import sys
+    import mmap
+    import struct
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+PCAP_MAGIC = { #Magic number -> (byte order, timestamp fraction per sec)
+    b'\xd4\xc3\xb2\xa1': ('<', 1000000), #Little endian, microsecond
+    b'\xa1\xb2\xc3\xd4': ('>', 1000000), #Big endian, microsecond
+    b'\x4d\x3c\xb2\xa1': ('<', 1000000000), #Little endian, nanosecond
+    b'\xa1\xb2\x3c\x4d': ('>', 1000000000) #Big endian, nanosecond
+}
+GLOBAL_HEADER_LENGTH = 24
+RECORD_HEADER_LENGTH = 16
+
+class PcapReader(object):
+    """
+    Iterate (timestamp, frame) records of a pcap file through a read-only memory map.
+    The file is never loaded whole, frames are memoryview slices paged in by the kernel on demand.
+    """
+    def __init__(self, path):
+        """
+        Open capture file and parse its global header
+
+        :param path: path to a libpcap file
+        """
+        self._file = open(path, 'rb')
+        self._map = None
+        self._view = None
+        try:
+            header = self._file.read(GLOBAL_HEADER_LENGTH)
+            if len(header) < GLOBAL_HEADER_LENGTH or header[:4] not in PCAP_MAGIC:
+                raise ValueError('Not a libpcap capture file: '+path)
+            self._endian, self._fraction = PCAP_MAGIC[header[:4]]
+            self.snaplen, self.linktype = struct.unpack(self._endian+'II', header[16:24])
+            self._record = struct.Struct(self._endian+'IIII')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+        except:
+            self.close()
+            raise
+
+    def __iter__(self):
+        """
+        Yield (timestamp, memoryview) per record, stop at end of file or on a truncated record
+        """
+        view = self._view
+        size = len(view)
+        offset = GLOBAL_HEADER_LENGTH
+        while offset + RECORD_HEADER_LENGTH <= size:
+            ts_sec, ts_frac, incl_len, orig_len = self._record.unpack_from(view, offset)
+            offset += RECORD_HEADER_LENGTH
+            if offset + incl_len > size: #Truncated capture, e.g. tcpdump killed while writing
+                break
+            yield ts_sec + ts_frac/self._fraction, view[offset:offset+incl_len]
+            offset += incl_len
+
+    def close(self):
+        """
+        Release memory map and file handle
+        """
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError: #Frames still referenced by caller, released by garbage collector
+                pass
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,103 @@
+"""
+Bounded ring buffer decoupling packet capture from Plug-in processing
+"""
+try:
+    import sys
+    import threading
+    from collections import deque
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class PacketRing(object):
+    """
+    Bounded FIFO between capture threads (producers, one per interface) and one or more consumer workers.
+    A full ring drops the incoming packet and counts it, capture never blocks on slow Plug-ins.
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: max packets buffered before overflow
+        """
+        self.capacity = capacity
+        self.enqueued = 0 #Packets accepted into the ring, updated by producers under lock
+        self.dropped = 0 #Packets lost on overflow or discarded, updated under lock
+        self.processed = 0 #Packets handed to Plug-ins, updated by consumers under lock
+        self._queue = deque() #Producers append under <_producer_lock>, consumers popleft without a lock, popleft is atomic
+        self._not_empty = threading.Event()
+        self._processed_lock = threading.Lock()
+        self._producer_lock = threading.Lock() #Capacity check and counters of concurrent producers
+        self._closed = False
+
+    def put(self, item):
+        """
+        Enqueue item unless the ring is full
+
+        :return True when enqueued, False when dropped
+        """
+        with self._producer_lock:
+            if len(self._queue) >= self.capacity:
+                self.dropped += 1
+                return False
+            self._queue.append(item)
+            self.enqueued += 1
+        if not self._not_empty.is_set():
+            self._not_empty.set()
+        return True
+
+    def get_batch(self, max_size):
+        """
+        Dequeue up to <max_size> items without waiting
+
+        :return list of items, empty when the ring is empty
+        """
+        batch = []
+        popleft = self._queue.popleft
+        try:
+            for i in range(max_size):
+                batch.append(popleft())
+        except IndexError:
+            pass
+        return batch
+
+    def wait(self, timeout):
+        """
+        Block a consumer until an item is enqueued, the ring is closed or <timeout> sec elapsed
+        """
+        self._not_empty.clear()
+        if not self._queue and not self._closed: #Re-check after clear, producer may have raced us
+            self._not_empty.wait(timeout)
+
+    def mark_processed(self, count):
+        with self._processed_lock:
+            self.processed += count
+
+    def close(self):
+        """
+        Signal no more items will be enqueued, consumers exit once the ring is drained
+        """
+        self._closed = True
+        self._not_empty.set()
+
+    def discard(self):
+        """
+        Drop every buffered item and count it as dropped, used when consumers cannot drain in time
+
+        :return number of items dropped
+        """
+        discarded = 0
+        popleft = self._queue.popleft
+        try:
+            while True:
+                popleft()
+                discarded += 1
+        except IndexError:
+            pass
+        with self._producer_lock:
+            self.dropped += discarded
+        return discarded
+
+    def drained(self):
+        return self._closed and not self._queue
+
+    def __len__(self):
+        return len(self._queue)
@@ -0,0 +1,142 @@
+"""
+Self-instrumentation of the hot path, call counters and sampled timing per stage and per Plug-in
+"""
+try:
+    import sys
+    from time import perf_counter
+    from collections import OrderedDict
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class Stage(object):
+    """
+    Counters of one stage. Every call is counted, one in <interval> calls is timed, so the cost of an untimed call
+    is a decrement and a comparison. Timed calls give the average cost per item, which times <count> estimates the total.
+    Counters are updated without locking, concurrent threads may lose an increment now and then.
+    """
+    __slots__ = ('name', 'interval', 'countdown', 'calls', 'count', 'sampled', 'elapsed', 'max')
+
+    def __init__(self, name, interval):
+        """
+        :param interval: time one in <interval> calls, 1 times every call, 0 never times
+        """
+        self.name = name
+        self.interval = interval
+        self.countdown = interval if interval else sys.maxsize #Calls left before the next timed one
+        self.calls = 0 #Calls
+        self.count = 0 #Items processed by all calls, e.g. packets or records
+        self.sampled = 0 #Items processed by timed calls
+        self.elapsed = 0.0 #Sec spent in timed calls
+        self.max = 0.0 #Longest timed call in sec
+
+    def start(self):
+        """
+        Enter the stage
+
+        :return start time to hand to stop() when this call is timed, otherwise 0
+        """
+        self.countdown -= 1
+        if self.countdown > 0:
+            return 0
+        self.countdown = self.interval
+        return perf_counter()
+
+    def stop(self, started, items=1):
+        """
+        Leave the stage
+
+        :param started: value returned by start()
+        :param items: items processed by the call
+        """
+        self.calls += 1
+        self.count += items
+        if started:
+            elapsed = perf_counter()-started
+            self.sampled += items
+            self.elapsed += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+
+    def average(self):
+        """
+        Return the sampled cost per item in sec, 0 before the first timed call
+        """
+        return self.elapsed/self.sampled if self.sampled else 0.0
+
+    def total(self):
+        """
+        Return the estimated sec spent in the stage since start
+        """
+        return self.average()*self.count
+
+class DisabledStage(object):
+    """
+    Stage of a disabled Profiler, calls are neither counted nor timed
+    """
+    __slots__ = ()
+
+    def start(self):
+        return 0
+
+    def stop(self, started, items=1):
+        pass
+
+_DISABLED = DisabledStage()
+
+class Profiler(object):
+    """
+    Registry of stages in first use order, e.g. 'decode', 'record' or 'plugin TopHitsByHost'
+    """
+    def __init__(self, sample_interval=64, enabled=True):
+        """
+        :param sample_interval: time one in N calls of stages called per packet, see Stage
+        :param enabled: False hands out stages doing nothing, no stage is registered, listed or exported
+        """
+        self.sample_interval = sample_interval
+        self.enabled = enabled
+        self.stages = OrderedDict()
+
+    def stage(self, name, interval=None):
+        """
+        Return the Stage of name, created on first use
+
+        :param interval: override <sample_interval>, e.g. 1 for stages called once per batch or tick
+        """
+        if not self.enabled:
+            return _DISABLED
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name, self.sample_interval if interval is None else interval)
+        return stage
+
+    def lines(self):
+        """
+        Return one line per stage with items, average and max cost, and share of the estimated total time
+        """
+        stages = list(self.stages.values())
+        grand_total = sum(stage.total() for stage in stages) or 1.0
+        lines = ['%-40s %12s %12s %10s %10s %10s %6s' % ('stage', 'calls', 'items', 'avg us', 'max us', 'total s', 'share')]
+        for stage in stages:
+            total = stage.total()
+            lines.append('%-40s %12d %12d %10.1f %10.1f %10.3f %5.1f%%' % (stage.name[:40], stage.calls, stage.count,
+                stage.average()*1e6, stage.max*1e6, total, total*100/grand_total))
+        return lines
+
+    def metrics(self):
+        """
+        Return export samples of items and estimated sec per stage, see exercise_export.MetricsSnapshot
+        """
+        samples = []
+        for stage in self.stages.values():
+            samples.append(('http_monitor_stage_items', (('stage', stage.name),), stage.count))
+        for stage in self.stages.values():
+            samples.append(('http_monitor_stage_seconds', (('stage', stage.name),), stage.total()))
+        return samples
+
+    def summary(self, stream=None):
+        """
+        Write the stage table, e.g. at exit
+        """
+        stream = stream if stream else sys.stdout
+        stream.write('\n'.join(['<<<Profile>>>']+self.lines())+'\n')
@@ -0,0 +1,83 @@
+"""
+Sliding window of fine-grained time buckets for rolling HTTP request rates
+"""
+try:
+    import sys
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class RateWindow(object):
+    """
+    Ring buffer of <resolution> sec buckets covering the last <length> sec.
+    Adding is O(1), a bucket is recycled when the ring wraps around, so no reset ever loses counts of the window.
+    """
+    def __init__(self, length, resolution=1):
+        """
+        :param length: longest window in sec that can be queried
+        :param resolution: bucket size in sec
+        """
+        self.resolution = resolution
+        self.size = int(length//resolution)+1 #One extra bucket for the partially filled current one
+        self._counts = [0]*self.size
+        self._epochs = [None]*self.size #Bucket number stored in each slot, detects recycled slots
+        self.last_epoch = None #Bucket number of the latest add
+
+    def add(self, count, now):
+        """
+        Add count to the bucket of time now
+
+        :param count: number of events
+        :param now: time in sec since epoch
+        """
+        epoch = int(now//self.resolution)
+        slot = epoch % self.size
+        if self._epochs[slot] != epoch: #Recycle slot of an aged bucket
+            self._epochs[slot] = epoch
+            self._counts[slot] = 0
+        self._counts[slot] += count
+        if self.last_epoch is None or epoch > self.last_epoch:
+            self.last_epoch = epoch
+
+    def total(self, window, now=None):
+        """
+        Sum of counts over the last <window> sec ending at the bucket of time now
+
+        :param window: sec, capped to the ring length
+        :param now: end of the window, defaults to the latest bucket added
+        """
+        if now is None:
+            end = self.last_epoch
+        else:
+            end = int(now//self.resolution)
+        if end is None:
+            return 0
+        buckets = min(int(window//self.resolution), self.size)
+        total = 0
+        for epoch in range(end-buckets+1, end+1):
+            slot = epoch % self.size
+            if self._epochs[slot] == epoch:
+                total += self._counts[slot]
+        return total
+
+    def clear(self):
+        self._counts = [0]*self.size
+        self._epochs = [None]*self.size
+        self.last_epoch = None
+
+    def dump(self):
+        """
+        Return (bucket number, count) pairs of the ring, oldest first
+        """
+        return sorted((epoch, count) for epoch, count in zip(self._epochs, self._counts) if epoch is not None)
+
+    def load(self, buckets, resolution=None):
+        """
+        Replace the content with pairs returned by dump(), buckets older than the ring are dropped
+
+        :param resolution: bucket size in sec of the dumped window, defaults to the same as this one
+        """
+        self.clear()
+        resolution = resolution if resolution else self.resolution
+        for epoch, count in buckets:
+            self.add(count, epoch*resolution)
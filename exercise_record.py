@@ -0,0 +1,105 @@
+"""
+Per packet record holding HTTP fields decoded once and shared by all StatisticVisitor Plug-ins
+"""
+try:
+    import sys
+    import urllib.parse
+    from functools import lru_cache
+    from exercise_parser import IpInfo
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+class PacketRecord(object):
+    """
+    Decoded, truncated and interned fields of one HTTP request or response.
+    Request fields are None on a response and <status_line> is None on a request.
+    The original packet and layers are kept for Plug-ins still implementing accept_packet.
+    <flow> is (client address, client port, server address, server port) for both directions of a TCP connection,
+    <port> is the server port and <interface> the device the packet was captured on, None when replaying.
+    """
+    __slots__ = ('time', 'capture_time', 'flow', 'port', 'interface', 'method', 'path', 'host', 'user_agent', 'status_line', 'section', 'payload_length',
+        'packet', 'request', 'response')
+
+class RecordBuilder(object):
+    """
+    Build PacketRecord from a Scapy packet or a FastPacket, normalizing sections through a bounded LRU cache
+    """
+    def __init__(self, config):
+        self.max_str_length = config.max_str_length
+        self.section = lru_cache(maxsize=config.section_cache_size)(self._section)
+
+    def _field(self, transaction, field_name):
+        """
+        Return decoded, truncated and interned field value, None when absent or empty
+        """
+        value = transaction.fields.get(field_name)
+        if value:
+            value = value.decode("utf-8", "replace")[:self.max_str_length] #Raw bytes of the fast parser may not be valid UTF-8
+            return sys.intern(value)
+        return None
+
+    def _section(self, host, path):
+        """
+        Return 'http://<host>/<first path segment>', URL decoded, without parameters and duplicated slashes
+        """
+        section_str = 'http://'+host
+        if path:
+            for string in urllib.parse.unquote(path).split('/'): #Normalize multiple slash '/', e.g. //folder1/folder2
+                if len(string) > 0:
+                    string = string.split('?')[0] #Remove request parameters
+                    if len(string) > 0:
+                        section_str += '/'+string[:self.max_str_length] #Trim section to max length
+                    break
+        return sys.intern(section_str)
+
+    @staticmethod
+    def flow(packet, is_request):
+        """
+        Return the TCP connection of a packet seen from the client, None when the packet has no IP and TCP header
+
+        :param packet: Scapy packet, or FastPacket whose payload is the IpInfo of the fast parser
+        :param is_request: packet travels from client to server
+        """
+        info = packet.payload
+        if isinstance(info, IpInfo): #Packed addresses
+            src, sport, dst, dport = info.src, info.sport, info.dst, info.dport
+        else: #Scapy layers
+            ip = packet.getlayer('IP') or packet.getlayer('IPv6')
+            tcp = packet.getlayer('TCP')
+            if ip is None or tcp is None:
+                return None
+            src, sport, dst, dport = ip.src, tcp.sport, ip.dst, tcp.dport
+        return (src, sport, dst, dport) if is_request else (dst, dport, src, sport)
+
+    def build(self, packet, request, response, timestamp, interface=None):
+        """
+        :param packet: Scapy packet, or FastPacket from the fast parser
+        :param request: HTTP request layer, None if absent
+        :param response: HTTP response layer, None if absent
+        :param timestamp: time the packet is accounted at
+        :param interface: device name the packet was captured on
+        """
+        record = PacketRecord()
+        record.time = timestamp
+        capture_time = getattr(packet, 'time', None)
+        record.capture_time = float(capture_time) if capture_time is not None else timestamp #Time on the wire, for response times
+        record.flow = flow = self.flow(packet, request is not None)
+        record.port = flow[3] if flow else None
+        record.interface = interface
+        record.packet = packet
+        record.request = request
+        record.response = response
+        record.status_line = self._field(response, 'Status-Line') if response else None
+        if request:
+            record.method = self._field(request, 'Method')
+            record.host = host = self._field(request, 'Host')
+            record.user_agent = self._field(request, 'User-Agent')
+            path = request.fields.get('Path')
+            record.path = path.decode("utf-8", "replace")[:self.max_str_length] if path else None
+            record.section = self.section(host, record.path) if host else None
+            record.payload_length = getattr(packet.payload, 'len', 0) #IP total length
+        else:
+            record.method = record.host = record.user_agent = record.path = record.section = None
+            record.payload_length = 0
+        return record
@@ -0,0 +1,176 @@
+"""
+Multi-resolution time buckets of per key counts, answering top N over a recent window without scanning lifetime tables
+"""
+try:
+    import sys
+    import heapq
+    from operator import itemgetter
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+_count = itemgetter(1)
+
+class RollupLevel(object):
+    """
+    Ring of at most <size> buckets of <resolution> sec, bucket epoch -> {key: count}
+    """
+    __slots__ = ('resolution', 'size', 'buckets', 'newest')
+
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.size = size
+        self.buckets = {}
+        self.newest = None #Epoch of the newest bucket, in <resolution> units
+
+class RollupStore(object):
+    """
+    Counts per key in buckets of increasing resolution, e.g. 60 buckets of 1s, 60 of 1m and 24 of 1h.
+    Counts are added to the finest level. A bucket leaving its ring is rolled up into the bucket of the next level
+    covering it, keeping the <max_keys> largest counts, and the coarsest level drops whole buckets.
+    A finest bucket reaching 2*<max_keys> keys is also cut down to its <max_keys> largest counts, so memory stays bounded
+    by about (2*finest buckets + other buckets)*<max_keys> keys whatever the number of distinct keys in the stream.
+    Every second of traffic lives in exactly one bucket, so a window sums each count once, at the resolution
+    of the level holding it: the bucket a window starts in is prorated by the share of its time inside the window,
+    as if its counts were spread evenly over it, a window within the finest level is exact to its resolution.
+    """
+    def __init__(self, levels=((1, 60), (60, 60), (3600, 24)), max_keys=1000):
+        """
+        :param levels: (resolution sec, buckets) pairs from the finest to the coarsest, resolutions must divide each other
+        :param max_keys: keys kept per bucket, the smaller counts are dropped and counted in <dropped>
+        """
+        self.levels = [RollupLevel(resolution, size) for resolution, size in levels]
+        self.max_keys = max_keys
+        self.dropped = 0 #Counts dropped when downsampling rolled up buckets
+        self.span = sum(level.resolution*level.size for level in self.levels) #Sec covered by all levels
+
+    def add(self, key, amount, timestamp):
+        """
+        Count amount for key at timestamp, late timestamps land in the level still holding their bucket
+
+        :return False when timestamp is older than every level
+        """
+        for index, level in enumerate(self.levels):
+            epoch = int(timestamp//level.resolution)
+            if level.newest is None or epoch > level.newest-level.size:
+                break
+        else:
+            return False
+        if level.newest is None or epoch > level.newest:
+            self._advance(index, epoch)
+        bucket = level.buckets.get(epoch)
+        if bucket is None:
+            bucket = level.buckets[epoch] = {}
+        elif key not in bucket and len(bucket) >= 2*self.max_keys: #Full, a distinct key stream costs one cut per <max_keys> new keys
+            bucket = self._downsample(level.buckets, epoch)
+        bucket[key] = bucket.get(key, 0)+amount
+        return True
+
+    def _advance(self, index, epoch):
+        """
+        Make epoch the newest bucket of a level, buckets leaving the ring are rolled up into the next level
+        """
+        level = self.levels[index]
+        level.newest = epoch
+        cutoff = epoch-level.size
+        upper = self.levels[index+1] if index+1 < len(self.levels) else None
+        for old in sorted(old for old in level.buckets if old <= cutoff):
+            bucket = level.buckets.pop(old)
+            if upper is None: #Coarsest level, whole bucket expires
+                continue
+            upper_epoch = old*level.resolution//upper.resolution
+            if upper.newest is None or upper_epoch > upper.newest:
+                self._advance(index+1, upper_epoch)
+            elif upper_epoch <= upper.newest-upper.size:
+                continue
+            target = upper.buckets.get(upper_epoch)
+            if target is None:
+                upper.buckets[upper_epoch] = target = {}
+            for key, count in bucket.items():
+                target[key] = target.get(key, 0)+count
+            if len(target) > self.max_keys:
+                self._downsample(upper.buckets, upper_epoch)
+        if upper is not None: #Coarser levels follow even without buckets to roll up, so their old buckets expire too
+            frontier = cutoff*level.resolution//upper.resolution
+            if upper.newest is None or frontier > upper.newest:
+                self._advance(index+1, frontier)
+
+    def _downsample(self, buckets, epoch):
+        bucket = buckets[epoch]
+        kept = dict(heapq.nlargest(self.max_keys, bucket.items(), key=_count))
+        self.dropped += sum(bucket.values())-sum(kept.values())
+        buckets[epoch] = kept
+        return kept
+
+    def expire(self, now):
+        """
+        Roll up and drop buckets as if a count was added at now, e.g. on a quiet link
+        """
+        epoch = int(now//self.levels[0].resolution)
+        if self.levels[0].newest is None or epoch > self.levels[0].newest:
+            self._advance(0, epoch)
+
+    def window(self, seconds, now):
+        """
+        Return key -> count summed over the buckets overlapping the last seconds before now,
+        the bucket the window starts in only adds the share of its counts inside the window
+        """
+        start = now-seconds
+        totals = {}
+        get = totals.get
+        covered = None #Start of the time covered by finer levels, coarser buckets only hold counts older than it
+        for level in self.levels:
+            resolution = level.resolution
+            for epoch, bucket in level.buckets.items():
+                first = epoch*resolution
+                end = first+resolution
+                if covered is not None and end > covered:
+                    end = covered
+                if end > start and first <= now:
+                    if first >= start:
+                        for key, count in bucket.items():
+                            totals[key] = get(key, 0)+count
+                    else: #Boundary bucket, counts of the time it holds before start are left out
+                        fraction = (end-start)/(end-first)
+                        for key, count in bucket.items():
+                            share = int(round(count*fraction))
+                            if share:
+                                totals[key] = get(key, 0)+share
+            if level.newest is not None:
+                covered = (level.newest-level.size+1)*resolution
+        return totals
+
+    def top(self, count, seconds, now):
+        """
+        Return up to <count> (key, count) pairs of the last seconds before now, largest first
+        """
+        return heapq.nlargest(count, self.window(seconds, now).items(), key=_count)
+
+    def clear(self):
+        for level in self.levels:
+            level.buckets.clear()
+            level.newest = None
+
+    def dump(self):
+        """
+        Return [(resolution, [(epoch, keys, counts), ...]), ...] per level, compact for checkpoints
+        """
+        return [(level.resolution, [(epoch, list(bucket.keys()), list(bucket.values())) for epoch, bucket in sorted(level.buckets.items())])
+            for level in self.levels]
+
+    def load(self, dumped, cutoff=None):
+        """
+        Replace the content with levels returned by dump(), levels whose resolution changed are skipped
+
+        :param cutoff: skip buckets ending before cutoff
+        """
+        self.clear()
+        for level, (resolution, buckets) in zip(self.levels, dumped):
+            if resolution != level.resolution:
+                continue
+            for epoch, keys, counts in buckets:
+                if cutoff is not None and (epoch+1)*resolution < cutoff:
+                    continue
+                level.buckets[epoch] = dict(zip(keys, counts))
+                if level.newest is None or epoch > level.newest:
+                    level.newest = epoch
@@ -0,0 +1,70 @@
+"""
+Load Scapy on first use, and only the layers HttpMonitor dissects.
+scapy.all registers every layer Scapy ships, which costs most of the startup time and memory of the program,
+while replaying with the fast parser or printing --help needs none of it.
+"""
+try:
+    import sys
+    import importlib
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+CAPTURE_MODULES = ('scapy.config', 'scapy.arch', 'scapy.layers.l2') #conf.L2listen, Ether/SLL link layers of captured frames
+LAYER_MODULES = CAPTURE_MODULES+('scapy.layers.inet', 'scapy.layers.inet6', 'scapy_http.http') #IPv4/TCP, IPv6 and raw link layer, HTTP on TCP
+
+_loaded = {} #Module tuple -> last module of the tuple, once imported
+_bound_ports = {80, 8080} #TCP ports dissected as HTTP
+
+def _require(names):
+    """
+    Import modules once, with the same error as a missing dependency at startup
+
+    :return last imported module
+    """
+    module = _loaded.get(names)
+    if module is None:
+        try:
+            for name in names:
+                module = importlib.import_module(name)
+        except ImportError as err:
+            sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+            exit(1)
+        _loaded[names] = module
+    return module
+
+def capture_conf():
+    """
+    Return Scapy conf with the capture socket of the platform and link layers, without dissection layers
+    """
+    _require(CAPTURE_MODULES)
+    return sys.modules['scapy.config'].conf
+
+def dissection_conf():
+    """
+    Return Scapy conf with link, IP, TCP and HTTP layers registered for dissection
+    """
+    _require(LAYER_MODULES)
+    return sys.modules['scapy.config'].conf
+
+def http():
+    """
+    Return the scapy_http.http module holding HTTPRequest and HTTPResponse
+    """
+    _require(LAYER_MODULES)
+    return sys.modules['scapy_http.http']
+
+def bind_http_ports(ports):
+    """
+    Dissect TCP payloads to and from ports as HTTP, scapy_http only binds ports 80 and 8080
+
+    :param ports: TCP ports of HTTP traffic
+    """
+    http_module = http()
+    tcp = sys.modules['scapy.layers.inet'].TCP
+    bind_layers = sys.modules['scapy.packet'].bind_layers
+    for port in ports:
+        if port not in _bound_ports:
+            bind_layers(tcp, http_module.HTTP, sport=port)
+            bind_layers(tcp, http_module.HTTP, dport=port)
+            _bound_ports.add(port)
@@ -0,0 +1,143 @@
+"""
+Shard HTTP processing across worker processes, merge their statistics back into one HttpMonitor
+"""
+try:
+    import sys
+    import signal
+    import zlib
+    import threading
+    import queue
+    import multiprocessing
+    from exercise_parser import locate_tcp_payload
+    from exercise_state import *
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+def flow_hash(frame, linktype):
+    """
+    Direction independent hash of the TCP 5-tuple, request and response of a flow land on the same shard.
+    crc32 is stable across processes, unlike hash() of bytes.
+
+    :return unsigned int, 0 for frames which are not TCP
+    """
+    located = locate_tcp_payload(frame, linktype)
+    if located is None:
+        return 0
+    info = located[0]
+    client = info.src+info.sport.to_bytes(2, 'big')
+    server = info.dst+info.dport.to_bytes(2, 'big')
+    if client > server:
+        client, server = server, client
+    return zlib.crc32(client+server)
+
+def _shard_worker(monitor_class, port, parser, replay, inbox, outbox):
+    """
+    Worker process, dissect frames of its shard and collect hits since the last sync into its own Plug-ins.
+    Plug-ins always collect, the coordinator drops deltas received while learning.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) #Ctrl+C is handled by the coordinator
+    monitor = monitor_class(None, port, parser, 0)
+    monitor.state = NormalState()
+    plugins = monitor.statistic_plugins
+    while True:
+        message = inbox.get()
+        if message[0] == 'packets':
+            for frame, linktype, timestamp, interface in message[1]:
+                if replay:
+                    monitor.clock.advance(timestamp)
+                transaction = monitor._decode(frame, linktype, timestamp)
+                if transaction:
+                    monitor._dispatch(*transaction, interface=interface)
+        elif message[0] == 'sync':
+            monitor._collect()
+            outbox.put((message[1], monitor.request_count, [plugin.delta() for plugin in plugins])) #Only deltas are kept between two syncs
+            monitor.request_count = 0
+        else: #'stop'
+            break
+
+class ShardCoordinator(object):
+    """
+    Distribute raw frames to worker processes by flow hash, merge request counts and Plug-in hits on sync
+    """
+    def __init__(self, monitor, workers, replay=False):
+        """
+        :param monitor: HttpMonitor owning the merged statistics, state and alerting
+        :param workers: number of worker processes
+        :param replay: workers follow packet timestamps when True, wall clock otherwise
+        """
+        self.monitor = monitor
+        self.workers = workers
+        self.batch_size = monitor.config.pipeline_batch_size
+        self._inboxes = [multiprocessing.Queue() for i in range(workers)]
+        self._outbox = multiprocessing.Queue()
+        self._batches = [[] for i in range(workers)]
+        self._lock = threading.Lock() #dispatch runs on the capture thread, sync on the main thread
+        self._sequence = 0
+        self._pending = False #Frames dispatched since the last sync
+        self._processes = [multiprocessing.Process(target=_shard_worker,
+            args=(type(monitor), monitor.filter, monitor.parser, replay, self._inboxes[i], self._outbox), daemon=True)
+            for i in range(workers)]
+        for process in self._processes:
+            process.start()
+
+    def dispatch(self, frame, linktype, timestamp, interface=None):
+        """
+        Queue a raw frame to the worker owning its flow, frames are shipped in batches
+        """
+        shard = flow_hash(frame, linktype) % self.workers
+        with self._lock:
+            self._pending = True
+            batch = self._batches[shard]
+            batch.append((bytes(frame), linktype, timestamp, interface))
+            if len(batch) >= self.batch_size:
+                self._inboxes[shard].put(('packets', batch))
+                self._batches[shard] = []
+
+    def sync(self, timeout=None):
+        """
+        Flush pending batches, collect per worker deltas since the last sync and merge them into the monitor.
+        Plug-in deltas are dropped while learning, the same as the single process skipping Plug-ins.
+
+        :param timeout: max sec to wait for each worker, None to wait forever
+        :return True when all workers answered, False on timeout
+        """
+        with self._lock:
+            if not self._pending: #Nothing to merge, skip the round trip
+                return True
+            self._pending = False
+            self._sequence += 1
+            for shard in range(self.workers):
+                if self._batches[shard]:
+                    self._inboxes[shard].put(('packets', self._batches[shard]))
+                    self._batches[shard] = []
+                self._inboxes[shard].put(('sync', self._sequence))
+        learning = self.monitor.state.check_state(LearnState)
+        received = 0
+        while received < self.workers:
+            try:
+                sequence, request_count, plugin_hits = self._outbox.get(timeout=timeout)
+            except queue.Empty: #Late deltas are merged on a later sync
+                return False
+            with self.monitor.dispatch_lock:
+                self.monitor.request_count += request_count
+                if not learning:
+                    for plugin, hits in zip(self.monitor.statistic_plugins, plugin_hits):
+                        plugin.merge(hits)
+            if sequence == self._sequence:
+                received += 1
+        return True
+
+    def stop(self, timeout=None):
+        """
+        Stop and join all worker processes, pending frames not yet synced are discarded
+
+        :param timeout: max sec to wait for each worker, a worker still busy afterwards is terminated
+        """
+        for inbox in self._inboxes:
+            inbox.put(('stop',))
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
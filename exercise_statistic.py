@@ -1,21 +1,45 @@
 try:
     import sys
-    import urllib
+    import os
     import time
-    from termcolor import colored, cprint
+    import socket
+    from collections import OrderedDict, deque
+    from operator import itemgetter
+    from termcolor import colored
+    from exercise_clock import Clock
+    from exercise_hits import new_hits, ExactHits
+    from exercise_histogram import LogHistogram
+    from exercise_hyperloglog import HyperLogLog, hash64
+    from exercise_rollup import RollupStore
+    from exercise_record import RecordBuilder
 except ImportError as err:
     sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
     exit(1)
 
+def window_name(seconds):
+    """
+    Return a short label of a window length, e.g. '90s', '5m' or '24h'
+    """
+    for unit, size in (('h', 3600), ('m', 60)):
+        if seconds >= size and seconds % size == 0:
+            return str(seconds//size)+unit
+    return str(seconds)+'s'
+
 class StatisticVisitor(object):
     """
     Abstract base class of Statistic Plug-in
     """
-    def __init__(self, config):
-        self.hits = {}
+    def __init__(self, config, clock=None):
+        self.hits = new_hits(config, type(self).__name__) #ExactHits or bounded SpaceSavingHits, see <hits_backend>
+        self.clock = clock if clock else Clock() #Shared with HttpMonitor, follows packet timestamps during replay
         self.max_top_hits = config.max_top_hits
         self.max_retention_length = config.max_retention_length
         self.max_str_length = config.max_str_length
+        self.config = config
+        self.rollup = RollupStore(config.rollup_levels, config.rollup_max_keys) if config.rollup_levels else None #Counts per time bucket for windowed top N
+        self.window = config.dashboard_window #Sec of the dashboard top N window, None for counts since the key was first seen
+        self._record_builder = None #Created on first legacy accept_packet call of a record based Plug-in
+        self._record_clock = Clock() #Pinned to the record time while a Plug-in not aware of records runs
 
     """
     Sub-class shall return relevant headline text for printing
@@ -24,155 +48,717 @@ class StatisticVisitor(object):
         pass
 
     """
-    Sub-class shall process fields of interest in the packet
+    Sub-class shall process fields of interest in the packet, or override accept_record instead
     """
     def accept_packet(self, packet, request, response):
-        pass
+        if type(self).accept_record is not StatisticVisitor.accept_record: #Record based Plug-in called per packet
+            if self._record_builder is None:
+                self._record_builder = RecordBuilder(self.config)
+            self.accept_record(self._record_builder.build(packet, request, response, self.clock.time()))
 
-    def print(self):
+    def accept_record(self, record):
+        """
+        Process a PacketRecord whose fields were decoded once for all Plug-ins.
+        Default hands the original packet and layers to accept_packet, for Plug-ins not aware of records.
+        Records reach Plug-ins on the tick after capture, meanwhile the Plug-in clock reads the record time.
         """
-        Sort, print & trim Top N hits
+        clock = self.clock
+        self._record_clock.replay_time = record.time
+        self.clock = self._record_clock
+        try:
+            self.accept_packet(record.packet, record.request, record.response)
+        finally:
+            self.clock = clock
 
-        :param title: A short text description to be printed at top of the section
-        :param hits: Dictionary object stores hits info in key, value pair
+    def accept_batch(self, records):
         """
-        cprint('\n\r'+self.visit_title(),'white', 'on_grey')
-        if len(self.hits) == 0: 
-            return
-        count = 0
-        for key,value in sorted(self.hits.items(), key=lambda kv: (kv[1][0],kv[1][1]), reverse=True): #Sort by value and last timestamp
-            print(key+': '+colored(str(value[0]),'blue')+' last seen: '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(value[1])))   
-            count+=1
-            if count >= self.max_top_hits: #Limit top N hits to screen
-                break
-        #Trim hits and return
-        trim_hits = sorted(self.hits.items(), key=lambda kv: (kv[1][1])) #Sort by last seen in asecdent
-        while len(trim_hits) > 0:
-            if time.time()-trim_hits[0][1][1] > self.max_retention_length:
-                self.hits.pop(trim_hits[0][0]) #Remove aging item by key
-                trim_hits.pop(0) #Sync sorted list
-            else:
-                break
+        Process a list of PacketRecord, one call per batch instead of per packet.
+        Sub-class may override for a faster batch path, default hands each record to accept_record.
+        """
+        accept_record = self.accept_record
+        for record in records:
+            accept_record(record)
+
+    def count(self, key, amount, timestamp):
+        """
+        Count <amount> hits of key seen at timestamp, in the hits table and in the time buckets of windowed top N
+        """
+        self.hits.add(key, amount, timestamp)
+        if self.rollup:
+            self.rollup.add(key, amount, timestamp)
+
+    def merge(self, hits):
+        """
+        Merge hits collected by another instance, e.g. a shard worker, counts add up and last seen keeps the latest.
+        Merged counts fall in the time bucket of their last seen, deltas of one tick stay within a bucket or two.
+
+        :param hits: dictionary of key -> [count, last_seen] or [count, last_seen, error], as returned by delta()
+        """
+        self.hits.merge(hits)
+        if self.rollup:
+            for key, value in hits.items():
+                self.rollup.add(key, value[0], value[1])
+
+    def delta(self):
+        """
+        Return hits collected since the last call and forget them, a shard worker only sends what changed
+
+        :return dictionary of key -> [count, last_seen], followed by the over-estimation bound for keys of a bounded table with one
+        """
+        hits = dict(self.hits)
+        for key, error in getattr(self.hits, 'errors', {}).items():
+            hits[key].append(error)
+        self.hits.clear()
+        if self.rollup:
+            self.rollup.clear() #Rebuilt from deltas by the receiving side
+        return hits
+
+    def dump(self):
+        """
+        Return the state to checkpoint, built from lists, dictionaries and scalars only
+        """
+        keys, counts, last_seen = self.hits.dump()
+        return keys, counts, last_seen, dict(getattr(self.hits, 'errors', {})), self.rollup.dump() if self.rollup else []
+
+    def load(self, dumped, cutoff):
+        """
+        Restore a state returned by dump()
+
+        :param cutoff: skip hits last seen and time buckets ending before cutoff
+        """
+        keys, counts, last_seen, errors, rollup = dumped[:5]
+        if errors and hasattr(self.hits, 'errors'):
+            self.hits.load(keys, counts, last_seen, cutoff, errors)
+        else:
+            self.hits.load(keys, counts, last_seen, cutoff)
+        if self.rollup:
+            self.rollup.load(rollup, cutoff)
+
+    def top(self, count, window=None):
+        """
+        Return up to <count> (key, count) pairs by count in descending order
+
+        :param window: sec before now to sum time buckets over, None for counts since the key was first seen
+        """
+        if window is None or not self.rollup:
+            return [(key, value[0]) for key, value in self.hits.top(count)]
+        return self.rollup.top(count, window, self.clock.time())
+
+    def lines(self):
+        """
+        Return the title and Top N hits as dashboard lines, the hits table keeps its top view up to date
+        so building the lines does not sort the whole table. With a <window>, only its time buckets are summed.
+        """
+        if self.window and self.rollup:
+            lines = ['', colored(self.visit_title()+' last '+window_name(self.window), 'white', 'on_grey')]
+            for key,count in self.top(self.max_top_hits, self.window):
+                value = self.hits.get(key)
+                lines.append(key+': '+colored(str(count),'blue')+(' last seen: '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(value[1])) if value else ''))
+            return lines
+        lines = ['', colored(self.visit_title(), 'white', 'on_grey')]
+        errors = getattr(self.hits, 'errors', {})
+        for key,value in self.hits.top(self.max_top_hits): #Sorted by value and last timestamp, limited to top N hits
+            error = errors.get(key) #Approximate count of a bounded hits table
+            lines.append(key+': '+colored(str(value[0]),'blue')+(' max over-count: '+str(error) if error else '')+' last seen: '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(value[1])))
+        return lines
+
+    def metrics(self):
+        """
+        Return export samples of the Top N hits and the number of keys, the cost does not grow with the number of keys
+
+        :return list of (name, labels, value), see exercise_export.MetricsSnapshot
+        """
+        plugin = type(self).__name__
+        samples = [('http_monitor_plugin_keys', (('plugin', plugin),), len(self.hits))]
+        for key,value in self.hits.top(self.max_top_hits):
+            samples.append(('http_monitor_top_hits', (('plugin', plugin), ('key', key)), value[0]))
+        if self.rollup:
+            for window in self.config.metrics_windows: #Same Top N over recent windows only
+                for key,count in self.top(self.max_top_hits, window):
+                    samples.append(('http_monitor_window_hits', (('plugin', plugin), ('window', window_name(window)), ('key', key)), count))
+        return samples
+
+    def trim(self):
+        """
+        Remove hits not seen for <max_retention_length>, oldest first without scanning fresh entries,
+        and roll up time buckets, whole buckets expire past the coarsest level
+        """
+        now = self.clock.time()
+        self.hits.expire(now-self.max_retention_length)
+        if self.rollup:
+            self.rollup.expire(now)
+
+    def print(self):
+        """
+        Print Top N hits & trim aged hits
+        """
+        for line in self.lines():
+            print(line)
+        self.trim()
 
     def _get_field_value(self, transaction, field_name):
         """
         Return decoded and truncated overlong string
         """    
         if field_name in transaction.fields:
-            value = transaction.fields[field_name].decode("utf-8")[:self.max_str_length]
+            value = transaction.fields[field_name].decode("utf-8", "replace")[:self.max_str_length] #Raw bytes of the fast parser may not be valid UTF-8
             if len(value) > 0:
                 return value
         return None
 
-class TopHitsBySection(StatisticVisitor):
+class TopHitsStatistic(StatisticVisitor):
+    """
+    Abstract base class of Plug-ins counting records under one key.
+    A batch adds up its records per key first, then updates the hits table and time buckets once per key,
+    records of a key in different finest time buckets stay apart so windowed counts are the same as per record.
+    """
+
+    """
+    Sub-class shall return the key a record is counted under, None to skip it
+    """
+    def record_key(self, record):
+        pass
+
+    def record_amount(self, record):
+        """
+        Return what a record adds to the count of its key, one hit by default
+        """
+        return 1
+
+    def accept_record(self, record):
+        key = self.record_key(record)
+        if key is not None:
+            self.count(key, self.record_amount(record), record.time)
+
+    def accept_batch(self, records):
+        resolution = self.rollup.levels[0].resolution if self.rollup else None
+        record_key = self.record_key
+        record_amount = self.record_amount
+        groups = {} #Key, or (key, finest bucket) with time buckets -> [key, amount, last seen]
+        get = groups.get
+        for record in records:
+            key = record_key(record)
+            if key is None:
+                continue
+            timestamp = record.time
+            group = (key, timestamp//resolution) if resolution else key
+            value = get(group)
+            if value is None:
+                groups[group] = [key, record_amount(record), timestamp]
+            else:
+                value[1] += record_amount(record)
+                if timestamp > value[2]:
+                    value[2] = timestamp
+        count = self.count
+        for key, amount, timestamp in sorted(groups.values(), key=itemgetter(2)): #Oldest first, hits keep their last seen order
+            count(key, amount, timestamp)
+
+class TopHitsBySection(TopHitsStatistic):
     """
     Collect Top hits by Section
     """
     def visit_title(self):
         return '<<<Top Hits By Section>>>'
 
-    def accept_packet(self, packet, request, response):
-        if request:
-            host = self._get_field_value(request,'Host')
-            if host:
-                section_str = 'http://'+host
-                path = self._get_field_value(request,'Path')
-                if path:
-                    str_arr = urllib.parse.unquote(path).split('/') #Normalize URL decode path
-                    for string in str_arr: #Normalize multiple slash '/', e.g. //folder1/folder2
-                        if len(string) > 0:
-                            str_arr2 = string.split('?') #Remove request parameters
-                            if len(str_arr2[0]) > 0:
-                                section_str += '/'+str_arr2[0][:self.max_str_length] #Trim section to max length
-                            break
-                if section_str in self.hits:
-                    self.hits[section_str][0] += 1
-                else:
-                    self.hits[section_str] = [1,0]
-                self.hits[section_str][1] = time.time()
-
-class TopHitsByHost(StatisticVisitor):
+    def record_key(self, record):
+        return record.section
+
+class TopHitsByHost(TopHitsStatistic):
     """
     Collect Top hits request count by Host
     """
     def visit_title(self):
         return '<<<Top Hits By Domain>>>'
 
-    def accept_packet(self, packet, request, response):
-        if request:
-            host = self._get_field_value(request,'Host')
-            if host:
-                if host in self.hits:
-                    self.hits[host][0] += 1
-                else:
-                    self.hits[host] = [1,0]
-                self.hits[host][1] = time.time()
+    def record_key(self, record):
+        return record.host
 
-class TopHitsUploadByHost(StatisticVisitor):
+class TopHitsUploadByHost(TopHitsStatistic):
     """
     Collect Top hits request volume by Host
     """
     def visit_title(self):
         return '<<<Top Hits Upload Volume By Domain>>>'
 
-    def accept_packet(self, packet, request, response):
-        if request:
-            host = self._get_field_value(request,'Host')
-            if host:
-                if host in self.hits:
-                    self.hits[host][0] += packet.payload.len
-                else:
-                    self.hits[host] = [packet.payload.len,0]
-                self.hits[host][1] = time.time()
+    def record_key(self, record):
+        return record.host
+
+    def record_amount(self, record):
+        return record.payload_length
 
-class TopHitsByUserAgent(StatisticVisitor):
+class TopHitsByUserAgent(TopHitsStatistic):
     """
     Collect Top hits by User-Agent
     """
     def visit_title(self):
         return '<<<Top Hits By User-Agent>>>'
 
-    def accept_packet(self, packet, request, response):
-        if request:
-            user_agent = self._get_field_value(request,'User-Agent')
-            if user_agent:
-                if user_agent in self.hits:
-                    self.hits[user_agent][0] += 1
-                else:
-                    self.hits[user_agent] = [1,0]
-                self.hits[user_agent][1] = time.time()
+    def record_key(self, record):
+        return record.user_agent
 
-class TopHitsByHttpMethod(StatisticVisitor):
+class TopHitsByHttpMethod(TopHitsStatistic):
     """
     Collect Top hits by HTTP Method
     """
     def visit_title(self):
         return '<<<Top Hits By Method>>>'
 
-    def accept_packet(self, packet, request, response):
-        #Collect Top hits by HTTP Method
-        if request:
-            request_method = self._get_field_value(request,'Method')
-            if request_method:
-                if request_method in self.hits:
-                    self.hits[request_method][0] += 1
-                else:
-                    self.hits[request_method] = [1,0]
-                self.hits[request_method][1] = time.time()
-
-class TopHitsByStatusCode(StatisticVisitor):
+    def record_key(self, record):
+        return record.method
+
+class TopHitsByStatusCode(TopHitsStatistic):
     """
     Collect Top hits by HTTP Status line
     """
     def visit_title(self):
         return '<<<Top Hits By Status Line>>>'
 
-    def accept_packet(self, packet, request, response):
-        if response:
-            status_line = self._get_field_value(response,'Status-Line')
-            if status_line:
-                if status_line in self.hits:
-                    self.hits[status_line][0] += 1
-                else:
-                    self.hits[status_line] = [1,0]
-                self.hits[status_line][1] = time.time()
\ No newline at end of file
+    def record_key(self, record):
+        return record.status_line
+
+class TopHitsByInterface(TopHitsStatistic):
+    """
+    Collect Top hits request count by capture interface
+    """
+    def visit_title(self):
+        return '<<<Top Hits By Interface>>>'
+
+    def record_key(self, record):
+        return record.interface if record.method else None
+
+class TopHitsByPort(TopHitsStatistic):
+    """
+    Collect Top hits request count by server port
+    """
+    def visit_title(self):
+        return '<<<Top Hits By Port>>>'
+
+    def record_key(self, record):
+        return str(record.port) if record.method and record.port else None
+
+QUANTILES = (0.5, 0.95, 0.99) #Response time quantiles shown on the dashboard and exported
+
+class ResponseTimeStatistic(StatisticVisitor):
+    """
+    Abstract base class of response time Plug-ins.
+    Each response is paired with the oldest pending request of its TCP connection, HTTP/1.1 answers requests in order,
+    and the time between both packets on the wire is counted in a LogHistogram per key. Pairing follows the order records
+    reach the Plug-in, not TCP sequence numbers, so a retransmitted request counts as a pipelined one and a response
+    seen before its request is unpaired, HttpMonitor hands records of all threads over in capture order.
+    Pending requests are bounded by <pairing_max_flows> connections of <pairing_max_pending> requests,
+    requests not answered within <pairing_timeout> are dropped. Keys beyond <latency_max_keys> evict the least recently seen.
+    """
+    def __init__(self, config, clock=None):
+        StatisticVisitor.__init__(self, config, clock)
+        self.hits = ExactHits(config) #Key -> [responses paired, last_seen], histograms follow its last seen order
+        self.histograms = {} #Key -> LogHistogram of response times in microseconds
+        self.flows = OrderedDict() #Flow -> deque of (request capture time, key), oldest request first
+        self.pending = 0 #Requests waiting for a response
+        self.evicted = 0 #Requests dropped on timeout or because <flows> was full
+        self.unpaired = 0 #Responses without a pending request, e.g. capture started mid-connection
+        self.shard_pending = {} #Sender -> requests waiting for a response in a shard worker, as of its last delta
+        self._sender = '%d/%d' % (os.getpid(), id(self)) #Identifies the deltas of this instance
+        self.precision_bits = config.latency_precision_bits
+        self.max_keys = config.latency_max_keys
+        self.pairing_timeout = config.pairing_timeout
+        self.max_flows = config.pairing_max_flows
+        self.max_pending = config.pairing_max_pending
+
+    """
+    Sub-class shall return the key a request is counted under, None to skip it
+    """
+    def request_key(self, record):
+        pass
+
+    def accept_record(self, record):
+        flow = record.flow
+        if flow is None:
+            return
+        if record.method:
+            key = self.request_key(record)
+            if key is not None:
+                self._push(flow, record.capture_time, key)
+        elif record.status_line:
+            requests = self.flows.get(flow)
+            if not requests:
+                self.unpaired += 1
+                return
+            request_time, key = requests.popleft()
+            self.pending -= 1
+            if not requests:
+                del self.flows[flow]
+            self.observe(key, int((record.capture_time-request_time)*1e6), record.time)
+
+    def _push(self, flow, capture_time, key):
+        flows = self.flows
+        requests = flows.get(flow)
+        if requests is None:
+            if len(flows) >= self.max_flows:
+                self._expire_flows(capture_time-self.pairing_timeout)
+                if len(flows) >= self.max_flows: #Still full of live connections, drop the least recently used
+                    self._drop_flow(next(iter(flows)))
+            requests = flows[flow] = deque()
+        else:
+            flows.move_to_end(flow)
+            if len(requests) >= self.max_pending: #Pipelined requests never answered
+                requests.popleft()
+                self.pending -= 1
+                self.evicted += 1
+        requests.append((capture_time, key))
+        self.pending += 1
+
+    def _drop_flow(self, flow):
+        requests = self.flows.pop(flow)
+        self.pending -= len(requests)
+        self.evicted += len(requests)
+
+    def _expire_flows(self, cutoff):
+        """
+        Drop connections whose last request was sent before cutoff, walks from the least recently used connection
+        """
+        flows = self.flows
+        while flows:
+            flow = next(iter(flows))
+            if flows[flow][-1][0] >= cutoff:
+                break
+            self._drop_flow(flow)
+
+    def observe(self, key, latency, timestamp):
+        """
+        Count a response time of key
+
+        :param latency: microseconds, negative values of out of order timestamps count as 0
+        :param timestamp: last seen time of key
+        """
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            if len(self.hits) >= self.max_keys:
+                self._forget_key(next(iter(self.hits)))
+            histogram = self.histograms[key] = LogHistogram(self.precision_bits)
+        histogram.add(latency)
+        self.count(key, 1, timestamp)
+
+    def _forget_key(self, key):
+        self.hits.pop(key)
+        del self.histograms[key]
+
+    def pending_requests(self):
+        """
+        Return requests waiting for a response here and in the shard workers merged into this instance
+        """
+        return self.pending+sum(self.shard_pending.values())
+
+    def merge(self, delta):
+        """
+        Merge response times and pairing counters collected by another instance
+
+        :param delta: (hits, counters) as returned by delta()
+        """
+        hits, (sender, pending, evicted, unpaired) = delta
+        self.shard_pending[sender] = pending
+        self.evicted += evicted
+        self.unpaired += unpaired
+        for key, value in hits.items():
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                if len(self.hits) >= self.max_keys:
+                    self._forget_key(next(iter(self.hits)))
+                histogram = self.histograms[key] = LogHistogram(self.precision_bits)
+            histogram.merge(value[2], value[3])
+        StatisticVisitor.merge(self, hits)
+
+    def delta(self):
+        """
+        Return response times collected since the last call and forget them, with the pairing counters
+
+        :return (hits, counters), hits is a dictionary of key -> [count, last_seen, sparse histogram, max],
+            counters is (sender, requests pending now, requests dropped and unpaired responses since the last call)
+        """
+        histograms = self.histograms
+        hits = StatisticVisitor.delta(self)
+        for key, value in hits.items():
+            value.extend((histograms[key].sparse(), histograms[key].max))
+        self.histograms = {}
+        counters = (self._sender, self.pending, self.evicted, self.unpaired)
+        self.evicted = self.unpaired = 0
+        return hits, counters
+
+    def dump(self):
+        dumped = StatisticVisitor.dump(self)
+        return dumped+([(self.histograms[key].sparse(), self.histograms[key].max) for key in dumped[0]],)
+
+    def load(self, dumped, cutoff):
+        StatisticVisitor.load(self, dumped, cutoff)
+        keys, histograms = dumped[0], dumped[5]
+        self.histograms.clear()
+        for key, (sparse, maximum) in zip(keys, histograms):
+            if key in self.hits:
+                histogram = self.histograms[key] = LogHistogram(self.precision_bits)
+                histogram.merge(sparse, maximum)
+
+    def lines(self):
+        """
+        Return the title, pairing counters and Top N keys by responses with p50/p95/p99 in milliseconds.
+        With a <window>, keys are ranked by responses within it, quantiles still cover every response kept for the key.
+        """
+        windowed = self.window and self.rollup
+        lines = ['', colored(self.visit_title()+(' last '+window_name(self.window) if windowed else ''), 'white', 'on_grey'),
+            'pending requests: %d dropped: %d unpaired responses: %d' % (self.pending_requests(), self.evicted, self.unpaired)]
+        for key,count in self.top(self.max_top_hits, self.window):
+            value = self.hits.get(key)
+            histogram = self.histograms.get(key)
+            line = key+': '+colored(str(count),'blue')
+            if histogram is not None: #Evicted keys may still rank within the window
+                line += ' p50: %.1fms p95: %.1fms p99: %.1fms' % tuple(quantile/1000 for quantile in histogram.quantiles(QUANTILES))
+            if value is not None:
+                line += ' last seen: '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(value[1]))
+            lines.append(line)
+        return lines
+
+    def metrics(self):
+        """
+        Return export samples of pairing counters, and responses with p50/p95/p99 in sec of the Top N keys
+        """
+        plugin = type(self).__name__
+        samples = [('http_monitor_plugin_keys', (('plugin', plugin),), len(self.hits)),
+            ('http_monitor_pairing_pending', (('plugin', plugin),), self.pending_requests()),
+            ('http_monitor_pairing_dropped', (('plugin', plugin),), self.evicted),
+            ('http_monitor_pairing_unpaired', (('plugin', plugin),), self.unpaired)]
+        for key,value in self.hits.top(self.max_top_hits):
+            histogram = self.histograms[key]
+            samples.append(('http_monitor_responses', (('plugin', plugin), ('key', key)), value[0]))
+            for q, quantile in zip(QUANTILES, histogram.quantiles(QUANTILES)):
+                samples.append(('http_monitor_response_seconds', (('plugin', plugin), ('key', key), ('quantile', str(q))), quantile/1e6))
+        return samples
+
+    def trim(self):
+        """
+        Remove keys not seen for <max_retention_length> and requests not answered within <pairing_timeout>
+        """
+        StatisticVisitor.trim(self)
+        if len(self.histograms) != len(self.hits):
+            self.histograms = {key: self.histograms[key] for key in self.hits}
+        self._expire_flows(self.clock.time()-self.pairing_timeout)
+
+class ResponseTimeByHost(ResponseTimeStatistic):
+    """
+    Collect response time percentiles by Host
+    """
+    def visit_title(self):
+        return '<<<Response Time By Domain>>>'
+
+    def request_key(self, record):
+        return record.host
+
+class ResponseTimeBySection(ResponseTimeStatistic):
+    """
+    Collect response time percentiles by Section
+    """
+    def visit_title(self):
+        return '<<<Response Time By Section>>>'
+
+    def request_key(self, record):
+        return record.section
+
+class DistinctCountStatistic(StatisticVisitor):
+    """
+    Abstract base class of distinct count Plug-ins.
+    Counts requests per key like other Plug-ins and estimates the distinct values seen per key, e.g. client addresses,
+    with a HyperLogLog sketch of <distinct_precision> bits, fixed memory whatever the number of values.
+    Windowed estimates merge the sketches of the buckets of <distinct_bucket_size> sec overlapping the window.
+    Sketches are kept for at most <distinct_max_keys> keys, the least recently seen is evicted above it.
+    """
+    label = 'values' #Name of the distinct values on the dashboard
+
+    def __init__(self, config, clock=None):
+        StatisticVisitor.__init__(self, config, clock)
+        self.hits = ExactHits(config) #Key -> [requests, last_seen], sketches follow its last seen order
+        self.sketches = {} #Key -> HyperLogLog of values since the key was first seen
+        self.buckets = {} #Bucket epoch -> {key: HyperLogLog of values seen in the bucket}
+        self.precision = config.distinct_precision
+        self.max_keys = config.distinct_max_keys
+        self.bucket_size = config.distinct_bucket_size
+        windows = [window for window in (config.dashboard_window,)+tuple(config.metrics_windows) if window]
+        self.bucket_count = -(-max(windows)//self.bucket_size)+1 if windows and self.bucket_size else 0 #Buckets covering the longest window, 0 keeps none
+
+    """
+    Sub-class shall return (key, value) of a request whose distinct values are counted per key, None to skip it
+    """
+    def distinct_item(self, record):
+        pass
+
+    def accept_record(self, record):
+        if record.method:
+            item = self.distinct_item(record)
+            if item is not None:
+                self.observe(item[0], hash64(item[1]), record.time)
+
+    def observe(self, key, hashed, timestamp):
+        """
+        Count a request of key with a value of the given hash64()
+        """
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self._new_sketch(key)
+        sketch.add_hash(hashed)
+        if self.bucket_count:
+            bucket = self._bucket(int(timestamp//self.bucket_size))
+            if bucket is not None:
+                sketch = bucket.get(key)
+                if sketch is None and len(bucket) < self.max_keys:
+                    sketch = bucket[key] = HyperLogLog(self.precision)
+                if sketch is not None:
+                    sketch.add_hash(hashed)
+        self.count(key, 1, timestamp)
+
+    def _new_sketch(self, key):
+        if len(self.hits) >= self.max_keys:
+            forgotten = next(iter(self.hits))
+            self.hits.pop(forgotten)
+            del self.sketches[forgotten]
+        sketch = self.sketches[key] = HyperLogLog(self.precision)
+        return sketch
+
+    def _bucket(self, epoch):
+        """
+        Return the sketches of a bucket, created on first use, None when it is older than the buckets kept
+        """
+        bucket = self.buckets.get(epoch)
+        if bucket is None:
+            if self.buckets and epoch <= max(self.buckets)-self.bucket_count:
+                return None
+            bucket = self.buckets[epoch] = {}
+        return bucket
+
+    def distinct(self, key, window=None):
+        """
+        Return the estimated distinct values of key
+
+        :param window: sec before now, sketches of the buckets overlapping it are merged, None for values since the key was first seen
+        """
+        if window is None or not self.bucket_count:
+            sketch = self.sketches.get(key)
+            return sketch.count() if sketch else 0
+        start = self.clock.time()-window
+        union = HyperLogLog(self.precision)
+        for epoch, bucket in self.buckets.items():
+            if (epoch+1)*self.bucket_size > start and key in bucket:
+                union.merge(bucket[key].registers)
+        return union.count()
+
+    def merge(self, hits):
+        """
+        Merge requests and sketches collected by another instance
+
+        :param hits: dictionary of key -> [count, last_seen, registers, [(bucket epoch, registers), ...]], as returned by delta()
+        """
+        for key, value in hits.items():
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self._new_sketch(key)
+            sketch.merge(value[2])
+            for epoch, registers in value[3]:
+                bucket = self._bucket(epoch)
+                if bucket is not None:
+                    sketch = bucket.get(key)
+                    if sketch is None and len(bucket) < self.max_keys:
+                        sketch = bucket[key] = HyperLogLog(self.precision)
+                    if sketch is not None:
+                        sketch.merge(registers)
+        StatisticVisitor.merge(self, hits)
+
+    def delta(self):
+        sketches, buckets = self.sketches, self.buckets
+        hits = StatisticVisitor.delta(self)
+        for key, value in hits.items():
+            value.extend((bytes(sketches[key].registers),
+                [(epoch, bytes(bucket[key].registers)) for epoch, bucket in buckets.items() if key in bucket]))
+        self.sketches = {}
+        self.buckets = {}
+        return hits
+
+    def dump(self):
+        dumped = StatisticVisitor.dump(self)
+        return dumped+([bytes(self.sketches[key].registers) for key in dumped[0]],
+            [(epoch, list(bucket.keys()), [bytes(sketch.registers) for sketch in bucket.values()]) for epoch, bucket in sorted(self.buckets.items())])
+
+    def load(self, dumped, cutoff):
+        StatisticVisitor.load(self, dumped, cutoff)
+        keys, sketches, buckets = dumped[0], dumped[5], dumped[6]
+        size = 1<<self.precision
+        self.sketches = {key: HyperLogLog(self.precision, registers) for key, registers in zip(keys, sketches) if key in self.hits and len(registers) == size}
+        for key in self.hits:
+            if key not in self.sketches: #Precision changed since the checkpoint, estimates start over
+                self.sketches[key] = HyperLogLog(self.precision)
+        self.buckets = {}
+        if self.bucket_count:
+            for epoch, bucket_keys, registers in buckets:
+                if (epoch+1)*self.bucket_size >= cutoff:
+                    self.buckets[epoch] = {key: HyperLogLog(self.precision, sketch) for key, sketch in zip(bucket_keys, registers) if len(sketch) == size}
+
+    def lines(self):
+        """
+        Return the title and Top N keys by requests with their estimated distinct values, over <window> when set
+        """
+        window = self.window if self.window and self.rollup else None
+        lines = ['', colored(self.visit_title()+(' last '+window_name(window) if window else ''), 'white', 'on_grey')]
+        for key,count in self.top(self.max_top_hits, window):
+            value = self.hits.get(key)
+            lines.append(key+': '+colored(str(count),'blue')+' distinct '+self.label+': ~'+colored(str(self.distinct(key, window)),'blue')+
+                (' last seen: '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(value[1])) if value else ''))
+        return lines
+
+    def metrics(self):
+        """
+        Return export samples of the Top N hits and their estimated distinct values, also over <metrics_windows>
+        """
+        plugin = type(self).__name__
+        samples = StatisticVisitor.metrics(self)
+        for key,value in self.hits.top(self.max_top_hits):
+            samples.append(('http_monitor_distinct', (('plugin', plugin), ('key', key)), self.distinct(key)))
+        if self.rollup and self.bucket_count:
+            for window in self.config.metrics_windows:
+                for key,count in self.top(self.max_top_hits, window):
+                    samples.append(('http_monitor_window_distinct', (('plugin', plugin), ('window', window_name(window)), ('key', key)), self.distinct(key, window)))
+        return samples
+
+    def trim(self):
+        """
+        Remove keys not seen for <max_retention_length> and buckets older than the longest window
+        """
+        StatisticVisitor.trim(self)
+        if len(self.sketches) != len(self.hits):
+            self.sketches = {key: self.sketches[key] for key in self.hits}
+        if self.buckets:
+            oldest = int(self.clock.time()//self.bucket_size)-self.bucket_count
+            for epoch in [epoch for epoch in self.buckets if epoch <= oldest]:
+                del self.buckets[epoch]
+
+class DistinctClientsByHost(DistinctCountStatistic):
+    """
+    Estimate distinct client addresses by Host, one bot or a crowd behind a spike
+    """
+    label = 'clients'
+
+    def visit_title(self):
+        return '<<<Distinct Clients By Domain>>>'
+
+    def distinct_item(self, record):
+        if record.host and record.flow:
+            address = record.flow[0]
+            if isinstance(address, bytes): #Packed by the fast parser, text like Scapy so sketches hash the same with either parser
+                address = socket.inet_ntop(socket.AF_INET if len(address) == 4 else socket.AF_INET6, address)
+            return record.host, address
+
+class DistinctPathsByHost(DistinctCountStatistic):
+    """
+    Estimate distinct paths, query string excluded, by Host
+    """
+    label = 'paths'
+
+    def visit_title(self):
+        return '<<<Distinct Paths By Domain>>>'
+
+    def distinct_item(self, record):
+        if record.host and record.path:
+            return record.host, record.path.split('?', 1)[0]
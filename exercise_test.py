@@ -1,6 +1,45 @@
 from exercise import HttpMonitor
 import unittest
+import unittest.mock
+import os
+import tempfile
 from exercise_state import *
+from exercise_benchmark import synthesize_pcap
+from exercise_parser import parse_frame
+from exercise_pipeline import PacketRing
+from exercise_pcap import PcapReader
+import threading
+import random
+import tracemalloc
+from exercise_hits import ExactHits, SpaceSavingHits
+from exercise_rate import RateWindow
+from collections import deque
+from exercise_statistic import StatisticVisitor, TopHitsBySection, TopHitsByUserAgent, TopHitsByHttpMethod, TopHitsUploadByHost
+from exercise_record import RecordBuilder
+from exercise_bpf import build_filter, prefilter_match, compile_filter, run_filter
+from exercise_capture import PacketMmapSocket
+import socket
+from exercise_benchmark import bench_prefilter
+import shutil
+import exercise_config
+import io
+import sys
+from exercise_epoch import EpochSwap
+import time
+import subprocess
+from exercise_checkpoint import save_checkpoint, load_checkpoint, read_checkpoint, CheckpointError
+from exercise_dashboard import DashboardRenderer, CLEAR_SCREEN, CLEAR_BELOW
+from gen_traffic import TrafficProfile, TrafficGenerator, LocalHttpServer, write_pcap
+from exercise_hyperloglog import HyperLogLog
+from exercise_histogram import LogHistogram
+from exercise_statistic import ResponseTimeByHost
+from exercise_record import PacketRecord
+from exercise_export import MetricsSnapshot, MetricsServer, UdpExporter
+import urllib.request
+from termcolor import colored
+from exercise_profile import Stage
+from exercise_rollup import RollupStore
+from scapy.all import Ether, Dot1Q, IP, IPv6, TCP, UDP, Raw
 
 class TestAlertLogic(unittest.TestCase):
 
@@ -86,5 +125,1503 @@ class TestAlertLogic(unittest.TestCase):
         with self.assertRaises(Exception): state.switch(NormalState) #FAILED: enforce_alert -> enforce_normal
         state.switch(DismissState) #OK: enforce_alert -> enforce_dismiss
 
+class TestRateWindow(unittest.TestCase):
+
+    def test_rolling_total(self):
+        '''
+        Test rolling totals over any window and recycling of aged buckets
+        '''
+        rate = RateWindow(10)
+        for now in range(100, 130):
+            rate.add(now-99, now+0.5) #1, 2, ..., 30
+        self.assertEqual(rate.total(1), 30)
+        self.assertEqual(rate.total(3), 30+29+28)
+        self.assertEqual(rate.total(10), sum(range(21, 31)))
+        self.assertEqual(rate.total(100), sum(range(20, 31))) #Capped to ring length
+        self.assertEqual(rate.total(10, now=135), sum(range(27, 31))) #Buckets without traffic count as 0
+
+    def test_bounded_alert_history(self):
+        '''
+        Test alert history keeps the newest alerts when bounded
+        '''
+        state = NormalState()
+        _alert_history = deque(maxlen=2)
+        for now in range(3):
+            HttpMonitor.process_alert(state, 200, 1, 100, _alert_history, now)
+        self.assertEqual(list(_alert_history), [[200, 2], [200, 1]])
+
+    def _run_ticks(self, monitor, start, per_step, steps, stop_on_alert=True):
+        '''
+        Feed <per_step> requests per <timeout> step and return the step index of the first alert, None if none
+        '''
+        for step in range(steps):
+            monitor.clock.advance(start+step*monitor.config.timeout)
+            monitor.request_count += per_step
+            monitor._tick(render=False)
+            if stop_on_alert and monitor.state.check_state(AlertState):
+                return step
+        return None
+
+    def test_detection_latency(self):
+        '''
+        Test a spike raises an alert within a few steps instead of waiting for the end of <average_bucket_size>
+        '''
+        monitor = HttpMonitor(None, '80')
+        start = 1500000000.0
+        steps = monitor.config.average_learning_duration+monitor.config.average_bucket_size
+        self.assertIsNone(self._run_ticks(monitor, start, 10, steps)) #Learn and hold steady traffic
+        self.assertEqual(monitor.average_baseline, 10*monitor.config.average_bucket_size)
+        latency = self._run_ticks(monitor, start+steps, 30, monitor.config.average_bucket_size) #3x spike
+        #Rolling count grows by 20 per step, exceeds baseline+10% after 1200*10%/20 = 6 steps
+        self.assertIsNotNone(latency)
+        self.assertLessEqual(latency*monitor.config.timeout, 7)
+        self.assertEqual(len(monitor.alert_history), 1)
+
+        #Ongoing alert is recorded once per <average_bucket_size>, then dismissed once the window drained
+        self._run_ticks(monitor, start+steps+latency+1, 30, monitor.config.average_bucket_size, False)
+        self.assertEqual(len(monitor.alert_history), 2)
+        self._run_ticks(monitor, start+steps+latency+1+monitor.config.average_bucket_size, 10, 3*monitor.config.average_bucket_size, False)
+        self.assertTrue(monitor.state.check_state(NormalState))
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_replay_follows_packet_clock(self):
+        '''
+        Test replayed packets reach all Plug-ins and timestamps follow the capture, not the wall clock
+        '''
+        start = 1500000000.0
+        count = synthesize_pcap(self.path, 300, start=start, interval=1, hosts=3)
+        monitor = HttpMonitor(None, '80')
+        self.assertEqual(monitor.replay(self.path), count)
+
+        #Learning finished after <average_learning_duration> of packet time
+        self.assertFalse(monitor.state.check_state(LearnState))
+        self.assertGreater(monitor.average_baseline, 0)
+        self.assertEqual(monitor.clock.time(), start+299.5)
+
+        #Plug-ins only run after learning, last seen comes from packet timestamps
+        host_hits = monitor.statistic_plugins[1].hits
+        self.assertEqual(len(host_hits), 3)
+        self.assertEqual(max(value[1] for value in host_hits.values()), start+299)
+        status_hits = monitor.statistic_plugins[5].hits
+        self.assertEqual(status_hits['HTTP/1.1 200 OK'][1], start+299.5)
+
+    def test_replay_shorter_than_learning(self):
+        '''
+        Test a capture ending before learning completed reports learning status instead of an extrapolated baseline
+        '''
+        synthesize_pcap(self.path, 30, interval=1)
+        monitor = HttpMonitor(None, '80')
+        monitor.replay(self.path)
+        stdout = sys.stdout
+        sys.stdout = output = io.StringIO()
+        try:
+            monitor._print_dashboard()
+        finally:
+            sys.stdout = stdout
+        self.assertIn('Learning did not complete', output.getvalue())
+        self.assertNotIn('Average baseline', output.getvalue())
+
+        synthesize_pcap(self.path, 300, interval=1)
+        monitor = HttpMonitor(None, '80')
+        monitor.replay(self.path)
+        self.assertFalse(any('Pipeline enqueued' in line for line in monitor._dashboard_lines())) #Live capture counters, empty on replay
+
+    def test_replay_custom_port(self):
+        '''
+        Test HTTP on a port scapy_http does not bind by itself is dissected by both parsers
+        '''
+        count = write_pcap(self.path, TrafficProfile(), count=50, port=8000, hosts=3)
+        for parser in ('scapy', 'fast'):
+            monitor = HttpMonitor(None, '8000', parser)
+            monitor.state = NormalState()
+            monitor.average_baseline = 100
+            monitor.replay(self.path)
+            self.assertEqual(sum(value[0] for value in monitor.statistic_plugins[1].hits.values()), count, parser)
+
+    def test_replay_rejects_non_pcap(self):
+        '''
+        Test replaying a file which is not a pcap fails cleanly
+        '''
+        with open(self.path, 'wb') as f:
+            f.write(b'not a capture file')
+        monitor = HttpMonitor(None, '80')
+        with self.assertRaises(ValueError): monitor.replay(self.path)
+
+class TestFastParser(unittest.TestCase):
+
+    def test_request_fields(self):
+        '''
+        Test request fields read by Plug-ins are parsed from raw bytes
+        '''
+        frame = bytes(Ether()/IP()/TCP(dport=80)/Raw(b'GET /a/b?c=1 HTTP/1.1\r\nhost: example.com \r\nUser-Agent: curl/7.0\r\n\r\nbody'))
+        packet = parse_frame(memoryview(frame), timestamp=1.5)
+        self.assertIsNone(packet.response)
+        self.assertEqual(packet.time, 1.5)
+        self.assertEqual(packet.payload.len, len(frame)-14)
+        self.assertEqual(packet.request.fields['Method'], b'GET')
+        self.assertEqual(packet.request.fields['Path'], b'/a/b?c=1')
+        self.assertEqual(packet.request.fields['Host'], b'example.com')
+        self.assertEqual(packet.request.fields['User-Agent'], b'curl/7.0')
+
+    def test_response_fields(self):
+        '''
+        Test Status-Line is parsed through VLAN tag and over IPv6
+        '''
+        payload = Raw(b'HTTP/1.1 404 Not Found\r\nServer: test\r\n\r\n')
+        for frame in [Ether()/Dot1Q()/IP()/TCP(sport=80)/payload, Ether()/IPv6()/TCP(sport=80)/payload]:
+            packet = parse_frame(bytes(frame))
+            self.assertIsNone(packet.request)
+            self.assertEqual(packet.response.fields['Status-Line'], b'HTTP/1.1 404 Not Found')
+
+    def test_non_http(self):
+        '''
+        Test frames without HTTP head are skipped
+        '''
+        self.assertIsNone(parse_frame(bytes(Ether()/IP()/TCP(dport=80, flags='A'))))
+        self.assertIsNone(parse_frame(bytes(Ether()/IP()/TCP(dport=80)/Raw(b'continuation of a body segment'))))
+        self.assertIsNone(parse_frame(bytes(Ether()/IP()/UDP(dport=80)/Raw(b'GET / HTTP/1.1\r\n\r\n'))))
+        self.assertIsNone(parse_frame(b'\x00'*10))
+
+    def test_replay_matches_scapy(self):
+        '''
+        Test fast parser replay produces the same Plug-in hits as Scapy dissection
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 300, interval=1)
+            monitors = [HttpMonitor(None, '80', 'scapy'), HttpMonitor(None, '80', 'fast')]
+            for monitor in monitors:
+                monitor.replay(path)
+            self.assertEqual(monitors[0].request_count, monitors[1].request_count)
+            for expected, actual in zip(monitors[0].statistic_plugins, monitors[1].statistic_plugins):
+                self.assertTrue(len(expected.hits) > 0 or expected.visit_title() == '<<<Top Hits By Interface>>>') #Replayed packets have no interface
+                self.assertEqual(expected.hits, actual.hits)
+        finally:
+            os.remove(path)
+
+class TestPipeline(unittest.TestCase):
+
+    def test_overflow_counted(self):
+        '''
+        Test a full ring drops and counts incoming packets instead of blocking
+        '''
+        ring = PacketRing(2)
+        self.assertTrue(ring.put(1))
+        self.assertTrue(ring.put(2))
+        self.assertFalse(ring.put(3))
+        self.assertEqual((ring.enqueued, ring.dropped), (2, 1))
+        self.assertEqual(ring.get_batch(10), [1, 2])
+        self.assertEqual(ring.get_batch(10), [])
+        ring.close()
+        self.assertTrue(ring.drained())
+
+    def test_concurrent_producers(self):
+        '''
+        Test counters and capacity stay exact with one capture thread per interface feeding the ring
+        '''
+        ring = PacketRing(30000)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) #Switch threads as often as possible
+        try:
+            producers = [threading.Thread(target=lambda: [ring.put(i) for i in range(10000)]) for _ in range(4)]
+            for producer in producers:
+                producer.start()
+            for producer in producers:
+                producer.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual((ring.enqueued, ring.dropped, len(ring)), (30000, 10000, 30000))
+
+    def test_batch_consumers(self):
+        '''
+        Test consumer workers process every enqueued packet and Plug-ins see each transaction once
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 500)
+            for parser in ['scapy', 'fast']:
+                monitor = HttpMonitor(None, '80', parser)
+                monitor.state = NormalState()
+                consumers = [threading.Thread(target=monitor._consume) for i in range(2)]
+                for consumer in consumers:
+                    consumer.start()
+                with PcapReader(path) as reader:
+                    for timestamp, frame in reader:
+                        monitor._enqueue(bytes(frame), reader.linktype, timestamp)
+                        del frame
+                monitor.pipeline.close()
+                for consumer in consumers:
+                    consumer.join()
+                monitor._collect() #Statistics reach Plug-ins on the next tick
+
+                self.assertEqual(monitor.pipeline.enqueued, 1000)
+                self.assertEqual(monitor.pipeline.processed, 1000)
+                self.assertEqual(monitor.pipeline.dropped, 0)
+                self.assertEqual(monitor.request_count, 500)
+                self.assertEqual(sum(value[0] for value in monitor.statistic_plugins[1].hits.values()), 500)
+                self.assertEqual(sum(value[0] for value in monitor.statistic_plugins[5].hits.values()), 500)
+        finally:
+            os.remove(path)
+
+class TestShards(unittest.TestCase):
+
+    def test_sharded_replay_matches_single_process(self):
+        '''
+        Test alert decisions and Plug-in hits of shard workers match a single process on the same capture
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            start = 1500000000.0
+            synthesize_pcap(path, 360, start=start, interval=1) #Steady 1 request/sec, learning then normal
+            synthesize_pcap(path, 600, start=start+360, interval=0.25, append=True) #4x spike raises an alert
+            monitors = [HttpMonitor(None, '80', 'fast', 0), HttpMonitor(None, '80', 'fast', 2)]
+            for monitor in monitors:
+                monitor.replay(path)
+            single, sharded = monitors
+            self.assertTrue(len(single.alert_history) > 0)
+            self.assertEqual(single.alert_history, sharded.alert_history)
+            self.assertEqual(single.average_baseline, sharded.average_baseline)
+            self.assertEqual(single.request_count, sharded.request_count)
+            self.assertEqual(single.state.name, sharded.state.name)
+            for expected, actual in zip(single.statistic_plugins, sharded.statistic_plugins):
+                self.assertEqual(dict(expected.hits), dict(actual.hits)) #Last seen order differs within a merged tick
+                self.assertEqual(expected.hits.top(10), actual.hits.top(10))
+            for expected, actual in zip(single.statistic_plugins, sharded.statistic_plugins): #Time buckets hold the same counts
+                self.assertEqual(expected.rollup.window(expected.rollup.span, expected.clock.time()), actual.rollup.window(actual.rollup.span, actual.clock.time()))
+            for expected, actual in zip(single.statistic_plugins[6:8], sharded.statistic_plugins[6:8]): #Response time histograms
+                self.assertEqual({key: histogram.sparse() for key, histogram in expected.histograms.items()},
+                    {key: histogram.sparse() for key, histogram in actual.histograms.items()})
+            for expected, actual in zip(single.statistic_plugins[10:12], sharded.statistic_plugins[10:12]): #Merged sketches are the sketch of the union
+                self.assertEqual({key: sketch.registers for key, sketch in expected.sketches.items()}, {key: sketch.registers for key, sketch in actual.sketches.items()})
+                self.assertEqual({epoch: {key: sketch.registers for key, sketch in bucket.items()} for epoch, bucket in expected.buckets.items()},
+                    {epoch: {key: sketch.registers for key, sketch in bucket.items()} for epoch, bucket in actual.buckets.items()})
+        finally:
+            os.remove(path)
+
+class TestHits(unittest.TestCase):
+
+    def test_exact_below_capacity(self):
+        '''
+        Test Space-Saving table is exact until capacity is reached
+        '''
+        exact = ExactHits()
+        bounded = SpaceSavingHits(capacity=100)
+        for i in range(1000):
+            for hits in [exact, bounded]:
+                hits.add('key%d' % (i % 50), 1, i)
+        self.assertEqual(exact, bounded)
+        self.assertEqual(bounded.errors, {})
+
+    def test_heavy_hitters_error_bound(self):
+        '''
+        Test frequent keys survive high-cardinality noise and counts stay within the documented bound
+        '''
+        capacity = 200
+        hits = SpaceSavingHits(capacity=capacity)
+        generator = random.Random(1)
+        true_counts = {}
+        total = 0
+        for i in range(50000):
+            key = 'heavy%d' % generator.randrange(5) if generator.random() < 0.2 else 'noise%d' % generator.randrange(10**9)
+            hits.add(key, 1, i)
+            true_counts[key] = true_counts.get(key, 0) + 1
+            total += 1
+        self.assertLessEqual(len(hits), capacity)
+        top = sorted(hits.items(), key=lambda kv: kv[1][0], reverse=True)[:5]
+        self.assertEqual(set(key for key, value in top), set('heavy%d' % i for i in range(5)))
+        for key, value in hits.items():
+            self.assertGreaterEqual(value[0], true_counts[key])
+            self.assertLessEqual(value[0]-true_counts[key], hits.errors.get(key, 0))
+            self.assertLessEqual(hits.errors.get(key, 0), total/capacity)
+
+    def test_flat_memory_stress(self):
+        '''
+        Test memory of a Space-Saving table stays flat under an unbounded stream of distinct long keys
+        '''
+        hits = SpaceSavingHits(capacity=1000)
+        tracemalloc.start()
+        try:
+            def feed(start, count):
+                for i in range(start, start+count):
+                    hits.add(('/random/%d/' % i).ljust(512, 'x'), 1, i)
+                return tracemalloc.get_traced_memory()[0]
+            warm = feed(0, 10000)
+            after = feed(10000, 50000)
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(hits), 1000)
+        self.assertLess(after, warm*1.2) #6x more distinct keys, no growth beyond noise
+
+    def test_incremental_top_and_expire(self):
+        '''
+        Test incremental top view and last seen eviction match a full sort of the table
+        '''
+        generator = random.Random(2)
+        for hits in [ExactHits(top_size=10), SpaceSavingHits(capacity=300, top_size=10)]:
+            for now in range(1, 20000):
+                hits.add('key%d' % int(generator.paretovariate(1.2)*10), generator.randrange(1, 5), now)
+                if now % 1000 == 0:
+                    expected = sorted(hits.items(), key=lambda kv: (kv[1][0],kv[1][1]), reverse=True)[:10]
+                    self.assertEqual(hits.top(10), expected)
+                    cutoff = now-500
+                    expired = [key for key, value in hits.items() if value[1] < cutoff]
+                    self.assertEqual(hits.expire(cutoff), len(expired))
+                    self.assertTrue(all(value[1] >= cutoff for value in hits.values()))
+
+    def test_dictionary_updates(self):
+        '''
+        Test top view and expiry stay right when values are updated the dictionary way instead of through add()
+        '''
+        for hits in [ExactHits(top_size=2), SpaceSavingHits(capacity=100, top_size=2)]:
+            for key, now in [('a', 1), ('b', 2), ('c', 3), ('d', 4)]:
+                hits.add(key, 5, now)
+            self.assertEqual([key for key, value in hits.top(2)], ['d', 'c'])
+            for now in range(5, 11): #'b' grows to 11 hits in place, 'a' is seen again and moves ahead of 'b' in time
+                hits['b'][0] += 1
+                hits['a'][1] = now
+            hits['e'] = [1, 11]
+            self.assertEqual(hits.top(2), [('b', [11, 2]), ('a', [5, 10])])
+            self.assertEqual(hits.expire(5), 3) #'b', 'c' and 'd' were last seen before 5, behind the fresh 'a'
+            self.assertEqual(list(hits), ['a', 'e'])
+            self.assertEqual(hits.top(2), [('a', [5, 10]), ('e', [1, 11])])
+            hits.add('a', 1, 12)
+            self.assertEqual(hits.expire(11), 0) #Last seen order restored, the walk from the oldest entry works again
+            self.assertEqual(hits.expire(12), 1)
+
+    def test_merge_keeps_latest_last_seen(self):
+        '''
+        Test merging an older delta adds its counts without moving last seen back
+        '''
+        for hits in [ExactHits(), SpaceSavingHits(capacity=100)]:
+            hits.add('a', 1, 10)
+            hits.add('b', 1, 20)
+            hits.merge({'a': [2, 5], 'b': [3, 30]})
+            self.assertEqual(dict(hits), {'a': [3, 10], 'b': [4, 30]})
+            self.assertEqual(hits.expire(10), 0)
+            self.assertEqual(list(hits), ['a', 'b'])
+
+    def test_merge_keeps_errors(self):
+        '''
+        Test over-estimation bounds of bounded shard tables travel with their deltas and still bound the merged counts
+        '''
+        class Bounded(exercise_config.Config):
+            hits_capacity = 5
+        rng = random.Random(11)
+        merged = TopHitsByUserAgent(Bounded)
+        workers = [TopHitsByUserAgent(Bounded) for i in range(2)]
+        true_counts = {}
+        for sync in range(10):
+            for i in range(200):
+                key = 'agent%d' % min(int(rng.paretovariate(1.0)), 30)
+                true_counts[key] = true_counts.get(key, 0)+1
+                record = PacketRecord()
+                record.time = 1500000000.0+sync*200+i
+                record.user_agent = key
+                workers[i % 2].accept_record(record)
+            for worker in workers:
+                merged.merge(worker.delta())
+        self.assertTrue(merged.hits.errors)
+        for key, value in merged.hits.items():
+            error = merged.hits.errors.get(key, 0)
+            self.assertTrue(value[0]-error <= true_counts[key] <= value[0], (key, value[0], error, true_counts[key]))
+
+    def test_backend_per_plugin(self):
+        '''
+        Test hits backend is selected per Plug-in from Config
+        '''
+        self.assertIsInstance(TopHitsByUserAgent(exercise_config.Config).hits, SpaceSavingHits)
+        self.assertNotIsInstance(TopHitsByHttpMethod(exercise_config.Config).hits, SpaceSavingHits)
+
+class LegacyPlugin(StatisticVisitor):
+    '''
+    Third-party style Plug-in only implementing accept_packet
+    '''
+    def visit_title(self):
+        return '<<<Legacy>>>'
+
+    def accept_packet(self, packet, request, response):
+        if request:
+            host = self._get_field_value(request,'Host')
+            if host:
+                if host in self.hits:
+                    self.hits[host][0] += 1
+                else:
+                    self.hits[host] = [1,0]
+                self.hits[host][1] = self.clock.time()
+
+class TestPacketRecord(unittest.TestCase):
+
+    def test_record_fields(self):
+        '''
+        Test fields are decoded, truncated, interned and the section normalized once
+        '''
+        builder = RecordBuilder(exercise_config.Config)
+        packet = parse_frame(bytes(Ether()/IP()/TCP(dport=80)/Raw(b'GET //a%20b/c?d=1 HTTP/1.1\r\nHost: example.com\r\nUser-Agent: '+b'x'*2000+b'\r\n\r\n')))
+        record = builder.build(packet, packet.request, packet.response, 10.0)
+        self.assertEqual(record.section, 'http://example.com/a b')
+        self.assertEqual(record.method, 'GET')
+        self.assertEqual(len(record.user_agent), exercise_config.Config.max_str_length)
+        self.assertIsNone(record.status_line)
+        self.assertEqual(record.payload_length, packet.payload.len)
+        again = builder.build(packet, packet.request, packet.response, 11.0)
+        self.assertIs(record.host, again.host) #Interned
+        self.assertEqual(builder.section.cache_info().hits, 1)
+
+        for i in range(exercise_config.Config.section_cache_size*2):
+            builder.section('example.com', '/%d' % i)
+        self.assertEqual(builder.section.cache_info().currsize, exercise_config.Config.section_cache_size)
+
+    def test_legacy_plugin_compatibility(self):
+        '''
+        Test accept_packet Plug-ins keep receiving packets, and record based Plug-ins still accept packets
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            start = 1500000000.0
+            synthesize_pcap(path, 100, start=start, interval=1, hosts=4)
+            synthesize_pcap(path, 100, start=start+100, interval=1, hosts=2, append=True) #Only host0 and host1 seen lately
+            for parser in ['scapy', 'fast']:
+                monitor = HttpMonitor(None, '80', parser)
+                monitor.state = NormalState()
+                monitor.average_baseline = 100 #Enforcing from the first packet
+                legacy = LegacyPlugin(monitor.config, monitor.clock)
+                monitor.statistic_plugins.append(legacy)
+                monitor.replay(path)
+                builtin = monitor.statistic_plugins[1]
+                self.assertEqual(dict(legacy.hits), dict(builtin.hits))
+                self.assertEqual(legacy.top(10), builtin.top(10))
+                self.assertEqual(legacy.top(1), [('host1.example.com', 75)])
+                self.assertEqual(legacy.hits.expire(start+150), 2) #host2 and host3, behind entries updated in place
+                self.assertEqual(sorted(legacy.hits), ['host0.example.com', 'host1.example.com'])
+        finally:
+            os.remove(path)
+
+        section = TopHitsBySection(exercise_config.Config)
+        packet = Ether()/IP()/TCP(dport=80)/Raw(b'GET /a/b HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        packet = Ether(bytes(packet))
+        section.accept_packet(packet, packet.getlayer('HTTP Request'), None)
+        self.assertEqual(list(section.hits.keys()), ['http://example.com/a'])
+
+class TestPrefilter(unittest.TestCase):
+
+    def test_filter_expression(self):
+        '''
+        Test prefilter expression matches method tokens and status line, plain filter is unchanged
+        '''
+        self.assertEqual(build_filter('80', False), 'tcp and port 80')
+        expression = build_filter('8080')
+        self.assertTrue(expression.startswith('tcp and port 8080 and (ip6 or '))
+        for token in [b'GET ', b'POST', b'HTTP', b'OPTI']:
+            self.assertIn('= 0x'+token.hex(), expression)
+
+    @unittest.skipUnless(shutil.which('tcpdump'), 'tcpdump is required to compile BPF')
+    def test_filter_compiles(self):
+        '''
+        Test libpcap accepts the generated expression
+        '''
+        from scapy.arch.common import compile_filter
+        compile_filter(build_filter('80'))
+
+    def test_only_heads_cross(self):
+        '''
+        Test ACKs and body segments are filtered out while no HTTP head is lost
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 50, segments=True)
+            result = bench_prefilter(path)
+            self.assertEqual(result['packets'], 450)
+            self.assertEqual(result['port'], 450)
+            self.assertEqual(result['prefilter'], 100)
+            self.assertEqual(result['http'], 100)
+            self.assertEqual(result['missed'], 0)
+        finally:
+            os.remove(path)
+        self.assertTrue(prefilter_match(bytes(Ether()/IPv6()/TCP(dport=80, flags='A')), 1, 80)) #IPv6 passes unfiltered
+        self.assertFalse(prefilter_match(bytes(Ether()/IP()/TCP(dport=81)/Raw(b'GET / HTTP/1.1\r\n\r\n')), 1, 80))
+
+class Terminal(io.StringIO):
+    """
+    Text stream posing as a terminal, records every write call
+    """
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def isatty(self):
+        return True
+
+    def write(self, text):
+        self.writes.append(text)
+        return super().write(text)
+
+class TestDashboard(unittest.TestCase):
+
+    def test_only_changed_lines_redrawn(self):
+        '''
+        Test the first frame clears the screen, later frames rewrite changed lines only, each in a single write
+        '''
+        terminal = Terminal()
+        renderer = DashboardRenderer(terminal, rows=50)
+        self.assertEqual(renderer.render(['title', 'a: 1', 'b: 2']), 3)
+        self.assertIn(CLEAR_SCREEN, terminal.writes[0])
+
+        self.assertEqual(renderer.render(['title', 'a: 1', 'b: 3']), 1)
+        self.assertEqual(len(terminal.writes), 2)
+        self.assertNotIn(CLEAR_SCREEN, terminal.writes[1])
+        self.assertIn('\x1b[3;1Hb: 3', terminal.writes[1])
+        self.assertNotIn('a: 1', terminal.writes[1])
+
+        self.assertEqual(renderer.render(['title', 'a: 1', 'b: 3']), 0) #Unchanged frame
+        self.assertEqual(renderer.render(['title']), 0) #Shorter frame clears leftover lines
+        self.assertIn('\x1b[2;1H'+CLEAR_BELOW, terminal.writes[3])
+        self.assertEqual(renderer.render(['x']*80), 49) #Clipped to the terminal height
+
+    def test_plain_stream(self):
+        '''
+        Test a stream which is not a terminal receives plain frames without control sequences
+        '''
+        stream = io.StringIO()
+        renderer = DashboardRenderer(stream)
+        renderer.render(['title', 'a: 1'])
+        renderer.render(['title', 'a: 2'])
+        self.assertEqual(stream.getvalue(), 'title\na: 1\ntitle\na: 2\n')
+
+    def test_monitor_frames(self):
+        '''
+        Test learning and dashboard frames are drawn from monitor state without clearing the screen
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 200, interval=1, hosts=3)
+            monitor = HttpMonitor(None, '80')
+            monitor.renderer = DashboardRenderer(Terminal(), rows=200)
+            self.assertIn('Learning', monitor._frame()[0])
+            monitor.replay(path)
+            monitor._render()
+            frame = monitor.renderer.previous
+            self.assertTrue(any('Average baseline' in line for line in frame))
+            self.assertTrue(any('Top Hits By Domain' in line for line in frame))
+            self.assertEqual(monitor.renderer.frames, 1)
+            monitor._render()
+            self.assertEqual(monitor.renderer.lines_written, len(frame)) #Nothing changed in between
+        finally:
+            os.remove(path)
+
+class TestEpochSwap(unittest.TestCase):
+
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) #Switch threads as often as possible to provoke races
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_no_lost_increments(self):
+        '''
+        Test writers hammering their buffers while the reporter keeps swapping lose no increment
+        '''
+        epochs = EpochSwap()
+        def write(count):
+            writer = epochs.writer()
+            for i in range(count):
+                buffer = writer.begin()
+                buffer.request_count += 1
+                writer.end()
+        threads = [threading.Thread(target=write, args=(50000,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        total = 0
+        while any(thread.is_alive() for thread in threads):
+            for buffer in epochs.swap():
+                total += buffer.request_count
+                buffer.clear()
+        for buffer in epochs.swap():
+            total += buffer.request_count
+            buffer.clear()
+        self.assertGreater(epochs.swaps, 1)
+        self.assertEqual(len(epochs.writers), 4)
+        self.assertEqual(total, 200000)
+
+    def test_monitor_stress(self):
+        '''
+        Test request counts and Plug-in hits stay exact while capture threads dispatch and the reporter ticks
+        '''
+        monitor = HttpMonitor(None, '80', 'fast')
+        monitor.state = NormalState()
+        packet = parse_frame(bytes(Ether()/IP()/TCP(dport=80)/Raw(b'GET /a HTTP/1.1\r\nHost: example.com\r\n\r\n')))
+        def capture(count):
+            for i in range(count):
+                monitor._dispatch(packet, packet.request, None)
+        threads = [threading.Thread(target=capture, args=(5000,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        total = 0
+        while any(thread.is_alive() for thread in threads):
+            with monitor.dispatch_lock:
+                monitor._collect()
+                total += monitor.request_count
+                monitor.request_count = 0
+        with monitor.dispatch_lock:
+            monitor._collect()
+        total += monitor.request_count
+        self.assertEqual(total, 20000)
+        self.assertEqual(monitor.statistic_plugins[1].hits['example.com'][0], 20000)
+        self.assertEqual(monitor.statistic_plugins[4].hits['GET'][0], 20000)
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.checkpoint')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _replayed(self):
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 400, interval=1, hosts=5)
+            monitor = HttpMonitor(None, '80', 'fast')
+            monitor.replay(path)
+        finally:
+            os.remove(path)
+        self.assertFalse(monitor.state.check_state(LearnState))
+        return monitor
+
+    def test_warm_restart(self):
+        '''
+        Test a fresh checkpoint restores baseline, rate window and hits, and skips learning
+        '''
+        saved = self._replayed()
+        self.assertGreater(save_checkpoint(saved, self.path), 0)
+        restored = HttpMonitor(None, '80', 'fast')
+        restored.clock.advance(saved.clock.time()+5)
+        self.assertTrue(load_checkpoint(restored, self.path, restored.config.checkpoint_max_age))
+        self.assertTrue(restored.state.check_state(NormalState))
+        self.assertEqual(restored.average_baseline, saved.average_baseline)
+        self.assertEqual(restored.rate.total(restored.config.average_bucket_size), saved.rate.total(saved.config.average_bucket_size))
+        for expected, actual in zip(saved.statistic_plugins, restored.statistic_plugins):
+            self.assertEqual(expected.hits, actual.hits)
+            self.assertEqual(expected.hits.top(10), actual.hits.top(10))
+            self.assertEqual(expected.rollup.dump(), actual.rollup.dump())
+        self.assertEqual(restored.statistic_plugins[6].histograms['host0.example.com'].quantile(0.99),
+            saved.statistic_plugins[6].histograms['host0.example.com'].quantile(0.99))
+        for expected, actual in zip(saved.statistic_plugins[10:12], restored.statistic_plugins[10:12]): #Distinct count sketches
+            self.assertEqual(expected.dump()[5:], actual.dump()[5:])
+            self.assertEqual(expected.distinct('host0.example.com', 300), actual.distinct('host0.example.com', 300))
+
+    def test_retention_and_age(self):
+        '''
+        Test aged hits are dropped on load, and a stale checkpoint keeps the monitor learning
+        '''
+        saved = self._replayed()
+        save_checkpoint(saved, self.path)
+        saved_at = read_checkpoint(self.path)[0]
+        restored = HttpMonitor(None, '80', 'fast')
+        restored.config = type('Config', (exercise_config.Config,), {'max_retention_length': 100})
+        restored.clock.advance(saved_at+10)
+        self.assertTrue(load_checkpoint(restored, self.path, 60))
+        section_hits = restored.statistic_plugins[0].hits
+        self.assertGreater(len(section_hits), 0)
+        self.assertTrue(all(value[1] >= saved_at+10-100 for value in section_hits.values()))
+        self.assertLess(len(section_hits), len(saved.statistic_plugins[0].hits))
+
+        stale = HttpMonitor(None, '80', 'fast')
+        stale.clock.advance(saved_at+61)
+        self.assertFalse(load_checkpoint(stale, self.path, 60))
+        self.assertTrue(stale.state.check_state(LearnState))
+        self.assertEqual(len(stale.statistic_plugins[1].hits), 0)
+
+    def test_damaged_checkpoint(self):
+        '''
+        Test damaged or missing checkpoints are reported or ignored instead of loaded
+        '''
+        with open(self.path, 'wb') as f:
+            f.write(b'not a checkpoint')
+        monitor = HttpMonitor(None, '80')
+        with self.assertRaises(CheckpointError):
+            load_checkpoint(monitor, self.path, 60)
+        self.assertFalse(load_checkpoint(monitor, self.path+'.missing', 60))
+        monitor.checkpoint_path = self.path
+        self.assertFalse(monitor._resume())
+        self.assertTrue(monitor.state.check_state(LearnState))
+
+    def test_large_table_load(self):
+        '''
+        Test a checkpoint holding 100k keys loads fast
+        '''
+        monitor = HttpMonitor(None, '80')
+        monitor.state = NormalState()
+        monitor.average_baseline = 100
+        now = monitor.clock.time()
+        monitor.statistic_plugins[0].hits = ExactHits(monitor.config)
+        for i in range(100000):
+            monitor.statistic_plugins[0].hits.add('key%d' % i, i, now)
+        save_checkpoint(monitor, self.path)
+        restored = HttpMonitor(None, '80')
+        restored.statistic_plugins[0].hits = ExactHits(restored.config)
+        start = time.perf_counter()
+        self.assertTrue(load_checkpoint(restored, self.path, 60))
+        self.assertLess(time.perf_counter()-start, 1.0)
+        self.assertEqual(len(restored.statistic_plugins[0].hits), 100000)
+        self.assertEqual(restored.statistic_plugins[0].hits.top(1)[0][0], 'key99999')
+
+class TestStartup(unittest.TestCase):
+
+    def _loaded(self, code):
+        here = os.path.dirname(os.path.abspath(__file__))
+        script = code+'; import sys; print(" ".join(sorted(name for name in sys.modules if name.split(".")[0] in ("scapy", "scapy_http", "requests"))))'
+        return subprocess.run([sys.executable, '-c', script], cwd=here, stdout=subprocess.PIPE, check=True).stdout.decode().split()
+
+    def test_no_heavy_imports(self):
+        '''
+        Test importing the monitor loads neither Scapy nor requests
+        '''
+        self.assertEqual(self._loaded('import exercise'), [])
+
+    def test_fast_parser_monitor(self):
+        '''
+        Test a monitor with the fast parser does not load Scapy to bind its HTTP ports
+        '''
+        self.assertEqual(self._loaded('import exercise; exercise.HttpMonitor(None, "8000", "fast")'), [])
+
+    def test_minimal_layers(self):
+        '''
+        Test Scapy dissection only loads the layers it needs instead of scapy.all
+        '''
+        loaded = self._loaded('import exercise_scapy; exercise_scapy.dissection_conf()')
+        self.assertIn('scapy_http.http', loaded)
+        self.assertIn('scapy.layers.inet', loaded)
+        self.assertNotIn('scapy.all', loaded)
+        self.assertNotIn('scapy.layers.all', loaded)
+        self.assertNotIn('requests', loaded)
+
+class TestMmapCapture(unittest.TestCase):
+
+    def test_compiled_filter(self):
+        '''
+        Test the BPF program compiled without libpcap accepts exactly what the filter expression does
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 20, segments=True)
+            with PcapReader(path) as reader:
+                frames = [bytes(frame) for timestamp, frame in reader]
+        finally:
+            os.remove(path)
+        frames.append(bytes(Ether()/IPv6()/TCP(dport=80, flags='A')))
+        frames.append(bytes(Ether()/IP()/TCP(dport=81)/Raw(b'GET / HTTP/1.1\r\n\r\n')))
+        frames.append(bytes(Ether()/IP(flags='MF', frag=10)/TCP(dport=80)/Raw(b'GET / HTTP/1.1\r\n\r\n')))
+        frames.append(bytes(Ether()/IP()/UDP(dport=80)/Raw(b'GET / HTTP/1.1\r\n\r\n')))
+        for prefilter in [True, False]:
+            for linktype, strip in [(1, 0), (101, 14)]:
+                program = compile_filter(80, prefilter, linktype=linktype)
+                accepted = 0
+                for frame in frames[:-2]:
+                    expected = prefilter_match(frame[strip:], linktype, 80, prefilter)
+                    self.assertEqual(run_filter(program, frame[strip:]) > 0, expected)
+                    accepted += 1 if expected else 0
+                self.assertEqual(run_filter(program, frames[-2][strip:]), 0) #Non-first fragment
+                self.assertEqual(run_filter(program, frames[-1][strip:]), 0) #UDP
+                self.assertEqual(accepted, 41 if prefilter else 181)
+
+    def test_loopback_ring(self):
+        '''
+        Test only HTTP heads of local traffic reach the ring and the monitor, kernel counters are reported
+        '''
+        try:
+            sock = PacketMmapSocket('lo', 8099, True, 1<<16, 8, 10)
+        except (OSError, ValueError) as err:
+            self.skipTest('AF_PACKET capture not permitted: '+str(err))
+        sock.close()
+
+        monitor = HttpMonitor('lo', '8099', 'fast')
+        monitor.config = type('Config', (exercise_config.Config,), {'pipeline_workers': 0, 'capture_block_size': 1<<16, 'capture_block_count': 8, 'capture_block_timeout': 10})
+        monitor.capture = 'mmap'
+        monitor.state = NormalState()
+        sniff_thread = threading.Thread(target=monitor._sniff, args=('lo',))
+        sniff_thread.start()
+        server = socket.socket()
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', 8099))
+        server.listen()
+        try:
+            for wait in range(100): #Wait for the ring to be bound
+                if monitor.capture_sockets:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.1)
+            client = socket.create_connection(('127.0.0.1', 8099))
+            connection = server.accept()[0]
+            client.sendall(b'GET /a/b HTTP/1.1\r\nHost: example.com\r\n\r\n')
+            connection.recv(1000)
+            connection.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello')
+            client.recv(1000)
+            client.close()
+            connection.close()
+            time.sleep(0.3)
+        finally:
+            monitor.exit_event.set()
+            sniff_thread.join()
+            server.close()
+        monitor._collect()
+        self.assertGreater(monitor.request_count, 0)
+        self.assertEqual(list(monitor.statistic_plugins[1].hits.keys()), ['example.com'])
+        self.assertEqual(list(monitor.statistic_plugins[5].hits.keys()), ['HTTP/1.1 200 OK'])
+        received, dropped, freezes = monitor.capture_sockets['lo'].statistics()
+        self.assertEqual(received, monitor.request_count*2) #Request and response heads only
+        self.assertEqual(dropped, 0)
+        self.assertTrue(any('Kernel lo received' in line for line in monitor._dashboard_lines()))
+        self.assertEqual(dict(monitor.statistic_plugins[8].hits)['lo'][0], monitor.request_count) #Requests by interface
+
+class TestShutdown(unittest.TestCase):
+
+    def _run_and_stop(self, capture, parser):
+        monitor = HttpMonitor('lo', '8099', parser)
+        monitor.config = type('Config', (exercise_config.Config,), {'timeout': 5, 'capture_block_size': 1<<16, 'capture_block_count': 8})
+        monitor.capture = capture
+        monitor.checkpoint_path = None
+        monitor.renderer = DashboardRenderer(io.StringIO())
+        run_thread = threading.Thread(target=monitor.run)
+        run_thread.start()
+        time.sleep(1.5) #Quiet link, capture is blocked waiting for a packet
+        start = time.perf_counter()
+        monitor.stop()
+        run_thread.join(10)
+        self.assertFalse(run_thread.is_alive())
+        return time.perf_counter()-start
+
+    def test_shutdown_latency(self):
+        '''
+        Test stopping on a quiet link returns well before the next <timeout> and without any outbound traffic
+        '''
+        try:
+            PacketMmapSocket('lo', 8099, True, 1<<16, 8, 10).close()
+        except (OSError, ValueError) as err:
+            self.skipTest('Capture not permitted: '+str(err))
+        for capture, parser in [('scapy', 'scapy'), ('scapy', 'fast'), ('mmap', 'fast')]:
+            self.assertLess(self._run_and_stop(capture, parser), 1.0, capture+' capture')
+
+    def test_bounded_drain(self):
+        '''
+        Test packets consumers cannot drain in time are dropped and counted
+        '''
+        ring = PacketRing(10)
+        for i in range(5):
+            ring.put(i)
+        self.assertEqual(ring.discard(), 5)
+        self.assertEqual((len(ring), ring.dropped, ring.enqueued), (0, 5, 5))
+
+class TestMultiCapture(unittest.TestCase):
+
+    def test_port_list_filter(self):
+        '''
+        Test several ports are accepted by the expression, the compiled program and its Python equivalent alike
+        '''
+        self.assertEqual(build_filter('80,8080', False), 'tcp and (port 80 or port 8080)')
+        self.assertTrue(build_filter(['80', '8000']).startswith('tcp and (port 80 or port 8000) and (ip6 or '))
+        frames = []
+        for port in (80, 8080, 8000, 81, 443):
+            frames.append(bytes(Ether()/IP()/TCP(sport=40000, dport=port)/Raw(b'GET / HTTP/1.1\r\n\r\n')))
+            frames.append(bytes(Ether()/IP()/TCP(sport=port, dport=40000)/Raw(b'HTTP/1.1 200 OK\r\n\r\n')))
+            frames.append(bytes(Ether()/IPv6()/TCP(sport=40000, dport=port, flags='A')))
+        ports = [80, 8080, 8000]
+        for prefilter in [True, False]:
+            program = compile_filter(ports, prefilter)
+            accepted = [frame for frame in frames if run_filter(program, frame) > 0]
+            self.assertEqual(accepted, [frame for frame in frames if prefilter_match(frame, 1, ports, prefilter)])
+            self.assertEqual(len(accepted), 9)
+
+    def test_interfaces_and_ports(self):
+        '''
+        Test two interfaces and two ports are captured by one monitor into shared tables, with interface and port dimensions
+        '''
+        try:
+            PacketMmapSocket('lo', [8098, 8099], True, 1<<16, 8, 10).close()
+            PacketMmapSocket('eth0', [8098, 8099], True, 1<<16, 8, 10).close()
+        except (OSError, ValueError) as err:
+            self.skipTest('AF_PACKET capture on lo and eth0 not permitted: '+str(err))
+        monitor = HttpMonitor('lo,eth0', '8098,8099', 'fast')
+        monitor.config = type('Config', (exercise_config.Config,), {'capture_block_size': 1<<16, 'capture_block_count': 8, 'capture_block_timeout': 10})
+        monitor.capture = 'mmap'
+        monitor.state = NormalState()
+        consumer_thread = threading.Thread(target=monitor._consume)
+        consumer_thread.start()
+        sniff_threads = [threading.Thread(target=monitor._sniff, args=(interface,)) for interface in monitor.interfaces]
+        for sniff_thread in sniff_threads:
+            sniff_thread.start()
+        servers = []
+        try:
+            for port in (8098, 8099):
+                server = socket.socket()
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                server.bind(('127.0.0.1', port))
+                server.listen()
+                servers.append(server)
+            for wait in range(100): #Wait for both rings to be bound
+                if len(monitor.capture_sockets) == 2:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.1)
+            for port, server in zip((8098, 8099), servers):
+                client = socket.create_connection(('127.0.0.1', port))
+                connection = server.accept()[0]
+                client.sendall(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+                connection.recv(1000)
+                client.close()
+                connection.close()
+            time.sleep(0.3)
+        finally:
+            monitor.stop()
+            for sniff_thread in sniff_threads:
+                sniff_thread.join()
+            monitor.pipeline.close()
+            consumer_thread.join()
+            for server in servers:
+                server.close()
+        monitor._collect()
+        self.assertEqual(sorted(monitor.capture_sockets), ['eth0', 'lo'])
+        requests = monitor.request_count
+        self.assertGreater(requests, 0)
+        self.assertEqual(monitor.statistic_plugins[1].hits['example.com'][0], requests) #One table for all interfaces and ports
+        self.assertEqual(dict((key, value[0]) for key, value in monitor.statistic_plugins[8].hits.items()), {'lo': requests})
+        self.assertEqual(sorted(monitor.statistic_plugins[9].hits), ['8098', '8099'])
+        self.assertEqual(sum(value[0] for value in monitor.statistic_plugins[9].hits.values()), requests)
+
+class TestResponseTime(unittest.TestCase):
+
+    def _record(self, flow, capture_time, host=None, status_line=None):
+        record = PacketRecord()
+        record.time = record.capture_time = capture_time
+        record.flow = flow
+        record.host = host
+        record.method = 'GET' if host else None
+        record.status_line = status_line
+        return record
+
+    def test_histogram_accuracy(self):
+        '''
+        Test quantiles of a skewed distribution stay within the histogram precision
+        '''
+        rng = random.Random(7)
+        values = sorted(int(rng.lognormvariate(10, 1.5)) for i in range(20000))
+        histogram = LogHistogram(5)
+        for value in values:
+            histogram.add(value)
+        for q in (0.5, 0.9, 0.95, 0.99, 0.999):
+            expected = values[int(q*len(values)+0.5)-1]
+            self.assertLess(abs(histogram.quantile(q)-expected), expected/2**5+1, 'p'+str(q))
+        self.assertEqual(histogram.quantile(1), values[-1])
+        self.assertEqual(histogram.quantiles((0.01, 0.5, 0.99, 1)), [histogram.quantile(q) for q in (0.01, 0.5, 0.99, 1)])
+        self.assertEqual(len(histogram.counts), 465)
+
+        #Merging sparse halves gives the same histogram
+        merged = LogHistogram(5)
+        for part in (values[::2], values[1::2]):
+            half = LogHistogram(5)
+            for value in part:
+                half.add(value)
+            merged.merge(half.sparse(), half.max)
+        self.assertEqual((merged.counts, merged.count, merged.max), (histogram.counts, histogram.count, histogram.max))
+
+    def test_replay_pairing(self):
+        '''
+        Test responses of a replayed capture are paired with their request, with both parsers
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 400, interval=0.5, hosts=3)
+            for parser in ('scapy', 'fast'):
+                monitor = HttpMonitor(None, '80', parser)
+                monitor.replay(path)
+                plugin = monitor.statistic_plugins[6]
+                self.assertEqual((plugin.pending, plugin.unpaired, plugin.evicted), (0, 0, 0), parser)
+                self.assertEqual(sum(value[0] for value in plugin.hits.values()), sum(value[0] for value in monitor.statistic_plugins[1].hits.values()))
+                for histogram in plugin.histograms.values():
+                    for q in (0.5, 0.99):
+                        self.assertAlmostEqual(histogram.quantile(q), 250000, delta=250000/2**5) #Responses follow requests by half an interval
+        finally:
+            os.remove(path)
+
+    def test_pipelined_and_unpaired(self):
+        '''
+        Test pipelined requests of a connection are answered in order, and stray responses are counted
+        '''
+        plugin = ResponseTimeByHost(exercise_config.Config)
+        flow = (b'\x0a\x00\x00\x01', 40000, b'\x0a\x00\x00\x02', 80)
+        plugin.accept_batch([self._record(flow, 0.0, 'a'), self._record(flow, 0.1, 'b'),
+            self._record(flow, 0.3, status_line='HTTP/1.1 200 OK'), self._record(flow, 0.6, status_line='HTTP/1.1 200 OK'),
+            self._record(flow, 0.7, status_line='HTTP/1.1 200 OK')])
+        self.assertEqual(plugin.histograms['a'].max, 300000)
+        self.assertEqual(plugin.histograms['b'].max, 500000)
+        self.assertEqual((plugin.pending, plugin.unpaired, len(plugin.flows)), (0, 1, 0))
+
+    def test_merge_pairing_counters(self):
+        '''
+        Test pending requests of shard workers are merged as their latest value, dropped and unpaired counts add up
+        '''
+        merged = ResponseTimeByHost(exercise_config.Config)
+        workers = [ResponseTimeByHost(exercise_config.Config) for i in range(2)]
+        for i, worker in enumerate(workers):
+            flow = ('c', i, 's', 80)
+            worker.accept_batch([self._record(flow, 0.0, 'a'), self._record(flow, 0.1, 'a'), self._record(flow, 0.2, status_line='HTTP/1.1 200 OK'),
+                self._record(('c', 9, 's', 80), 0.3, status_line='HTTP/1.1 200 OK')])
+            merged.merge(worker.delta())
+        self.assertEqual((merged.pending_requests(), merged.evicted, merged.unpaired), (2, 0, 2))
+        self.assertEqual(merged.hits['a'][0], 2)
+        workers[0].accept_record(self._record(('c', 0, 's', 80), 0.4, status_line='HTTP/1.1 200 OK'))
+        merged.merge(workers[0].delta())
+        self.assertEqual((merged.pending_requests(), merged.unpaired), (1, 2)) #Gauge replaced, not added
+        self.assertEqual(merged.lines()[2], 'pending requests: 1 dropped: 0 unpaired responses: 2')
+
+    def test_pairing_across_threads(self):
+        '''
+        Test a response taken from the ring by another consumer than its request is still paired
+        '''
+        monitor = HttpMonitor(None, '80', 'fast')
+        monitor.state = NormalState()
+        monitor.statistic_plugins = [ResponseTimeByHost(monitor.config, monitor.clock)] #Test records only carry the fields it reads
+        flow = ('c', 1, 's', 80)
+        records = [self._record(flow, 1.0, status_line='HTTP/1.1 200 OK'), self._record(flow, 0.5, 'a')] #Response written first
+        def write(record):
+            writer = monitor.epochs.writer()
+            writer.begin().records.append(record)
+            writer.end()
+        for record in records:
+            thread = threading.Thread(target=write, args=(record,))
+            thread.start()
+            thread.join()
+        monitor._collect()
+        plugin = monitor.statistic_plugins[0]
+        self.assertEqual((plugin.pending, plugin.unpaired), (0, 0))
+        self.assertEqual(plugin.histograms['a'].max, 500000)
+
+    def test_window_lines(self):
+        '''
+        Test a response time Plug-in with a window ranks keys by recent responses
+        '''
+        class Windowed(exercise_config.Config):
+            dashboard_window = 60
+        plugin = ResponseTimeByHost(Windowed)
+        for i in range(100):
+            plugin.observe('old' if i < 80 else 'new', 1000, 1500000000.0+i*10)
+        plugin.clock.advance(1500000990.0)
+        lines = plugin.lines()
+        self.assertEqual(lines[1], colored('<<<Response Time By Domain>>> last 1m', 'white', 'on_grey'))
+        self.assertTrue(lines[3].startswith('new: '+colored('6', 'blue')+' p50: 1.0ms'), lines[3])
+        self.assertEqual(len(lines), 4)
+
+    def test_pending_bounds(self):
+        '''
+        Test pending requests stay bounded by connections, requests per connection and timeout
+        '''
+        class Bounded(exercise_config.Config):
+            pairing_max_flows = 100
+            pairing_max_pending = 4
+            pairing_timeout = 10
+            latency_max_keys = 50
+        plugin = ResponseTimeByHost(Bounded)
+        for i in range(1000):
+            plugin.accept_record(self._record(('c', i, 's', 80), float(i), 'host'))
+        self.assertEqual(len(plugin.flows), 100)
+        self.assertEqual((plugin.pending, plugin.evicted), (100, 900))
+        for i in range(10):
+            plugin.accept_record(self._record(('c', 0, 's', 80), 2000.0, 'host'))
+        self.assertEqual(len(plugin.flows[('c', 0, 's', 80)]), 4)
+
+        plugin.clock.advance(2005)
+        plugin.trim() #Requests older than <pairing_timeout> dropped
+        self.assertEqual((len(plugin.flows), plugin.pending), (1, 4))
+
+        for i in range(200):
+            plugin.observe('host%d' % i, 1000, 2005)
+        self.assertEqual((len(plugin.hits), len(plugin.histograms)), (50, 50))
+        self.assertIn('host199', plugin.histograms)
+
+class TestExport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            synthesize_pcap(path, 400, interval=1, hosts=5)
+            cls.monitor = HttpMonitor(None, '80', 'fast')
+            cls.monitor.replay(path)
+        finally:
+            os.remove(path)
+        with cls.monitor.dispatch_lock:
+            cls.monitor._snapshot_plugins()
+            cls.snapshot = cls.monitor._snapshot_metrics()
+
+    def test_http_endpoint(self):
+        '''
+        Test a local scrape returns the published snapshot in the text exposition format
+        '''
+        server = MetricsServer('127.0.0.1', 0)
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_port
+            with self.assertRaises(urllib.error.HTTPError): urllib.request.urlopen(url, timeout=5) #Nothing published yet
+            server.publish(self.snapshot)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                body = response.read().decode()
+        finally:
+            server.close()
+        self.assertIn('http_monitor_state{state="enforce_normal"} 1\n', body)
+        self.assertIn('http_monitor_top_hits{plugin="TopHitsByHost",key="host0.example.com"} 56\n', body)
+        self.assertIn('http_monitor_response_seconds{plugin="ResponseTimeByHost",key="host0.example.com",quantile="0.99"}', body)
+        names = [line.split()[2] for line in body.splitlines() if line.startswith('# TYPE')]
+        self.assertEqual(len(names), len(set(names))) #Samples of a metric are grouped under one TYPE line
+
+    def test_udp_batches(self):
+        '''
+        Test line protocol reaches a local collector in datagrams no larger than the packet size
+        '''
+        collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        collector.bind(('127.0.0.1', 0))
+        collector.settimeout(5)
+        exporter = UdpExporter('127.0.0.1', collector.getsockname()[1], 512)
+        try:
+            datagrams = exporter.publish(self.snapshot)
+            received = [collector.recv(65535) for i in range(datagrams)]
+        finally:
+            exporter.close()
+            collector.close()
+        self.assertLess(datagrams, len(self.snapshot.samples))
+        self.assertTrue(all(len(datagram) <= 512 for datagram in received))
+        lines = b'\n'.join(received).split(b'\n')
+        self.assertEqual(lines, self.snapshot.line_protocol())
+        self.assertIn(b'http_monitor_top_hits,plugin=TopHitsByHost,key=host0.example.com value=56 1500000399500000000', lines)
+
+    def test_bounded_cost_and_escaping(self):
+        '''
+        Test Plug-ins export Top N and aggregates only, and client supplied keys cannot break either format
+        '''
+        plugin = TopHitsByUserAgent(exercise_config.Config)
+        for i in range(5000):
+            plugin.hits.add('agent "%d", x=1\n' % i, i, 1500000000.0)
+        samples = plugin.metrics()
+        self.assertEqual(len(samples), 1+exercise_config.Config.max_top_hits)
+        snapshot = MetricsSnapshot(samples, 1500000000.0)
+        self.assertIn('key="agent \\"4999\\", x=1\\n"} 4999', snapshot.exposition().decode())
+        self.assertIn(b'key=agent\\ "4999"\\,\\ x\\=1\\n value=4999', snapshot.line_protocol()[1])
+        self.assertEqual(len(snapshot.exposition().splitlines()), len(samples)+2)
+
+class TestProfile(unittest.TestCase):
+
+    def test_sampled_stage(self):
+        '''
+        Test every call is counted, one in <interval> is timed, and interval 0 never times
+        '''
+        stage = Stage('decode', 4)
+        for i in range(100):
+            stage.stop(stage.start(), 2)
+        self.assertEqual((stage.calls, stage.count, stage.sampled), (100, 200, 50))
+        self.assertGreater(stage.total(), 0)
+        counted = Stage('decode', 0)
+        for i in range(100):
+            counted.stop(counted.start())
+        self.assertEqual((counted.calls, counted.sampled, counted.total()), (100, 0, 0))
+
+    def test_replay_stages(self):
+        '''
+        Test a replay accounts decode, record building and every Plug-in, and the dashboard section lists them
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            count = synthesize_pcap(path, 300, interval=1, hosts=3)
+            monitor = HttpMonitor(None, '80', 'fast')
+            monitor.replay(path)
+        finally:
+            os.remove(path)
+        stages = monitor.profiler.stages
+        self.assertEqual(stages['decode'].count, count)
+        self.assertGreater(stages['decode'].sampled, 0)
+        records = stages['record'].count
+        self.assertGreater(records, 0)
+        for plugin in monitor.statistic_plugins:
+            self.assertEqual(stages['plugin '+type(plugin).__name__].count, records)
+            self.assertIn('snapshot '+type(plugin).__name__, stages)
+
+        monitor.profile_dashboard = True
+        lines = monitor._frame()
+        start = lines.index(colored('<<<Profile>>>', 'white', 'on_grey'))
+        self.assertEqual(len(lines)-start-2, len(stages))
+        stream = io.StringIO()
+        monitor.profiler.summary(stream)
+        self.assertIn('plugin TopHitsByHost', stream.getvalue())
+
+    def test_disabled(self):
+        '''
+        Test a disabled profiler neither counts nor exports stages until profiling is enabled, and --profile leaves the shared settings alone
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            count = synthesize_pcap(path, 100, interval=1)
+            with unittest.mock.patch.object(exercise_config.Config, 'profile_enabled', False): #Read when the monitor is built
+                monitor = HttpMonitor(None, '80', 'fast')
+            self.assertEqual(monitor.replay(path), count)
+            self.assertEqual(len(monitor.profiler.stages), 0)
+            self.assertFalse(any(name.startswith('http_monitor_stage') for name, labels, value in monitor._snapshot_metrics().samples))
+            monitor.enable_profiling()
+            monitor.replay(path)
+            self.assertEqual(monitor.profiler.stages['decode'].count, count)
+        finally:
+            os.remove(path)
+
+        monitor = HttpMonitor(None, '80', 'fast')
+        monitor.profile_dashboard = True
+        self.assertIn(colored('<<<Profile>>>', 'white', 'on_grey'), monitor._dashboard_lines())
+        self.assertFalse(exercise_config.Config.profile_dashboard)
+        self.assertNotIn(colored('<<<Profile>>>', 'white', 'on_grey'), HttpMonitor(None, '80', 'fast')._dashboard_lines())
+
+class TestRollup(unittest.TestCase):
+
+    def test_windows_match_raw_counts(self):
+        '''
+        Test windowed sums stay between the exact counts of the window narrowed and widened by one bucket of the level reached
+        '''
+        rng = random.Random(3)
+        rollup = RollupStore(((1, 60), (60, 60), (3600, 24)), max_keys=100)
+        start = 1500000000.0
+        events = []
+        timestamp = start
+        for i in range(20000):
+            timestamp += rng.expovariate(1.5) #About 3.7h of traffic
+            key = 'k%d' % min(int(rng.paretovariate(1.2)), 50)
+            events.append((timestamp, key))
+            rollup.add(key, 1, timestamp)
+        now = timestamp
+        for window, slack in ((30, 1), (59, 1), (300, 60), (3600, 60), (3*3600, 3600)):
+            summed = rollup.window(window, now)
+            for key in ('k1', 'k2', 'k10'):
+                exact = sum(1 for t, k in events if k == key and t > now-window)
+                narrowed = sum(1 for t, k in events if k == key and t > now-window+slack)
+                widened = sum(1 for t, k in events if k == key and t > now-window-slack)
+                self.assertTrue(narrowed <= summed.get(key, 0) <= widened, (window, key, exact, summed.get(key), narrowed, widened))
+        self.assertEqual(sum(rollup.window(rollup.span, now).values())+rollup.dropped, len(events))
+        self.assertEqual(rollup.top(1, 60, now)[0][0], 'k1')
+        for level in rollup.levels:
+            self.assertLessEqual(len(level.buckets), level.size)
+
+    def test_boundary_bucket_prorated(self):
+        '''
+        Test a window starting within a minute or hour bucket only counts the share of the bucket inside the window
+        '''
+        rollup = RollupStore(((1, 60), (60, 60), (3600, 24)), max_keys=100)
+        events = [1500000000.5+i for i in range(3*3600)] #1 request/sec for 3h
+        for timestamp in events:
+            rollup.add('a', 1, timestamp)
+        now = events[-1]
+        for window in (90, 330, 3000, 5400, 7000): #Starting within the finest, minute and hour levels
+            exact = sum(1 for timestamp in events if timestamp > now-window)
+            self.assertEqual(rollup.window(window, now), {'a': exact}, window)
+
+    def test_expire_and_downsample(self):
+        '''
+        Test buckets expire whole past the coarsest level, and rolled up buckets keep the largest counts
+        '''
+        rollup = RollupStore(((1, 10), (10, 6)), max_keys=2)
+        for second in range(10):
+            rollup.add('big', 10, 100.0+second)
+            rollup.add('mid', 5, 100.0+second)
+            rollup.add('small%d' % second, 1, 100.0+second)
+        rollup.expire(125.0) #Seconds rolled up into 10s buckets, downsampled to 2 keys
+        self.assertEqual(rollup.window(60, 125.0), {'big': 100, 'mid': 50})
+        self.assertEqual(rollup.dropped, 10)
+        rollup.expire(200.0) #Past 10 sec + 6*10 sec, nothing left
+        self.assertEqual(rollup.window(rollup.span, 200.0), {})
+        self.assertFalse(rollup.add('late', 1, 100.0))
+
+    def test_flat_memory_plugin(self):
+        '''
+        Test memory of a bounded Plug-in, hits table and time buckets, stays flat under an unbounded stream of distinct long keys
+        '''
+        plugin = TopHitsByUserAgent(exercise_config.Config)
+        self.assertIsInstance(plugin.hits, SpaceSavingHits)
+        start = 1500000000.0
+        tracemalloc.start()
+        try:
+            def feed(first, count):
+                for i in range(first, first+count):
+                    timestamp = start+i/1000.0 #1000 distinct keys/sec
+                    plugin.accept_record(self._user_agent(('agent/%d/' % i).ljust(512, 'x'), timestamp))
+                    if i % 1000 == 0:
+                        plugin.clock.advance(timestamp)
+                        plugin.trim()
+                return tracemalloc.get_traced_memory()[0]
+            warm = feed(0, 60000) #Hits table and finest time buckets full
+            after = feed(60000, 60000)
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(plugin.hits), exercise_config.Config.hits_capacity)
+        for level in plugin.rollup.levels:
+            for bucket in level.buckets.values():
+                self.assertLessEqual(len(bucket), 2*plugin.rollup.max_keys)
+        self.assertLess(after, warm*1.2) #Twice as many distinct keys, no growth beyond noise
+
+    def test_dashboard_window(self):
+        '''
+        Test a Plug-in with a window shows recent counts only
+        '''
+        class Windowed(exercise_config.Config):
+            dashboard_window = 300
+        plugin = TopHitsByHttpMethod(Windowed)
+        for i in range(3600):
+            plugin.accept_record(self._request('GET' if i < 3000 else 'POST', 1500000000.0+i))
+        plugin.clock.advance(1500003599.0)
+        self.assertEqual(plugin.lines()[1], colored('<<<Top Hits By Method>>> last 5m', 'white', 'on_grey'))
+        self.assertTrue(plugin.lines()[2].startswith('POST: '+colored('301', 'blue'))) #Last 60 sec, whole minutes, and 1/60 of the minute the window starts in
+        self.assertEqual(plugin.top(1), [('GET', 3000)])
+        self.assertIn(('http_monitor_window_hits', (('plugin', 'TopHitsByHttpMethod'), ('window', '5m'), ('key', 'POST')), 301), plugin.metrics())
+
+    def test_batch_matches_records(self):
+        '''
+        Test a batch counted once per key leaves the same hits, last seen and windowed counts as one record at a time
+        '''
+        rng = random.Random(5)
+        records = []
+        for i in range(2000):
+            record = self._request(rng.choice(('GET', 'GET', 'POST', 'HEAD')), 1500000000.0+i*0.01) #Batches straddle 1s buckets
+            record.host = rng.choice(('a.com', 'b.com', None))
+            record.payload_length = rng.randint(0, 1000)
+            records.append(record)
+        for plugin_class in (TopHitsByHttpMethod, TopHitsUploadByHost):
+            single, batched = plugin_class(exercise_config.Config), plugin_class(exercise_config.Config)
+            for record in records:
+                single.accept_record(record)
+            for first in range(0, len(records), 256):
+                batched.accept_batch(records[first:first+256])
+            self.assertEqual(list(batched.hits.items()), list(single.hits.items()))
+            now = records[-1].time
+            for window in (1, 5, 20):
+                self.assertEqual(batched.rollup.window(window, now), single.rollup.window(window, now), (plugin_class, window))
+
+    def _request(self, method, timestamp):
+        record = PacketRecord()
+        record.time = timestamp
+        record.method = method
+        return record
+
+    def _user_agent(self, user_agent, timestamp):
+        record = PacketRecord()
+        record.time = timestamp
+        record.user_agent = user_agent
+        return record
+
+class TestTrafficGenerator(unittest.TestCase):
+
+    def test_profile_bursts(self):
+        '''
+        Test requests are due at the steady rate, then at the burst rate at the end of every cycle
+        '''
+        profile = TrafficProfile(10, 4, 60, 15)
+        self.assertEqual(profile.time_of(0), 0)
+        self.assertAlmostEqual(profile.time_of(449), 44.9)
+        self.assertAlmostEqual(profile.time_of(450), 45) #450 steady requests, then 40 req/sec
+        self.assertAlmostEqual(profile.time_of(450+600), 60) #Next cycle
+        self.assertEqual(profile.rate_at(44.9), 10)
+        self.assertEqual(profile.rate_at(59), 40)
+        self.assertEqual(TrafficProfile(0).time_of(1000), 0)
+
+    def test_flood_local_server(self):
+        '''
+        Test every request sent over keep-alive and pipelined connections is answered by the bundled server
+        '''
+        server = LocalHttpServer()
+        try:
+            for pipeline in (1, 4):
+                generator = TrafficGenerator(server.host, server.port, TrafficProfile(0), concurrency=8, pipeline=pipeline)
+                self.assertEqual(generator.run(10, 2000), 2000)
+                self.assertEqual(generator.sent, 2000)
+                self.assertEqual(generator.errors, 0)
+            self.assertEqual(server.requests, 4000)
+        finally:
+            server.close()
+
+    def test_synthetic_pcap_raises_alert(self):
+        '''
+        Test a synthetic capture with the configured cardinality replays to the same hits with both parsers, and its burst raises an alert
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            written = write_pcap(path, TrafficProfile(1, 4, 480, 120), 480, hosts=3, paths=7)
+            self.assertEqual(written, 360+480)
+            monitors = [HttpMonitor(None, '80', 'fast'), HttpMonitor(None, '80', 'scapy')]
+            for monitor in monitors:
+                self.assertEqual(monitor.replay(path), 2*written)
+                self.assertTrue(len(monitor.alert_history) > 0)
+                self.assertEqual(len(monitor.statistic_plugins[1].hits), 3) #Hosts
+                self.assertEqual(len(monitor.statistic_plugins[0].hits), 3*7) #Sections of each host
+            fast, scapy = monitors
+            for expected, actual in zip(fast.statistic_plugins[:6], scapy.statistic_plugins[:6]):
+                self.assertEqual(dict(expected.hits), dict(actual.hits))
+        finally:
+            os.remove(path)
+
+class TestDistinctCount(unittest.TestCase):
+
+    def test_estimate_and_merge(self):
+        '''
+        Test estimates stay within 3 standard errors, small counts are exact, and merged halves equal the sketch of all values
+        '''
+        for count in (1, 10, 100, 10000, 100000):
+            whole, first, second = HyperLogLog(), HyperLogLog(), HyperLogLog()
+            for i in range(count):
+                whole.add('10.%d.%d.%d' % (i>>16, (i>>8) & 0xff, i & 0xff))
+                (first if i % 2 else second).add('10.%d.%d.%d' % (i>>16, (i>>8) & 0xff, i & 0xff))
+            if count <= 10:
+                self.assertEqual(whole.count(), count)
+            self.assertLess(abs(whole.count()-count), 3*1.04/32*count+1)
+            first.merge(second.registers)
+            self.assertEqual(first.registers, whole.registers)
+        with self.assertRaises(ValueError): whole.merge(HyperLogLog(12).registers)
+
+    def test_distinct_clients_and_paths(self):
+        '''
+        Test distinct clients and paths per domain of a synthetic capture, lifetime and windowed, on the dashboard and in the export
+        '''
+        fd, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            write_pcap(path, TrafficProfile(2), 300, hosts=3, paths=7, clients=50)
+            monitor, scapy = HttpMonitor(None, '80', 'fast'), HttpMonitor(None, '80', 'scapy')
+            monitor.replay(path)
+            scapy.replay(path)
+        finally:
+            os.remove(path)
+        for expected, actual in zip(monitor.statistic_plugins[10:12], scapy.statistic_plugins[10:12]): #Same sketches whatever the parser
+            self.assertEqual({key: sketch.registers for key, sketch in expected.sketches.items()}, {key: sketch.registers for key, sketch in actual.sketches.items()})
+        clients, paths = monitor.statistic_plugins[10:12]
+        requests = clients.hits['host0.example.com'][0]
+        self.assertLess(abs(clients.distinct('host0.example.com')-50), 3) #Every host sees every client, 3 and 50 are coprime
+        self.assertLess(abs(paths.distinct('host0.example.com')-requests), 0.1*requests) #Each request has its own page, within 3 standard errors
+        self.assertTrue(0.9*2*60/3 < paths.distinct('host0.example.com', 60) < 1.1*2*120/3) #Last minute and the bucket it started in
+        self.assertIn('distinct clients: ~', '\n'.join(clients.lines()))
+        samples = {(name, labels): value for name, labels, value in clients.metrics()}
+        self.assertEqual(samples[('http_monitor_distinct', (('plugin', 'DistinctClientsByHost'), ('key', 'host0.example.com')))], clients.distinct('host0.example.com'))
+        self.assertIn(('http_monitor_window_distinct', (('plugin', 'DistinctClientsByHost'), ('window', '5m'), ('key', 'host0.example.com'))), samples)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,24 +1,356 @@
-import time
-import requests
-import argparse
-
 """
-Generate HTTP traffic every interval
+Generate HTTP traffic, a request every interval to a website, a high rate flood of a bundled local HTTP server,
+or an equivalent synthetic pcap file for reproducible throughput and alert benchmarks
 """
-#Parse out commandline arguments
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-    description="This program Generate HTTP traffic every interval.",
-)
-parser.add_argument("--host", "-i", help="Which host to visit.", default="www.google.com")
-parser.add_argument("--frequency", "-f", type=int, help="How frequent to visit Host.", default=5)
-args = parser.parse_args()
-
-while True:
-    try: 
-        requests.get('http://'+args.host)
-    except requests.exceptions.ConnectionError:
-        print ("network error, retry...")
-        continue
-    print ('http://'+args.host+'... at '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(time.time())))
-    time.sleep(args.frequency)
\ No newline at end of file
+try:
+    import sys
+    import time
+    import struct
+    import socket
+    import asyncio
+    import argparse
+    import threading
+    from array import array
+    import requests
+    from exercise_export import parse_address
+except ImportError as err:
+    sys.stderr.write("ERROR: found depedancies not yet installed, run 'pip install -r requirements.txt'\n\r"+str(err)+'\n\r')
+    exit(1)
+
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nok'
+RESPONSE_MARKER = b'HTTP/1.1 ' #Starts every response, the body never contains it
+
+def request_bytes(index, hosts=20, paths=200, user_agents=10):
+    """
+    Return the <index>th request, hosts, sections and User-Agents cycle with the given cardinality
+    """
+    return ('GET /section%d/page%d?id=%d HTTP/1.1\r\nHost: host%d.example.com\r\nUser-Agent: bench-agent/%d\r\nAccept: */*\r\n\r\n'
+        % (index % paths, index, index, index % hosts, index % user_agents)).encode()
+
+class TrafficProfile(object):
+    """
+    Request rate over time, <rate> req/sec with a burst of <burst_factor> times the rate lasting <burst_length> sec
+    at the end of every <burst_every> sec, so traffic starts steady, e.g. long enough for the monitor to learn
+    """
+    def __init__(self, rate=1000.0, burst_factor=1.0, burst_every=0, burst_length=0):
+        """
+        :param rate: req/sec outside of bursts, 0 sends as fast as possible
+        :param burst_every: sec between burst starts, 0 never bursts
+        """
+        self.rate = rate
+        self.burst_factor = burst_factor
+        self.burst_every = burst_every
+        self.burst_length = min(burst_length, burst_every) if burst_every else 0
+        self._steady = self.rate*(self.burst_every-self.burst_length) #Requests before the burst of a cycle
+        self._cycle = self._steady+self.rate*self.burst_factor*self.burst_length #Requests per cycle
+
+    def rate_at(self, offset):
+        """
+        Return req/sec at offset sec from the start
+        """
+        if self.burst_every and offset % self.burst_every >= self.burst_every-self.burst_length:
+            return self.rate*self.burst_factor
+        return self.rate
+
+    def time_of(self, index):
+        """
+        Return the offset in sec from the start the <index>th request is due at
+        """
+        if not self.rate:
+            return 0.0
+        if not self.burst_every or not self._cycle:
+            return index/self.rate
+        cycles, rest = divmod(index, self._cycle)
+        offset = cycles*self.burst_every
+        if rest < self._steady:
+            return offset+rest/self.rate
+        return offset+self.burst_every-self.burst_length+(rest-self._steady)/(self.rate*self.burst_factor)
+
+class _ServerProtocol(asyncio.Protocol):
+    """
+    Answer every request of a connection with RESPONSE, pipelined requests are answered with one write
+    """
+    def __init__(self, server):
+        self.server = server
+        self.tail = b'' #End of the last read, a request head may span reads
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        data = self.tail+data
+        heads = data.count(b'\r\n\r\n') #Requests are GET heads without body
+        self.tail = data[data.rfind(b'\r\n\r\n')+4:] if heads else data[-3:]
+        if heads:
+            self.server.requests += heads
+            self.transport.write(RESPONSE*heads)
+
+class LocalHttpServer(object):
+    """
+    Minimal keep-alive HTTP server answering any request with 200, served by an event loop in a daemon thread.
+    Stands in for a website at rates no public server tolerates, sniff it with `python exercise.py -i lo -p <port>`.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        :param port: TCP port to listen on, 0 picks a free one, see <port>
+        """
+        self.requests = 0 #Requests answered
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(self._loop.create_server(lambda: _ServerProtocol(self), host, port, reuse_address=True))
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+class _ClientProtocol(asyncio.Protocol):
+    """
+    Keep-alive connection counting responses, wait() resolves once the responses of the last requests arrived
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.received = 0
+        self.expected = 0
+        self.waiter = None
+        self.tail = b'' #End of the last read, a marker may span reads
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        data = self.tail+data
+        self.received += data.count(RESPONSE_MARKER)
+        self.tail = data[-len(RESPONSE_MARKER)+1:]
+        if self.waiter is not None and self.received >= self.expected and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def connection_lost(self, exc):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(ConnectionError('connection closed'))
+
+    def wait(self, count):
+        self.expected += count
+        self.waiter = self.loop.create_future()
+        if self.received >= self.expected:
+            self.waiter.set_result(None)
+        return self.waiter
+
+class TrafficGenerator(object):
+    """
+    Send requests over <concurrency> keep-alive connections paced by a TrafficProfile.
+    Every connection sends <pipeline> requests at once and waits for their responses, request indexes are shared
+    so hosts, sections and User-Agents cycle across connections as in request_bytes().
+    """
+    def __init__(self, host, port, profile, concurrency=64, pipeline=1, hosts=20, paths=200, user_agents=10):
+        self.address = (host, port)
+        self.profile = profile
+        self.concurrency = concurrency
+        self.pipeline = pipeline
+        self.cardinality = (hosts, paths, user_agents)
+        self.sent = 0 #Requests sent
+        self.received = 0 #Responses received
+        self.errors = 0 #Connections lost or refused, reconnected
+        self.elapsed = 0.0 #Sec of the last run
+
+    async def _connection(self, loop, started, deadline, count):
+        protocol = None
+        try:
+            while self.sent < count and loop.time() < deadline:
+                if protocol is None or protocol.transport.is_closing():
+                    try:
+                        _, protocol = await loop.create_connection(lambda: _ClientProtocol(loop), *self.address)
+                    except OSError:
+                        self.errors += 1
+                        await asyncio.sleep(0.1)
+                        continue
+                index = self.sent
+                batch = min(self.pipeline, count-index)
+                self.sent += batch #Claimed before sleeping, connections never send the same index
+                delay = started+self.profile.time_of(index+batch-1)-loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                protocol.transport.write(b''.join(request_bytes(i, *self.cardinality) for i in range(index, index+batch)))
+                try:
+                    await protocol.wait(batch)
+                    self.received += batch
+                except ConnectionError:
+                    self.errors += 1
+                    protocol = None
+        finally:
+            if protocol is not None:
+                protocol.transport.close()
+
+    async def _run(self, loop, duration, count):
+        started = loop.time()
+        await asyncio.gather(*[self._connection(loop, started, started+duration, count) for _ in range(self.concurrency)])
+        self.elapsed = loop.time()-started
+
+    def run(self, duration=10, count=None):
+        """
+        Send requests until duration sec elapsed or count requests were sent, whichever comes first
+
+        :return responses received
+        """
+        received = self.received
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._run(loop, duration, count if count is not None else sys.maxsize))
+        finally:
+            loop.close()
+        return self.received-received
+
+def _checksum(data):
+    """
+    Return the Internet checksum of data as 2 bytes, summed in native byte order which the result is packed back in
+    """
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(array('H', data))
+    while total >> 16:
+        total = (total & 0xffff)+(total >> 16)
+    return struct.pack('=H', ~total & 0xffff)
+
+def _frame(src, dst, sport, dport, seq, ack, payload, ident, flags=0x18):
+    """
+    Return an Ethernet/IPv4/TCP frame carrying payload, with PSH+ACK flags by default
+    """
+    tcp = struct.pack('!HHIIBBH', sport, dport, seq, ack, 5<<4, flags, 65535)
+    pseudo = src+dst+struct.pack('!BBH', 0, socket.IPPROTO_TCP, 20+len(payload))
+    tcp += _checksum(pseudo+tcp+b'\0\0\0\0'+payload)+b'\0\0'
+    ip = struct.pack('!BBHHHBB', 0x45, 0, 20+len(tcp)+len(payload), ident, 0x4000, 64, socket.IPPROTO_TCP)
+    ip += _checksum(ip+b'\0\0'+src+dst)+src+dst
+    return b'\x02\0\0\0\0\x02\x02\0\0\0\0\x01\x08\x00'+ip+tcp+payload
+
+SEGMENTED_RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 1000\r\n\r\n' #Head of a response whose body is sent in its own segment
+SEGMENTED_BODY = b'x'*1000
+
+def _exchange(client, server, sport, port, request, ident, segments):
+    """
+    Return (offset in latencies, frame) of one request/response pair, wrapped in the whole TCP connection with segments:
+    handshake, ACKs, a body segment after the response head and the FIN of the client
+    """
+    if not segments:
+        return [(0, _frame(client, server, sport, port, 1, 1, request, ident)),
+            (1, _frame(server, client, port, sport, 1, 1+len(request), RESPONSE, ident))]
+    sent = 1+len(request) #Next client sequence number once the request is sent
+    received = 1+len(SEGMENTED_RESPONSE)+len(SEGMENTED_BODY)
+    return [
+        (-0.6, _frame(client, server, sport, port, 0, 0, b'', ident, 0x02)), #SYN
+        (-0.4, _frame(server, client, port, sport, 0, 1, b'', ident, 0x12)), #SYN+ACK
+        (-0.2, _frame(client, server, sport, port, 1, 1, b'', ident, 0x10)), #ACK
+        (0, _frame(client, server, sport, port, 1, 1, request, ident)),
+        (0.5, _frame(server, client, port, sport, 1, sent, b'', ident, 0x10)),
+        (1, _frame(server, client, port, sport, 1, sent, SEGMENTED_RESPONSE, ident)),
+        (1.2, _frame(server, client, port, sport, 1+len(SEGMENTED_RESPONSE), sent, SEGMENTED_BODY, ident)),
+        (1.4, _frame(client, server, sport, port, sent, received, b'', ident, 0x10)),
+        (1.6, _frame(client, server, sport, port, sent, received, b'', ident, 0x11)) #FIN+ACK
+    ]
+
+def write_pcap(path, profile, duration=60, count=None, start=1500000000.0, latency=0.0005, port=80, hosts=20, paths=200, user_agents=10, clients=1,
+        append=False, segments=False):
+    """
+    Write the request/response pairs a TrafficGenerator would send with the same profile, as a microsecond libpcap file.
+    Frames are packed directly, orders of magnitude faster than building Scapy packets, so large captures are cheap to regenerate.
+
+    :param duration: sec of traffic, the capture ends earlier when count pairs are written
+    :param start: timestamp of the first request
+    :param latency: sec between a request and its response
+    :param port: server port
+    :param clients: distinct client addresses, 10.0.0.1 and up, the live flood always comes from the loopback address
+    :param append: add packets to an existing capture file written by this function
+    :param segments: wrap each pair in a full TCP exchange, handshake, ACKs, body segment and FIN, as seen on the wire
+    :return number of request/response pairs written
+    """
+    if not profile.rate and count is None:
+        raise ValueError('rate 0 needs a count of requests')
+    server = socket.inet_aton('10.0.0.2')
+    record = struct.Struct('<IIII')
+    written = 0
+    with open(path, 'ab' if append else 'wb') as f:
+        if f.tell() == 0:
+            f.write(b'\xd4\xc3\xb2\xa1'+struct.pack('<HHiIII', 2, 4, 0, 0, 65535, 1)) #Little endian microsecond Ethernet capture
+        while count is None or written < count:
+            offset = profile.time_of(written)
+            if offset >= duration:
+                break
+            request = request_bytes(written, hosts, paths, user_agents)
+            client = struct.pack('!I', 0x0a000001+written % clients)
+            sport = 32768 + written % 28000 #Ephemeral ports, a new connection per pair
+            for delay, frame in _exchange(client, server, sport, port, request, written & 0xffff, segments):
+                microseconds = int(round((start+offset+delay*latency)*1000000))
+                f.write(record.pack(microseconds//1000000, microseconds % 1000000, len(frame), len(frame)))
+                f.write(frame)
+            written += 1
+    return written
+
+def visit(host, frequency):
+    """
+    Hit a website every frequency sec until interrupted
+    """
+    while True:
+        try:
+            requests.get('http://'+host)
+        except requests.exceptions.ConnectionError:
+            print ("network error, retry...")
+            continue
+        print ('http://'+host+'... at '+time.strftime('%H:%M:%S %Y/%m/%d', time.localtime(time.time())))
+        time.sleep(frequency)
+
+if __name__ == '__main__':
+    #Parse out commandline arguments
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="This program Generate HTTP traffic every interval, floods a local HTTP server or writes a synthetic pcap file.",
+    )
+    parser.add_argument("--host", "-i", help="Which host to visit.", default="www.google.com")
+    parser.add_argument("--frequency", "-f", type=int, help="How frequent to visit Host.", default=5)
+    parser.add_argument("--serve", action='store_true', help="Only run the bundled HTTP server on --target until Ctrl+c.")
+    parser.add_argument("--local", action='store_true', help="Run the bundled HTTP server on --target and flood it.")
+    parser.add_argument("--target", "-t", help="host:port of the HTTP server to flood.", default=None)
+    parser.add_argument("--pcap", help="Write a synthetic capture file instead of sending traffic.", default=None)
+    parser.add_argument("--rate", "-r", type=float, help="Requests/sec outside of bursts, 0 is as fast as possible.", default=1000)
+    parser.add_argument("--duration", "-d", type=float, help="Sec of traffic.", default=60)
+    parser.add_argument("--count", "-n", type=int, help="Stop after this number of requests.", default=None)
+    parser.add_argument("--concurrency", "-c", type=int, help="Keep-alive connections of the flood.", default=64)
+    parser.add_argument("--pipeline", type=int, help="Requests sent at once per connection, >1 packs several requests in a TCP segment.", default=1)
+    parser.add_argument("--hosts", type=int, help="Distinct Host headers.", default=20)
+    parser.add_argument("--paths", type=int, help="Distinct sections.", default=200)
+    parser.add_argument("--user-agents", type=int, help="Distinct User-Agent headers.", default=10)
+    parser.add_argument("--clients", type=int, help="Distinct client addresses of the synthetic capture.", default=1)
+    parser.add_argument("--burst-factor", type=float, help="Rate multiplier during bursts.", default=4)
+    parser.add_argument("--burst-every", type=float, help="Sec between burst starts, 0 never bursts.", default=0)
+    parser.add_argument("--burst-length", type=float, help="Sec a burst lasts, at the end of every --burst-every.", default=10)
+    parser.add_argument("--port", "-p", type=int, help="Server port of the synthetic capture.", default=80)
+    args = parser.parse_args()
+
+    profile = TrafficProfile(args.rate, args.burst_factor, args.burst_every, args.burst_length)
+    cardinality = dict(hosts=args.hosts, paths=args.paths, user_agents=args.user_agents)
+    if args.pcap:
+        started = time.time()
+        written = write_pcap(args.pcap, profile, args.duration, args.count, port=args.port, clients=args.clients, **cardinality)
+        print('%d request/response pairs written to %s in %.2fs' % (written, args.pcap, time.time()-started))
+    elif args.serve or args.local or args.target:
+        host, port = parse_address(args.target or '127.0.0.1:8080')
+        server = LocalHttpServer(host, port) if args.serve or args.local else None
+        if server is not None:
+            host, port = server.host, server.port #Port 0 picked a free one
+        try:
+            if args.serve:
+                print('serving http://%s:%d/, Ctrl+c to stop' % (host, port))
+                while True:
+                    time.sleep(1)
+            generator = TrafficGenerator(host, port, profile, args.concurrency, args.pipeline, **cardinality)
+            generator.run(args.duration, args.count)
+            print('sent: %d, received: %d, errors: %d, elapsed: %.2fs, requests/sec: %.0f' % (generator.sent, generator.received,
+                generator.errors, generator.elapsed, generator.received/generator.elapsed if generator.elapsed else 0))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server is not None:
+                server.close()
+    else:
+        visit(args.host, args.frequency)